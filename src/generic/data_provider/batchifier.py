@@ -1,6 +1,6 @@
-import copy
 from enum import Enum
 import collections
+import random
 
 
 class BatchifierSplitMode(Enum):
@@ -22,6 +22,63 @@ class BatchifierSplitMode(Enum):
             assert False, "Invalid question type for batchifier. Was {}".format(s)
 
 
+class SplitGame(object):
+    """
+    Lightweight view on a turn of a game (split_mode 1: the question of the turn, 2: the dialogue up to the turn)
+
+    Questions/answers are read from the parent game and the other attributes (image, objects...) are delegated to it,
+    no copy of the game is made. The view is read-only except user_data.
+    """
+
+    __slots__ = ("game", "turn", "split_mode", "_user_data")
+
+    def __init__(self, game, turn, split_mode):
+        self.game = game
+        self.turn = turn
+        self.split_mode = split_mode
+        self._user_data = None
+
+    def _slice(self, values):
+        if self.split_mode == 1:
+            return [values[self.turn]]
+        return values[:self.turn + 1]
+
+    @property
+    def questions(self):
+        return self._slice(self.game.questions)
+
+    @property
+    def question_ids(self):
+        return self._slice(self.game.question_ids)
+
+    @property
+    def answers(self):
+        return self._slice(self.game.answers)
+
+    @property
+    def is_full_dialogue(self):
+        return self.split_mode == 2 and self.turn + 1 == len(self.game.question_ids)
+
+    @property
+    def user_data(self):
+        if self._user_data is None:
+            self._user_data = {"full_game": self.game}
+        return self._user_data
+
+    @user_data.setter
+    def user_data(self, user_data):
+        self._user_data = user_data
+
+    def __getattr__(self, name):
+        # only called for the attributes of the game (slots may not be set yet while unpickling)
+        if name.startswith("__") or name in SplitGame.__slots__:
+            raise AttributeError(name)
+        return getattr(self.game, name)
+
+    def __str__(self):
+        return "Split game (turn {}) of {}".format(self.turn, self.game)
+
+
 def batchifier_split_helper(games, split_mode):
 
     new_games = []
@@ -31,30 +88,9 @@ def batchifier_split_helper(games, split_mode):
         new_games = games
 
     # One sample = One question
-    elif split_mode == 1:
-        for game in games:
-            for i, q, a in zip(game.question_ids, game.questions, game.answers):
-                new_game = copy.copy(game)  # Beware shallow copy!
-                new_game.questions = [q]
-                new_game.question_ids = [i]
-                new_game.answers = [a]
-                new_game.is_full_dialogue = False
-                new_game.user_data = {"full_game": game}
-
-                new_games.append(new_game)
-
     # One sample = Subset of questions
-    elif split_mode == 2:
-        for game in games:
-            for i in range(len(game.question_ids)):
-                new_game = copy.copy(game)  # Beware shallow copy!
-                new_game.questions = game.questions[:i + 1]
-                new_game.question_ids = game.question_ids[:i + 1]
-                new_game.answers = game.answers[:i + 1]
-                new_game.is_full_dialogue = len(game.question_ids) == len(new_game.question_ids)
-                new_game.user_data = {"full_game": game}
-
-                new_games.append(new_game)
+    elif split_mode in [1, 2]:
+        new_games = [SplitGame(game, turn, split_mode) for game in games for turn in range(len(game.question_ids))]
 
     # elif split_mode == 2:
     #     for game in games:
@@ -76,8 +112,28 @@ class AbstractBatchifier(object):
     def apply(self, games, skip_targets=False):
         pass
 
-    def split(self, games):
+    def filter_dataset(self, dataset):
+        """Filter the games of a (non-streaming) dataset, batchifiers may override it to rely on the dataset indexes"""
+        return self.filter(dataset.get_data())
+
+    def split(self, games, rng=random):
+        """
+        :param rng: random generator (random.Random) of the Iterator, batchifiers must not use the global random module
+        """
         return games
 
     def filter(self, games):
         return games
+
+    def bucket_key(self, game):
+        """Sizes along which apply pads a (split) game, e.g. (no turns, no objects). Used by the Iterator bucketing"""
+        return ()
+
+    def cost_profile(self):
+        """
+        Main cost of apply, used by the Iterator to select its backend (cf. iterator.select_backend)
+         - "light": a few python operations, batches are computed inline (a pool costs more than it saves)
+         - "io": waiting for files (e.g. h5 features), threads are enough
+         - "cpu": python/numpy computations (e.g. tokens, raw images), processes avoid the GIL
+        """
+        return "cpu"
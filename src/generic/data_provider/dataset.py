@@ -1,9 +1,24 @@
 import copy
+import collections
+import numpy as np
+from itertools import chain
 
 
 class AbstractDataset(object):
+
+    is_streaming = False
+
+    # Picklable object that rebuilds the i-th game in other processes (get_game), cf. shared_memory.py
+    game_store = None
+
+    # Secondary indexes: name -> function that returns the key of a game (cf. get_index)
+    index_keys = dict(image_id=lambda game: game.image.id)
+
     def __init__(self, games):
         self.games = games
+        self._loaded_games = games
+        self._indexes = dict()
+        self._indexed_games = games
 
     def get_data(self, indices=list()):
         if len(indices) > 0:
@@ -14,6 +29,120 @@ class AbstractDataset(object):
     def n_examples(self):
         return len(self.games)
 
+    def get_game_store(self):
+        """Return the game store, if any, as long as the list of games was not replaced (e.g. one game per image)"""
+        if self.games is self._loaded_games:
+            return self.game_store
+        return None
+
+    def has_index(self, name):
+        return name in self.index_keys
+
+    def get_index(self, name):
+        """
+        Return the index key -> positions of the games (in the dataset order)
+        Indexes are built on first use and only rebuilt if the list of games is replaced
+
+        :param name: name of the index (cf. index_keys)
+        """
+        if self._indexed_games is not self.games:
+            self._indexes = dict()
+            self._indexed_games = self.games
+
+        if name not in self._indexes:
+            key = self.index_keys[name]
+            index = collections.OrderedDict()
+            for i, game in enumerate(self.games):
+                index.setdefault(key(game), []).append(i)
+            self._indexes[name] = index
+
+        return self._indexes[name]
+
+    def select_positions(self, **criteria):
+        """
+        Return the positions of the games that match all the criteria (in the dataset order)
+
+        :param criteria: index name -> list of accepted keys, e.g. status=["success"]
+        """
+        positions = None
+        for name, keys in criteria.items():
+            index = self.get_index(name)
+            selected = set(chain.from_iterable(index.get(k, []) for k in keys))
+            positions = selected if positions is None else positions & selected
+
+        if positions is None:
+            return list(range(len(self.games)))
+        return sorted(positions)
+
+    def select(self, **criteria):
+        """Return the games that match all the criteria (cf. select_positions)"""
+        return [self.games[i] for i in self.select_positions(**criteria)]
+
+    def find_games(self, name, key):
+        """Return the games with the given key, e.g. find_games("game_id", 42)"""
+        return [self.games[i] for i in self.get_index(name).get(key, [])]
+
+    def one_game_per_image(self, keep_last=False):
+        """Return one game per image (the first one by default)"""
+        i = -1 if keep_last else 0
+        return [self.games[positions[i]] for positions in self.get_index("image_id").values()]
+
+
+class AbstractStreamingDataset(AbstractDataset):
+    """
+    Games are (re)created on the fly at every pass over the dataset: they are never stored in memory.
+    The Iterator consumes them by chunk and shuffle them through a bounded buffer.
+    """
+
+    is_streaming = True
+
+    def __init__(self, no_games=None):
+        super(AbstractStreamingDataset, self).__init__(games=None)
+        self.no_games = no_games
+
+    def get_data(self, indices=list()):
+        assert len(indices) == 0, "Streaming datasets do not support random access"
+        return self.generate_games()
+
+    def generate_games(self):
+        """Return a new iterator over the games of the dataset"""
+        raise NotImplementedError()
+
+    def has_index(self, name):
+        return False
+
+    def n_examples(self):
+        if self.no_games is None:  # Warning: require a full pass over the dataset
+            self.no_games = sum(1 for _ in self.generate_games())
+        return self.no_games
+
+
+class ExpandedView(object):
+    """
+    Read-only list of games created on the fly from (game index, object index) pairs
+    Only the pairs are stored: the expanded games are never kept in memory,
+    every access returns a new game (keep a reference to the game rather than indexing the view twice)
+    """
+
+    def __init__(self, games, samples, create_game):
+        self.games = games
+        self.samples = samples
+        self.create_game = create_game
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        game_index, object_index = self.samples[index]
+        return self.create_game(self.games[game_index], object_index)
+
+    def __iter__(self):
+        for game_index, object_index in self.samples:
+            yield self.create_game(self.games[game_index], object_index)
+
 
 class CropDataset(AbstractDataset):
     """
@@ -21,45 +150,38 @@ class CropDataset(AbstractDataset):
     """
 
     def __init__(self, dataset, expand_objects):
-        old_games = dataset.get_data()
-        new_games = []
+        games = dataset.get_data()
 
-        for g in old_games:
+        # One sample = (game index, object index)
+        samples = []
+        for i, game in enumerate(games):
             if expand_objects:
-                new_games += self.split(g)
+                samples += [(i, j) for j in range(len(game.objects))]
             else:
-                new_games += self.update_ref(g)
+                samples.append((i, game.objects.index(game.object)))
+        samples = np.array(samples, dtype=np.int32).reshape(-1, 2)
 
-        super(CropDataset, self).__init__(new_games)
+        super(CropDataset, self).__init__(ExpandedView(games, samples, self.create_crop_game))
 
     @staticmethod
     def load(dataset_cls, expand_objects, **kwargs):
         return CropDataset(dataset_cls(**kwargs), expand_objects=expand_objects)
 
     @staticmethod
-    def split(game):
-        games = []
-        for obj in game.objects:
-            new_game = copy.copy(game)  # Beware shallow copy!
-
-            # select new object
-            new_game.object = obj
-
-            # Hack the image id to differentiate objects
-            new_game.image = copy.copy(game.image)  # Beware shallow copy!
-            new_game.image.id = obj.id
-
-            games.append(new_game)
-
-        return games
-
-    @staticmethod
-    def update_ref(game):
-
+    def create_crop_game(game, object_index):
         new_game = copy.copy(game)  # Beware shallow copy!
 
+        # select new object
+        new_game.object = game.objects[object_index]
+
         # Hack the image id to differentiate objects
         new_game.image = copy.copy(game.image)  # Beware shallow copy!
-        new_game.image.id = game.object.id
+        new_game.image.id = new_game.object.id
+
+        return new_game
+
+    def split(self, game):
+        return [self.create_crop_game(game, i) for i in range(len(game.objects))]
 
-        return [new_game]
+    def update_ref(self, game):
+        return [self.create_crop_game(game, game.objects.index(game.object))]
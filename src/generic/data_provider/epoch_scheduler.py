@@ -0,0 +1,137 @@
+import random
+import threading
+
+
+# Why an epoch scheduler?
+# A new Iterator is created at every phase of every epoch (train, then valid) and its batches are only computed once it
+# is created: the first seconds of every phase are spent waiting for the data (e.g. the short validation passes).
+# The EpochScheduler creates the iterator of the next phase (valid after train, train of the next epoch after valid)
+# as soon as all the batches of the current one are submitted to the pool: the games are filtered/shuffled and the
+# first batches are prefetched while the last batches of the current phase are still processed by the network.
+# Every (epoch, phase) has its own seed so that the order of the games does not depend on this look-ahead.
+
+
+def get_epoch_seed(seed, epoch, phase):
+    """Deterministic seed of a phase of an epoch (string seeds are hashed by random.Random)"""
+    return "{}-{}-{}".format(seed, epoch, phase)
+
+
+class _Prepared(object):
+    """Iterator created by a background thread"""
+
+    def __init__(self):
+        self.iterator = None
+        self.error = None
+        self.is_cancelled = threading.Event()
+        self.thread = None
+
+
+class EpochScheduler(object):
+    """
+    Create the iterators of the phases of every epoch one step ahead
+
+    :param seed: base seed of the epochs (random if None or negative, as config["seed"])
+    :param no_epoch: no iterator is prepared beyond this epoch
+    :param look_ahead: prepare the next iterator in the background (otherwise iterators are created on request)
+    """
+
+    def __init__(self, seed=None, no_epoch=None, look_ahead=True):
+        self.seed = seed if seed is not None and seed > -1 else random.randrange(1 << 31)
+        self.no_epoch = no_epoch
+        self.look_ahead = look_ahead
+
+        self.phases = []
+        self.create_fcts = dict()
+        self.prepared = dict()  # (epoch, phase) -> _Prepared
+
+    def add_phase(self, phase, create_iterator):
+        """
+        :param phase: name of the phase (phases are run in the order they are added)
+        :param create_iterator: function seed -> Iterator (the seed must be given to the Iterator),
+        it also receives a state argument if a phase is resumed (cf. get)
+        """
+        self.phases.append(phase)
+        self.create_fcts[phase] = create_iterator
+
+    def get_seed(self, epoch, phase):
+        return get_epoch_seed(self.seed, epoch, phase)
+
+    def _next_key(self, epoch, phase):
+        i = self.phases.index(phase) + 1
+        if i < len(self.phases):
+            return epoch, self.phases[i]
+        return epoch + 1, self.phases[0]
+
+    def _create(self, epoch, phase, state=None):
+        if state is not None:
+            return self.create_fcts[phase](self.get_seed(epoch, phase), state=state)
+        return self.create_fcts[phase](self.get_seed(epoch, phase))
+
+    def _prepare(self, key, current_iterator):
+        prepared = _Prepared()
+
+        def run():
+            # Wait until the pool is not fed by the current iterator anymore
+            while not current_iterator.wait_submitted(timeout=0.1):
+                if prepared.is_cancelled.is_set():
+                    return
+            try:
+                prepared.iterator = self._create(*key)
+            except Exception as e:  # raised when the iterator is requested
+                prepared.error = e
+
+        prepared.thread = threading.Thread(target=run)
+        prepared.thread.daemon = True
+        prepared.thread.start()
+
+        self.prepared[key] = prepared
+
+    def _cancel(self, prepared):
+        prepared.is_cancelled.set()
+        prepared.thread.join()
+        if prepared.iterator is not None:
+            prepared.iterator.close()
+
+    def get(self, epoch, phase, state=None):
+        """
+        Return the iterator of the phase of the epoch (and start preparing the next one)
+
+        :param state: resume the phase from Iterator.get_state (the prepared iterator is not used)
+        """
+        key = (epoch, phase)
+
+        prepared = self.prepared.pop(key, None)
+        if prepared is not None and state is not None:
+            self._cancel(prepared)
+            prepared = None
+
+        if prepared is not None:
+            prepared.thread.join()
+            if prepared.error is not None:
+                raise prepared.error
+            iterator = prepared.iterator
+        else:
+            iterator = self._create(epoch, phase, state)
+
+        # The phases were not requested in the expected order (e.g. skipped validation)
+        for other in list(self.prepared.values()):
+            self._cancel(other)
+        self.prepared.clear()
+
+        next_key = self._next_key(epoch, phase)
+        if self.look_ahead and (self.no_epoch is None or next_key[0] < self.no_epoch):
+            self._prepare(next_key, current_iterator=iterator)
+
+        return iterator
+
+    def close(self):
+        """Stop the iterators that were prepared but not requested (e.g. early stopping)"""
+        for prepared in self.prepared.values():
+            self._cancel(prepared)
+        self.prepared.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -39,6 +39,32 @@ def get_spatial_feat(bbox, im_width, im_height):
     return feat
 
 
+def get_spatial_feats(bboxes, im_width, im_height):
+    """
+    Vectorized get_spatial_feat
+
+    :param bboxes: COCO bboxes (x, y, width, height) of n objects
+    :return: (n, 8) spatial features
+    """
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    x, y, width, height = bboxes[:, 0], bboxes[:, 1], bboxes[:, 2], bboxes[:, 3]
+
+    # Same operations as Bbox/get_spatial_feat (y axis is flipped)
+    y_lower = im_height - y - height
+    y_upper = im_height - y
+
+    feat = [(x / im_width) * 2 - 1,
+            (y_lower / im_height) * 2 - 1,
+            ((x + width) / im_width) * 2 - 1,
+            (y_upper / im_height) * 2 - 1,
+            ((x + 0.5 * width) / im_width) * 2 - 1,
+            ((y_lower + 0.5 * height) / im_height) * 2 - 1,
+            (width / im_width) * 2,
+            (height / im_height) * 2]
+
+    return np.stack(feat, axis=1)
+
+
 def scaled_crop_and_pad(bbox, raw_img, scale=1.0):
 
     im_width, im_height = raw_img.size
@@ -1,20 +1,20 @@
+import itertools
 import math
 import random
-from multiprocessing import Semaphore
-
-#Note from author : we put extra documentation as we beleive that this class can be very useful to other developers
+import zlib
+import numpy as np
 
+from generic.data_provider.dataset import AbstractDataset
+from generic.data_provider.prefetcher import Prefetcher, InlineLoader
+from generic.data_provider.shared_memory import SharedBatchBuffer, SharedBatchifier, get_split_rng
+from generic.utils.thread_pool import is_process_pool, has_workers
 
-def sem_iterator(l, sem):
-    """
-    Turn a list into a generator with a hidden semaphote (to limit the number off ongoing iteration)
+try:
+    import queue
+except ImportError:  # python 2.X
+    import Queue as queue
 
-    :param l:  list
-    :param sem: semaphore
-    """
-    for e in l:
-        sem.acquire()
-        yield e
+#Note from author : we put extra documentation as we beleive that this class can be very useful to other developers
 
 
 def split_batch(games, batch_size, use_padding):
@@ -47,77 +47,397 @@ def split_batch(games, batch_size, use_padding):
     return batch
 
 
-class Iterator(object):
-    """Provides an generic multithreaded iterator over the dataset."""
+def bucket_batch(games, batch_size, bucket_key, use_padding, shuffle, max_tokens=None, rng=random):
+    """
+    Split a list of games into batches of games of similar sizes (less padding)
 
-    def __init__(self, dataset, batch_size, batchifier, pool,
-                 shuffle=False, use_padding=False, no_semaphore=20):
+    Games are sorted by bucket key (in random order within a bucket when shuffle is set) and cut into batches,
+    the order of the batches is then shuffled.
 
-        # Filtered games
-        games = dataset.get_data()
-        games = batchifier.filter(games)
-        games = batchifier.split(games)
+    :param games: list of games that is going to be used to create a batch
+    :param batch_size: maximum number of games used by batch
+    :param bucket_key: function that returns the padded sizes of a game, e.g. (no turns, no objects)
+    :param use_padding: pad the incomplete batches with their own games
+    :param shuffle: shuffle the games within the buckets and the order of the batches
+    :param max_tokens: if set, a batch also ends before its padded size (no games x product of max sizes) exceeds it
+    :param rng: random generator (random.Random) used to shuffle
+    :return: a list of list of games
+    """
+    if shuffle:
+        games = list(games)
+        rng.shuffle(games)
 
-        if shuffle:
-            random.shuffle(games)
+    keys = [tuple(bucket_key(game)) for game in games]
+    order = sorted(range(len(games)), key=keys.__getitem__)  # stable sort: shuffled games remain shuffled
 
-        self.batch_size = batch_size
-        self.n_batches = int(math.ceil(1. * len(games) / self.batch_size))
-        if use_padding:
-            self.n_examples = self.n_batches * self.batch_size
+    batches, batch, max_key = [], [], ()
+    for i in order:
+        new_max_key = tuple(max(a, b) for a, b in zip(max_key, keys[i])) if len(batch) > 0 else keys[i]
+
+        is_full = len(batch) == batch_size
+        if max_tokens is not None and not is_full:
+            is_full = len(batch) > 0 and (len(batch) + 1) * int(np.prod(new_max_key)) > max_tokens
+
+        if is_full:
+            batches.append(batch)
+            batch, new_max_key = [], keys[i]
+
+        batch.append(games[i])
+        max_key = new_max_key
+
+    if len(batch) > 0:
+        batches.append(batch)
+
+    if use_padding:
+        batches = [batch + (batch * batch_size)[:batch_size - len(batch)] for batch in batches]
+
+    if shuffle:
+        rng.shuffle(batches)
+
+    return batches
+
+
+def stream_bucket_batch(games, batch_size, bucket_key, use_padding, shuffle, max_tokens, chunk_size, rng=random):
+    """
+    Streaming counterpart of bucket_batch: games are bucketed by chunk of chunk_size games
+
+    :param games: iterator over games
+    """
+    chunk = []
+    for game in games:
+        chunk.append(game)
+        if len(chunk) >= chunk_size:
+            for batch in bucket_batch(chunk, batch_size, bucket_key, use_padding, shuffle, max_tokens, rng):
+                yield batch
+            chunk = []
+
+    for batch in bucket_batch(chunk, batch_size, bucket_key, use_padding, shuffle, max_tokens, rng):
+        yield batch
+
+
+def shuffle_buffer_iterator(games, buffer_size, rng=random):
+    """
+    Approximately shuffle a stream of games with a bounded memory
+
+    :param games: iterator over games
+    :param buffer_size: number of games that are kept in memory to be shuffled
+    :param rng: random generator (random.Random)
+    """
+    buffer = []
+    for game in games:
+        if len(buffer) < buffer_size:
+            buffer.append(game)
         else:
-            self.n_examples = len(games)
+            i = rng.randint(0, buffer_size - 1)
+            yield buffer[i]
+            buffer[i] = game
 
-        batch = split_batch(games, batch_size, use_padding)
+    rng.shuffle(buffer)
+    for game in buffer:
+        yield game
 
-        # no proc
-        # self.it = (batchifier.apply(b) for b in batch)
 
-        # Multi_proc
-        self.semaphores = Semaphore(no_semaphore)
-        it_batch = sem_iterator(l=batch, sem=self.semaphores)
-        self.process_iterator = pool.imap(batchifier.apply, it_batch)
+def stream_games(games, batchifier, chunk_size, rng=random):
+    """
+    Filter/split a stream of games by chunk (the full list of games is never created)
 
-    def __len__(self):
-        return self.n_batches
+    :param games: iterator over games
+    :param batchifier: batchifier used to filter/split the games
+    :param chunk_size: number of games filtered/split at once
+    :param rng: random generator (random.Random) given to batchifier.split
+    """
+    chunk = []
+    for game in games:
+        chunk.append(game)
+        if len(chunk) >= chunk_size:
+            for g in batchifier.split(batchifier.filter(chunk), rng=rng):
+                yield g
+            chunk = []
 
-    def __iter__(self):
-        return self
+    for g in batchifier.split(batchifier.filter(chunk), rng=rng):
+        yield g
 
-    def __next__(self):
-        self.semaphores.release()
-        return self.process_iterator.next()
-        # return self.it.__next__()
 
-    # trick for python 2.X
-    def next(self):
-        return self.__next__()
+def stream_batch(games, batch_size, use_padding):
+    """
+    Streaming counterpart of split_batch: yield a sublist of games of size batch_size
+
+    :param games: iterator over games
+    :param batch_size: number of games used by batch
+    :param use_padding: pad with the first games to fill the last batch
+    """
+    first_batch = None
+    batch = []
+    for game in games:
+        batch.append(game)
+        if len(batch) == batch_size:
+            if first_batch is None:
+                first_batch = batch
+            yield batch
+            batch = []
+
+    if len(batch) > 0:
+        if use_padding and first_batch is not None:
+            batch += first_batch[:batch_size - len(batch)]
+        yield batch
+
+
+def get_fingerprint(games):
+    """crc32 of the (filtered/split) games in their order: dialogue, turn, image and target object of every game"""
+    crc = 0
+    for game in games:
+        image, obj = getattr(game, "image", None), getattr(game, "object", None)
+        key = "{}/{}/{}/{}".format(getattr(game, "dialogue_id", None), getattr(game, "turn", None),
+                                   getattr(image, "id", None), getattr(obj, "id", None))
+        crc = zlib.crc32(key.encode('utf-8'), crc)
+    return crc
+
+
+# Why backends?
+# There used to be two iterators: Iterator (pool + prefetching) for the datasets and BasicIterator (synchronous) for the
+# few games of every looper step. They drifted apart (e.g. BasicIterator shuffled the games after building the batches).
+# The Iterator is now the only pipeline: the games are always filtered/split/batched the same way and only the way
+# the batches are computed (batchifier.apply) changes:
+#  - inline: in the calling thread when a batch is requested (no thread/queue, lowest overhead for tiny batches)
+#  - thread: in a ThreadPool, prefetched (cf. prefetcher.py)
+#  - process: in a process Pool, prefetched, the games are pickled to the workers
+#  - shared_memory: in a process Pool, prefetched, only game indices are sent and batches come back through shared
+#    memory (cf. shared_memory.py)
+# By default (auto), the backend follows the pool and the cost profile of the batchifier (cf. select_backend).
+
+ITERATOR_BACKENDS = ["auto", "inline", "thread", "process", "shared_memory"]
+
+
+def select_backend(backend, dataset, batchifier, pool, use_shared_memory=True):
+    """
+    Return the backend that computes the batches of an Iterator
+
+    :param backend: one of ITERATOR_BACKENDS, "auto": inline without workers or for "light" batchifiers, otherwise
+    the kind of the pool (shared_memory if the dataset can be rebuilt in the workers)
+    :param dataset: dataset or list of games
+    :param batchifier: batchifier of the iterator (cf. AbstractBatchifier.cost_profile)
+    :param pool: multiprocessing Pool/ThreadPool, CpuPool or None
+    """
+    assert backend in ITERATOR_BACKENDS, "Unknown iterator backend: {}".format(backend)
+
+    # Process pools only receive game indices if the dataset can be rebuilt in the workers (cf. shared_memory.py)
+    can_share = isinstance(dataset, AbstractDataset) \
+        and not dataset.is_streaming \
+        and dataset.get_game_store() is not None
 
+    if backend == "auto":
+        if not has_workers(pool) or batchifier.cost_profile() == "light":
+            return "inline"
+        if is_process_pool(pool):
+            return "shared_memory" if use_shared_memory and can_share else "process"
+        return "thread"
 
-# TODO Fuse with Iterator
-class BasicIterator(object):
-    """Provides an generic multithreaded iterator over the dataset."""
+    if backend != "inline":
+        assert has_workers(pool), "The {} backend requires a pool with workers".format(backend)
+        assert is_process_pool(pool) == (backend != "thread"), "The pool does not match the {} backend".format(backend)
+    if backend == "shared_memory":
+        assert can_share, "The shared_memory backend requires a (non streaming) dataset with a game store"
 
-    def __init__(self, games, batch_size, batchifier, shuffle=False, use_padding=False):
+    return backend
 
-        # Filtered games
-        games = batchifier.filter(games)
-        games = batchifier.split(games)
+
+class Iterator(object):
+    """
+    Provides an generic multithreaded iterator over the dataset.
+
+    :param dataset: dataset or list of games (e.g. the games of a looper step)
+    :param backend: how the batches are computed (cf. select_backend)
+    """
+
+    def __init__(self, dataset, batch_size, batchifier, pool=None,
+                 shuffle=False, use_padding=False, prefetch_depth=20, ordered=True, shuffle_buffer=10000,
+                 use_shared_memory=True, slot_bytes=1 << 26, bucketing=False, max_tokens=None, seed=None, state=None,
+                 backend="auto"):
 
         self.batch_size = batch_size
-        self.n_batches = int(math.ceil(1. * len(games) / self.batch_size))
-        if use_padding:
-            self.n_examples = self.n_batches * self.batch_size
+        self.batch_buffer = None
+        self.batch_positions = None
+        self.items = None
+        self.fingerprint = None
+        self.ordered = ordered
+
+        # Resume an epoch from get_state (the other arguments must be the same): earlier batches are skipped
+        self.cursor = 0
+        if state is not None:
+            seed, self.cursor = state["seed"], state["cursor"]
+
+        # The order of the games only depends on the seed if it is set (global random module otherwise)
+        self.seed = seed
+        self.rng = random.Random(seed) if seed is not None else random
+
+        # Group the games of similar sizes (batchifier.bucket_key) to reduce padding
+        self.bucket_key = batchifier.bucket_key if bucketing else None
+        self.max_tokens = max_tokens
+
+        self.backend = select_backend(backend, dataset, batchifier, pool, use_shared_memory)
+
+        if self.backend == "shared_memory":
+            batch = self._split_indices(dataset, batch_size, batchifier, shuffle, use_padding, state)
+        elif getattr(dataset, "is_streaming", False):
+            batch = self._stream(dataset, batch_size, batchifier, shuffle, use_padding, shuffle_buffer)
         else:
-            self.n_examples = len(games)
+            batch = self._split(dataset, batch_size, batchifier, shuffle, use_padding, state)
 
-        batch = split_batch(games, batch_size, use_padding)
+        # no proc
+        if self.backend == "inline":
+            self.loader = InlineLoader(batchifier.apply, batch)
+
+        # Multi_proc: at most prefetch_depth batches are computed in advance (cf. prefetcher.py)
+        # With ordered=False, batches are delivered as soon as they are ready (the order of the batches is not kept)
+        elif self.backend == "shared_memory":
+            # A slot is released when the next batch is returned: there are at most prefetch_depth+1 slots in use
+            # Warning: the numpy arrays of a batch are views on its slot, copy them if they must outlive the next batch
+            self.batch_buffer = SharedBatchBuffer(no_slots=prefetch_depth + 2, slot_bytes=slot_bytes)
+            self.free_slots = queue.Queue()
+            for slot in range(self.batch_buffer.no_slots):
+                self.free_slots.put(slot)
+            self.current_slot = None
+            self.slot_batches = dict()
+
+            shared_batchifier = SharedBatchifier(batchifier, dataset.get_game_store(), self.batch_buffer,
+                                                 split_seed=self.split_seed)
+            self.loader = Prefetcher(pool, shared_batchifier, self._shared_tasks(batch),
+                                     depth=prefetch_depth, ordered=ordered)
+        else:
+            self.loader = Prefetcher(pool, batchifier.apply, batch, depth=prefetch_depth, ordered=ordered)
+
+    def get_prefetch_stats(self):
+        """Data loading counters of the epoch (cf. PrefetchStats)"""
+        return self.loader.get_stats()
+
+    def wait_submitted(self, timeout=None):
+        """Wait until all the batches are submitted to the pool (the pool may then be fed by the next iterator)"""
+        return self.loader.wait_submitted(timeout)
+
+    def close(self):
+        """Stop computing batches (e.g. iterator that is not fully consumed)"""
+        self.loader.close()
+        if self.batch_buffer is not None:
+            self.batch_buffer.close()
+
+    def get_state(self):
+        """
+        Serializable (json) position of the iterator within the epoch: seed, order of the games and number of
+        returned batches (cursor). Iterator(..., state=state) resumes the epoch after the last returned batch.
+        """
+        assert self.ordered, "The position of an unordered iterator cannot be saved"
+
+        state = dict(seed=self.seed, cursor=self.cursor)
+        if self.batch_positions is not None:
+            if self.fingerprint is None:
+                self.fingerprint = get_fingerprint(self.items)
+            state["no_items"] = len(self.items)
+            state["fingerprint"] = self.fingerprint
+            state["batch_sizes"] = [len(b) for b in self.batch_positions]
+            state["permutation"] = [p for b in self.batch_positions for p in b]
+        return state
+
+    def _make_batch_positions(self, items, batch_size, shuffle, use_padding, state):
+        """Split the positions of the (filtered/split) games into batches, or restore the batches of a state"""
+        self.items = items
+
+        if state is not None and "permutation" in state:
+            # The positions of the state are only valid for the same games in the same order (e.g. same targets)
+            self.fingerprint = get_fingerprint(items)
+            assert state["no_items"] == len(items) and state["fingerprint"] == self.fingerprint, \
+                "The games changed since the iterator state was saved"
+            permutation = iter(state["permutation"])
+            return [list(itertools.islice(permutation, size)) for size in state["batch_sizes"]]
+
+        positions = list(range(len(items)))
+
+        if self.bucket_key is not None:
+            return bucket_batch(positions, batch_size, lambda p: self.bucket_key(items[p]),
+                                use_padding, shuffle, self.max_tokens, self.rng)
 
         if shuffle:
-            random.shuffle(games)
+            self.rng.shuffle(positions)  # do not shuffle the dataset itself (its indexes refer to positions)
 
-        # no proc
-        self.it = (batchifier.apply(b) for b in batch)
+        return split_batch(positions, batch_size, use_padding)
+
+    def _split(self, dataset, batch_size, batchifier, shuffle, use_padding, state):
+
+        # Filtered games (a list of games is filtered as is: no dataset index is built)
+        if isinstance(dataset, AbstractDataset):
+            games = batchifier.filter_dataset(dataset)
+        else:
+            games = batchifier.filter(dataset)
+        games = batchifier.split(games, rng=self.rng)
+
+        self.batch_positions = self._make_batch_positions(games, batch_size, shuffle, use_padding, state)
+        self._count_batches(self.batch_positions[self.cursor:])
+
+        return ([games[p] for p in b] for b in self.batch_positions[self.cursor:])
+
+    def _count_batches(self, batch):
+        # Only the remaining batches are counted when an epoch is resumed
+        self.n_batches = len(batch)
+        self.n_examples = sum(len(b) for b in batch)
+
+    def _split_indices(self, dataset, batch_size, batchifier, shuffle, use_padding, state):
+
+        # Games are filtered/split in the main process but only their indices are sent to the workers
+        games = dataset.get_data()
+        game_indices = {id(game): i for i, game in enumerate(games)}
+
+        # Games are split one by one, in the workers as well: every game has its own rng (cf. get_split_rng)
+        self.split_seed = self.seed if self.seed is not None else random.getrandbits(64)
+
+        self.records, self.split_games = [], []
+        for game in batchifier.filter_dataset(dataset):
+            game_index = game_indices[id(game)]
+            split_rng = get_split_rng(self.split_seed, game_index)
+            for split_index, split_game in enumerate(batchifier.split([game], rng=split_rng)):
+                self.records.append((game_index, split_index))
+                self.split_games.append(split_game)
+
+        self.batch_positions = self._make_batch_positions(self.split_games, batch_size, shuffle, use_padding, state)
+        self._count_batches(self.batch_positions[self.cursor:])
+
+        return self.batch_positions
+
+    def _shared_tasks(self, batch_positions):
+        # A slot is only used by one batch at a time: it identifies the batch (to retrieve its raw games)
+        for i in range(self.cursor, len(batch_positions)):
+            b = batch_positions[i]
+            slot = self.free_slots.get()
+            self.slot_batches[slot] = i
+            yield slot, [self.records[p] for p in b]
+
+    def _stream(self, dataset, batch_size, batchifier, shuffle, use_padding, shuffle_buffer):
+
+        # The games are streamed again when an epoch is resumed: its order must only depend on the seed
+        assert self.cursor == 0 or self.seed is not None or not shuffle, "Streamed epochs require a seed to be resumed"
+
+        # The number of batches is an upper bound as games may still be filtered/split
+        self.n_batches = int(math.ceil(1. * dataset.n_examples() / self.batch_size)) - self.cursor
+
+        # n_examples is updated while the games are streamed: it is only exact once the iterator is consumed
+        self.n_examples = 0
+
+        games = stream_games(dataset.get_data(), batchifier, chunk_size=max(shuffle_buffer, batch_size), rng=self.rng)
+        if shuffle:
+            games = shuffle_buffer_iterator(games, buffer_size=shuffle_buffer, rng=self.rng)
+
+        if self.bucket_key is not None:
+            # Incomplete batches may occur at every chunk
+            batch = stream_bucket_batch(games, batch_size, self.bucket_key, use_padding, shuffle,
+                                        self.max_tokens, chunk_size=max(shuffle_buffer, batch_size), rng=self.rng)
+        else:
+            batch = stream_batch(games, batch_size, use_padding)
+
+        # The batches before the cursor are built (without the batchifier) but skipped
+        return self._count_examples(itertools.islice(batch, self.cursor, None))
+
+    def _count_examples(self, batch):
+        for b in batch:
+            self.n_examples += len(b)
+            yield b
 
     def __len__(self):
         return self.n_batches
@@ -126,8 +446,62 @@ class BasicIterator(object):
         return self
 
     def __next__(self):
-        return self.it.__next__()
+        if self.batch_buffer is None:
+            _, batch = self.loader.next_with_task()
+            self.cursor += 1
+            return batch
+
+        try:
+            (slot, _), batch = self.loader.next_with_task()
+        except StopIteration:
+            self.batch_buffer.close()
+            raise
+
+        # The previous batch is not used anymore: its slot can be overwritten
+        if self.current_slot is not None:
+            self.free_slots.put(self.current_slot)
+        self.current_slot = slot
+
+        batch = self.batch_buffer.read(batch)
+        batch["raw"] = [self.split_games[p] for p in self.batch_positions[self.slot_batches[slot]]]
+        self.cursor += 1
+
+        return batch
 
     # trick for python 2.X
     def next(self):
         return self.__next__()
+
+
+class PeriodicCheckpoint(object):
+    """
+    Call save(iterator.get_state()) every no_batches batches of an Iterator (the other attributes are delegated)
+
+    A batch is only counted once it is processed, i.e. when the next batch is requested: the saved state never skips
+    a batch that was not used. No state is saved after the last batch (the epoch is over).
+    """
+
+    def __init__(self, iterator, no_batches, save):
+        assert no_batches > 0, "Checkpoint period must be positive"
+        self.iterator = iterator
+        self.no_batches = no_batches
+        self.save = save
+
+    def __len__(self):
+        return len(self.iterator)
+
+    def __iter__(self):
+        no_epoch_batches = None
+        if self.iterator.batch_positions is not None:
+            no_epoch_batches = len(self.iterator.batch_positions)
+
+        for batch in self.iterator:
+            yield batch
+            cursor = self.iterator.cursor
+            if cursor % self.no_batches == 0 and cursor != no_epoch_batches:
+                self.save(self.iterator.get_state())
+
+    def __getattr__(self, name):
+        if name == "iterator":  # not set yet (e.g. copy)
+            raise AttributeError(name)
+        return getattr(self.iterator, name)
@@ -1,7 +1,15 @@
+import json
+import os
+import shutil
+import threading
 import numpy as np
 from generic.utils.file_handlers import pickle_loader
 
 
+def glove_key(word):
+    return word.lower().replace("\'s", "")
+
+
 class GloveEmbeddings(object):
 
     def __init__(self, file, glove_dim=300):
@@ -11,7 +19,7 @@ class GloveEmbeddings(object):
     def get_embeddings(self, tokens):
         vectors = []
         for token in tokens:
-            token = token.lower().replace("\'s", "")
+            token = glove_key(token)
             if token in self.glove:
                 vectors.append(np.array(self.glove[token]))
             else:
@@ -19,63 +27,293 @@ class GloveEmbeddings(object):
         return vectors
 
 
-def padder(list_of_tokens, seq_length=None, padding_symbol=0, max_seq_length=0):
+# Why a glove matrix?
+# GloveEmbeddings unpickles the whole glove dictionary (millions of words) in every process and looks words up one by
+# one, so the batchifier has to decode the tokens back to words first. The GloveMatrix only keeps the vectors of the
+# words of the dictionary, stored as a contiguous float32 matrix whose rows are the token ids of the tokenizer
+# (cf. guesswhat/preprocess_data/create_glove_matrix.py). It is memory-mapped (shared by all the workers) and padded
+# token matrices are looked up at once: (batch, max_seq_length) -> (batch, max_seq_length, glove_dim).
+# Padding and unknown words are mapped to zero vectors (as GloveEmbeddings).
+
+GLOVE_MATRIX_VERSION = 1
+
+glove_matrix_meta_filename = "meta.json"
+
+
+class GloveMatrix(object):
+    """Memory-mapped glove vectors of the dictionary words (indexed by token id)"""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+        with open(os.path.join(store_dir, glove_matrix_meta_filename), 'r') as f:
+            self.meta = json.load(f)
+
+        with open(os.path.join(store_dir, "vocabulary.json"), 'r') as f:
+            self.i2word = json.load(f)
+        self.word2i = {w: i for i, w in enumerate(self.i2word)}
+
+        self.matrix = np.load(os.path.join(store_dir, "embeddings.npy"), mmap_mode='r')
+        self.glove_dim = self.matrix.shape[1]
+
+    # Only send the path to other processes (memmap would be fully copied otherwise)
+    def __getstate__(self):
+        return self.store_dir
+
+    def __setstate__(self, store_dir):
+        self.__init__(store_dir)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def check_vocabulary(self, tokenizer):
+        """Ensure that the rows of the matrix are the token ids of tokenizer (e.g. the dictionary was not updated)"""
+        i2word = [tokenizer.i2word[i] for i in range(tokenizer.no_words)]
+        assert i2word == self.i2word, \
+            "Glove matrix {} is not aligned with the dictionary (rebuild it with create_glove_matrix.py)".format(self.store_dir)
+
+    def lookup(self, tokens):
+        """
+        Return the glove vectors of (padded) token ids
+
+        :param tokens: int array of any shape, e.g. (batch, max_seq_length)
+        :return: float32 array of shape tokens.shape + (glove_dim,)
+        """
+        return self.matrix[np.asarray(tokens)]
+
+    def get_embeddings(self, words):
+        """Same interface as GloveEmbeddings (words out of the dictionary are mapped to zeros)"""
+        return list(self.lookup([self.word2i.get(w, 0) for w in words]))
+
+    @staticmethod
+    def build(glove, tokenizer, store_dir, glove_dim=300):
+        """
+        Extract the glove vectors of the dictionary words
+
+        :param glove: dict word -> vector (e.g. GloveEmbeddings.glove)
+        :param tokenizer: GWTokenizer, row i of the matrix is the vector of the token i
+        :param store_dir: where to store the matrix
+        :return: number of words found in glove
+        """
+        i2word = [tokenizer.i2word[i] for i in range(tokenizer.no_words)]
+
+        matrix = np.zeros((len(i2word), glove_dim), dtype=np.float32)
+        no_found = 0
+        for i, word in enumerate(i2word):
+            if i == tokenizer.padding_token:
+                continue
+            vector = glove.get(glove_key(word), None)
+            if vector is not None:
+                matrix[i] = vector
+                no_found += 1
+
+        tmp_dir = store_dir + ".tmp{}".format(os.getpid())
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        np.save(os.path.join(tmp_dir, "embeddings.npy"), matrix)
+        with open(os.path.join(tmp_dir, "vocabulary.json"), 'w') as f:
+            json.dump(i2word, f)
+        with open(os.path.join(tmp_dir, glove_matrix_meta_filename), 'w') as f:
+            json.dump(dict(version=GLOVE_MATRIX_VERSION, no_words=len(i2word), glove_dim=glove_dim, no_found=no_found), f)
+
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)
+        os.rename(tmp_dir, store_dir)
+
+        return no_found
+
+
+def load_glove(path, tokenizer=None):
+    """Load a GloveMatrix directory (memory-mapped) or a glove pickle (GloveEmbeddings)"""
+    if os.path.isdir(path):
+        glove = GloveMatrix(path)
+        if tokenizer is not None:
+            glove.check_vocabulary(tokenizer)
+        return glove
+    return GloveEmbeddings(path)
+
+
+# Why a padding pool?
+# Batchifiers pad many small arrays at every batch (per game, then per batch). Arrays have explicit dtypes
+# (int32 tokens, float32 features) and ragged inputs are copied in a single pass. With reuse=True, the arrays are
+# views on per-thread buffers (keyed by dtype and power-of-two size bucket) that are overwritten by the next call of
+# the same thread for the same bucket: they must be consumed (or copied) before, e.g. intermediate results.
+
+
+class PaddingBufferPool(object):
+    """Per-thread (and thus per-worker) buffers used by the padders"""
+
+    def __init__(self, min_size=64):
+        self.min_size = min_size
+        self.local = threading.local()
+
+    def get(self, shape, dtype, fill_value):
+        buffers = getattr(self.local, "buffers", None)
+        if buffers is None:
+            buffers = self.local.buffers = dict()
+
+        size = int(np.prod(shape))
+        bucket = max(self.min_size, 1 << (size - 1).bit_length())
+        key = (np.dtype(dtype).str, bucket)
+
+        buffer = buffers.get(key, None)
+        if buffer is None:
+            buffer = buffers[key] = np.empty(bucket, dtype=dtype)
+
+        array = buffer[:size].reshape(shape)
+        array.fill(fill_value)
+        return array
+
+    def clear(self):
+        self.local.buffers = dict()
+
+
+padding_pool = PaddingBufferPool()
+
+
+def allocate(shape, dtype, fill_value=0, reuse=False):
+    if reuse:
+        return padding_pool.get(shape, dtype, fill_value)
+    return np.full(shape, fill_value=fill_value, dtype=dtype)
+
+
+def padder(list_of_tokens, seq_length=None, padding_symbol=0, max_seq_length=0, dtype=np.int32, reuse=False):
 
     if seq_length is None:
         seq_length = np.array([len(q) for q in list_of_tokens], dtype=np.int32)
 
     if max_seq_length == 0:
-        max_seq_length = seq_length.max()
+        max_seq_length = seq_length.max() if len(seq_length) > 0 else 0
 
     batch_size = len(list_of_tokens)
 
-    padded_tokens = np.full(shape=(batch_size, max_seq_length), fill_value=padding_symbol)
+    padded_tokens = allocate((batch_size, max_seq_length), dtype=dtype, fill_value=padding_symbol, reuse=reuse)
 
-    for i, seq in enumerate(list_of_tokens):
-        seq = seq[:max_seq_length]
-        padded_tokens[i, :len(seq)] = seq
+    # Single pass fill: the truncated sequences are flattened and scattered with a mask
+    lengths = np.minimum(seq_length, max_seq_length)
+    mask = np.arange(max_seq_length) < lengths[:, None]
+    padded_tokens[mask] = np.fromiter((t for seq, l in zip(list_of_tokens, lengths) for t in seq[:l]),
+                                      dtype=dtype, count=lengths.sum())
 
     return padded_tokens, seq_length, max_seq_length
 
 
-def padder_3d(list_of_tokens, max_seq_length=0, feature_size=0):
+def padder_3d(list_of_tokens, max_seq_length=0, feature_size=0, dtype=np.float32, reuse=False):
     seq_length = np.array([len(q) for q in list_of_tokens], dtype=np.int32)
-    # print('seq_l', seq_length)
 
     if max_seq_length == 0:
         max_seq_length = seq_length.max()
 
     batch_size = len(list_of_tokens)
     if feature_size == 0:
-        feature_size = list_of_tokens[0][0].shape[0]
+        feature_size = next(len(seq[0]) for seq in list_of_tokens if len(seq) > 0)
 
-    padded_tokens = np.zeros(shape=(batch_size, max_seq_length, feature_size))
+    padded_tokens = allocate((batch_size, max_seq_length, feature_size), dtype=dtype, reuse=reuse)
 
     for i, seq in enumerate(list_of_tokens):
         seq = seq[:max_seq_length]
-        padded_tokens[i, :len(seq), :] = seq
+        if len(seq) > 0:
+            padded_tokens[i, :len(seq), :] = seq
 
     return padded_tokens, max_seq_length
 
 
-def mask_generate(lengths, feature_size=0):
-    seq_length = np.array([q.max() for q in lengths], dtype=np.int32)
-    turn_length = np.array([q.shape[0] for q in lengths], dtype=np.int32)
+def padder_stack(list_of_arrays, padding_symbol=0, dtype=None, reuse=False):
+    """
+    Stack arrays of different lengths (first dimension) with a single concatenate, e.g. per-game object features
 
-    if feature_size == 0:
-        feature_size = seq_length.max()
+    :return: padded arrays (batch x max_length x ...), int32 lengths
+    """
+    seq_length = np.array([len(a) for a in list_of_arrays], dtype=np.int32)
+    max_seq_length = seq_length.max() if len(seq_length) > 0 else 0
+
+    values = np.concatenate(list_of_arrays) if len(list_of_arrays) > 0 else np.zeros(0)
+    dtype = values.dtype if dtype is None else dtype
+
+    padded = allocate((len(list_of_arrays), max_seq_length) + values.shape[1:], dtype=dtype, fill_value=padding_symbol,
+                      reuse=reuse)
+    padded[np.arange(max_seq_length) < seq_length[:, None]] = values
+
+    return padded, seq_length
+
+
+def padder_ragged_3d(list_of_list_of_tokens, max_seq_length=0, padding_symbol=0, length_padding_symbol=0,
+                     dtype=np.int32, reuse=False):
+    """
+    Pad a batch of lists of sequences (e.g. the questions of every dialogue) in a single pass
 
-    B = len(lengths)
-    max_seq_length = turn_length.max()
+    :param max_seq_length: the sequences are truncated (0: length of the longest sequence)
+    :return: padded sequences (batch x max_turn x max_seq_length),
+             int32 sequence lengths before truncation (batch x max_turn, padded with length_padding_symbol),
+             int32 number of sequences (batch)
+    """
+    no_turns = np.array([len(seqs) for seqs in list_of_list_of_tokens], dtype=np.int32)
+    max_turn = no_turns.max() if len(no_turns) > 0 else 0
+    batch_size = len(list_of_list_of_tokens)
 
-    padding_mask = np.zeros(shape=(B, max_seq_length, feature_size), dtype=np.float32)
+    is_turn = np.arange(max_turn) < no_turns[:, None]
+    seq_length = np.full((batch_size, max_turn), fill_value=length_padding_symbol, dtype=np.int32)
+    seq_length[is_turn] = np.fromiter((len(seq) for seqs in list_of_list_of_tokens for seq in seqs),
+                                      dtype=np.int32, count=no_turns.sum())
 
-    for i, (end_of_question, r) in enumerate(zip(lengths, [1] * B)):
-        for j in range(max_seq_length):
-            idx = end_of_question[j]
-            padding_mask[i, j, :idx] = r  # gamma = 1
+    if max_seq_length == 0:
+        max_seq_length = seq_length[is_turn].max() if no_turns.sum() > 0 else 0
+
+    padded_tokens = allocate((batch_size, max_turn, max_seq_length), dtype=dtype, fill_value=padding_symbol,
+                             reuse=reuse)
+
+    lengths = np.where(is_turn, np.minimum(seq_length, max_seq_length), 0)
+    mask = np.arange(max_seq_length) < lengths[:, :, None]
+    padded_tokens[mask] = np.fromiter((t for seqs, seq_lengths in zip(list_of_list_of_tokens, lengths)
+                                       for seq, l in zip(seqs, seq_lengths) for t in seq[:l]),
+                                      dtype=dtype, count=lengths.sum())
+
+    return padded_tokens, seq_length, no_turns
+
+
+def padder_turns(padded_tokens, seq_length, no_turns, max_seq_length=0, padding_symbol=0, length_padding_symbol=0):
+    """
+    Split the padded sequences of all the turns of a batch (e.g. tokenizer.encode_batch over the flattened dialogues)
+    by dialogue, with the same output as padder_ragged_3d
+
+    :param padded_tokens: padded sequences of every turn (total no turns x seq length)
+    :param seq_length: sequence lengths before truncation (total no turns)
+    :param no_turns: number of turns of every dialogue (batch)
+    :param max_seq_length: the sequences are truncated (0: keep the width of padded_tokens)
+    """
+    no_turns = np.asarray(no_turns, dtype=np.int32)
+    max_turn = no_turns.max() if len(no_turns) > 0 else 0
+    batch_size = len(no_turns)
+
+    if max_seq_length == 0:
+        max_seq_length = padded_tokens.shape[1]
+    width = min(max_seq_length, padded_tokens.shape[1])
+
+    is_turn = np.arange(max_turn) < no_turns[:, None]
+    tokens = np.full((batch_size, max_turn, max_seq_length), fill_value=padding_symbol, dtype=padded_tokens.dtype)
+    tokens[is_turn, :width] = padded_tokens[:, :width]
+
+    lengths = np.full((batch_size, max_turn), fill_value=length_padding_symbol, dtype=np.int32)
+    lengths[is_turn] = seq_length
+
+    return tokens, lengths, no_turns
+
+
+def mask_generate(lengths, feature_size=0, dtype=np.float32):
+    """
+    Mask of the first lengths[i, j] steps of every turn: mask[i, j, k] = k < lengths[i, j]
+
+    A negative length masks all the steps but the last -length ones (as the slice [:length])
+    """
+    lengths = np.asarray(lengths)
+
+    if feature_size == 0:
+        feature_size = lengths.max()
 
-    return padding_mask
+    ends = np.where(lengths < 0, np.maximum(lengths + feature_size, 0), lengths)
+    return (np.arange(feature_size) < ends[:, :, None]).astype(dtype)
 
 
 class DummyTokenizer(object):
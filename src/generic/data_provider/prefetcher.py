@@ -0,0 +1,264 @@
+import threading
+import time
+
+from generic.utils.thread_pool import get_no_workers
+
+try:
+    import queue
+except ImportError:  # python 2.X
+    import Queue as queue
+
+
+# Why a prefetcher?
+# The Iterator used to throttle pool.imap with a semaphore released in __next__: the number of batches prepared in
+# advance was hidden and there was no way to know whether the training loop was waiting for the data.
+# The Prefetcher submits the tasks from a feeder thread, at most `depth` batches are submitted and not consumed yet
+# (backpressure), and batches are delivered in the task order (ordered) or as soon as they are ready (unordered).
+# It counts how long the consumer waits, how long the workers are busy and how many batches are ready when a batch is
+# requested: no waiting and a full queue means that fewer workers are enough, a long wait and an empty queue means
+# that the data pipeline is the bottleneck (more workers, or a cheaper batchifier).
+
+_END = object()
+
+
+class TimedTask(object):
+    """Worker-side wrapper that measures the duration of a task (exceptions are sent back to the consumer)"""
+
+    def __init__(self, fct):
+        self.fct = fct
+
+    def __call__(self, task):
+        start = time.time()
+        try:
+            result = self.fct(task)
+            return time.time() - start, result, None
+        except Exception as e:
+            return time.time() - start, None, e
+
+
+class PrefetchStats(object):
+    """
+    Counters of a Prefetcher (an Iterator is created at every epoch: counters are per epoch)
+     - wait_time: time spent by the consumer waiting for a batch
+     - busy_time: time spent by the workers to compute the batches
+     - mean_ready: average number of ready batches when the consumer requests one (out of depth)
+    """
+
+    def __init__(self, depth, no_workers):
+        self.depth = depth
+        self.no_workers = no_workers
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.start_time = time.time()
+        self.no_batches = 0
+        self.no_empty = 0
+        self.wait_time = 0.
+        self.busy_time = 0.
+        self.ready_sum = 0
+
+    def add_busy(self, duration):
+        with self.lock:  # updated by the callback thread of the pool
+            self.busy_time += duration
+
+    def add_get(self, no_ready, wait_time):
+        self.no_batches += 1
+        self.no_empty += int(no_ready == 0)
+        self.ready_sum += no_ready
+        self.wait_time += wait_time
+
+    def get_stats(self):
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        no_batches = max(self.no_batches, 1)
+        return dict(no_batches=self.no_batches,
+                    elapsed=elapsed,
+                    wait_time=self.wait_time,
+                    wait_ratio=self.wait_time / elapsed,
+                    busy_time=self.busy_time,
+                    worker_usage=self.busy_time / (elapsed * max(self.no_workers, 1)),
+                    mean_ready=1. * self.ready_sum / no_batches,
+                    empty_ratio=1. * self.no_empty / no_batches,
+                    depth=self.depth,
+                    no_workers=self.no_workers)
+
+
+def format_prefetch_stats(stats):
+    """One line summary of PrefetchStats.get_stats (or Evaluator.get_data_stats)"""
+    if "no_batches" not in stats:
+        return "n/a"
+    msg = "{no_batches} batches in {elapsed:.1f}s - waiting for data {wait_time:.1f}s ({wait_ratio:.0%}) - " \
+          "workers busy {worker_usage:.0%} ({no_workers} workers) - " \
+          "ready batches {mean_ready:.1f}/{depth} (empty {empty_ratio:.0%})".format(**stats)
+    if "run_time" in stats:
+        msg += " - network {run_time:.1f}s".format(**stats)
+    return msg
+
+
+class Prefetcher(object):
+    """
+    Compute fct(task) for every task in a pool with a bounded number of batches in advance
+
+    :param pool: multiprocessing Pool/ThreadPool or CpuPool (None: the tasks are computed by the feeder thread)
+    :param fct: picklable function applied to the tasks
+    :param tasks: iterable of tasks, it is consumed by the feeder thread
+    :param depth: max number of tasks submitted and not consumed yet
+    :param ordered: deliver the results in the order of the tasks, otherwise as soon as they are ready
+    """
+
+    def __init__(self, pool, fct, tasks, depth=20, ordered=True):
+        assert depth > 0, "Prefetch depth must be positive"
+
+        self.pool = pool
+        self.fct = TimedTask(fct)
+        self.depth = depth
+        self.ordered = ordered
+
+        self.stats = PrefetchStats(depth, no_workers=get_no_workers(pool))
+
+        self.slots = threading.Semaphore(depth)
+        self.results = queue.Queue()  # (index, task, (duration, result, error)), filled by the pool callbacks
+
+        self.reorder = dict()  # ordered mode: results received before their turn
+        self.next_index = 0
+        self.no_tasks = None  # known once the feeder is done
+        self.is_closed = False
+        self.is_submitted = threading.Event()  # all the tasks are submitted (or the prefetcher is closed)
+
+        self.feeder = threading.Thread(target=self._feed, args=(tasks,))
+        self.feeder.daemon = True
+        self.feeder.start()
+
+    def _feed(self, tasks):
+        index = 0
+        try:
+            it = iter(tasks)
+            while True:
+                self.slots.acquire()
+                if self.is_closed:
+                    break
+                try:
+                    task = next(it)
+                except StopIteration:
+                    break
+
+                if self.pool is None:
+                    self._on_result(index, task, self.fct(task))
+                else:
+                    # Errors raised outside of fct (e.g. task or result that cannot be pickled) only reach the
+                    # error_callback: they are sent to the consumer, which would otherwise wait forever
+                    self.pool.apply_async(self.fct, (task,),
+                                          callback=lambda res, index=index, task=task: self._on_result(index, task, res),
+                                          error_callback=lambda e, index=index: self._on_result(index, None, (0., None, e)))
+                index += 1
+        except Exception as e:  # e.g. error while reading the games
+            self.results.put((index, None, (0., None, e)))
+            index += 1
+
+        self.results.put((_END, index, None))
+        self.is_submitted.set()
+
+    def _on_result(self, index, task, res):
+        self.stats.add_busy(res[0])
+        self.results.put((index, task, res))
+
+    def _no_ready(self):
+        return self.results.qsize() + len(self.reorder)
+
+    def next_with_task(self):
+        """Return the next (task, result)"""
+        no_ready = self._no_ready()
+        start = time.time()
+
+        while True:
+            if self.ordered and self.next_index in self.reorder:
+                task, res = self.reorder.pop(self.next_index)
+                break
+
+            if self.no_tasks is not None and self.next_index >= self.no_tasks:
+                raise StopIteration
+
+            index, task, res = self.results.get()
+            if index is _END:
+                self.no_tasks = task
+            elif self.ordered and index != self.next_index:
+                self.reorder[index] = (task, res)
+            else:
+                break
+
+        self.stats.add_get(no_ready, time.time() - start)
+        self.next_index += 1
+        self.slots.release()
+
+        _, result, error = res
+        if error is not None:
+            self.close()
+            raise error
+
+        return task, result
+
+    def get_stats(self):
+        return self.stats.get_stats()
+
+    def wait_submitted(self, timeout=None):
+        return self.is_submitted.wait(timeout)
+
+    def close(self):
+        """Stop submitting tasks (the feeder may be blocked by the backpressure)"""
+        self.is_closed = True
+        self.slots.release()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.next_with_task()[1]
+
+    # trick for python 2.X
+    def next(self):
+        return self.__next__()
+
+
+class InlineLoader(object):
+    """
+    Compute fct(task) in the calling thread when a batch is requested (same interface as Prefetcher)
+
+    There is no thread, no queue and no batch computed in advance: the consumer waits for every batch.
+    It is meant for cheap batches (e.g. the few games of a looper step) for which a pool costs more than it saves.
+    """
+
+    def __init__(self, fct, tasks):
+        self.fct = fct
+        self.tasks = iter(tasks)
+        self.stats = PrefetchStats(depth=0, no_workers=1)
+
+    def next_with_task(self):
+        task = next(self.tasks)
+
+        start = time.time()
+        result = self.fct(task)
+        duration = time.time() - start
+
+        self.stats.busy_time += duration  # no lock: single thread
+        self.stats.add_get(0, duration)
+
+        return task, result
+
+    def get_stats(self):
+        return self.stats.get_stats()
+
+    def wait_submitted(self, timeout=None):
+        return True  # no task is computed in advance
+
+    def close(self):
+        self.tasks = iter(())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.next_with_task()[1]
+
+    # trick for python 2.X
+    def next(self):
+        return self.__next__()
@@ -0,0 +1,192 @@
+import html.entities
+import re
+
+
+# Why a regex tokenizer?
+# nltk.TweetTokenizer is slow to import (the whole nltk package is loaded) and slow to call (third-party regex module,
+# timeout checks...) while it is used for every question of every batch.
+# The RegexTokenizer reproduces the TweetTokenizer rules (preserve_case=False, reduce_len=False, strip_handles=False)
+# with precompiled patterns of the standard re module.
+# Both tokenizers can be compared with guesswhat/benchmark/benchmark_tokenizer.py
+
+# The patterns below are taken from nltk.tokenize.casual (Apache License 2.0)
+
+EMOTICONS = r"""
+    (?:
+      [<>]?
+      [:;=8]                     # eyes
+      [\-o\*\']?                 # optional nose
+      [\)\]\(\[dDpP/\:\}\{@\|\\] # mouth
+      |
+      [\)\]\(\[dDpP/\:\}\{@\|\\] # mouth
+      [\-o\*\']?                 # optional nose
+      [:;=8]                     # eyes
+      [<>]?
+      |
+      </?3                       # heart
+    )"""
+
+URLS = r"""
+  (?:
+  https?:
+    (?:
+      /{1,3}
+      |
+      [a-z0-9%]
+    )
+    |
+    [a-z0-9.\-]{1,255}[.]
+    (?:[a-z]{2,13})
+    /
+  )
+  (?:
+    [^\s()<>{}\[\]]+
+    |
+    \([^\s()]{0,255}?\([^\s()]{1,255}\)[^\s()]{0,255}?\)
+    |
+    \([^\s]{1,255}?\)
+  )+
+  (?:
+    \([^\s()]{0,255}?\([^\s()]{1,255}\)[^\s()]{0,255}?\)
+    |
+    \([^\s]{1,255}?\)
+    |
+    [^\s`!()\[\]{};:'".,<>?«»“”‘’]
+  )
+  |
+  (?:
+    (?<!@)
+    [a-z0-9]+
+    (?:[.\-][a-z0-9]+){0,126}
+    [.]
+    (?:[a-z]{2,13})
+    \b
+    /?
+    (?!@)
+  )
+"""
+
+FLAGS = r"""
+  (?:
+    [\U0001F1E6-\U0001F1FF]{2}
+    |
+    \U0001F3F4\U000E0067\U000E0062\U000E0065\U000E006e\U000E0067\U000E007F
+    |
+    \U0001F3F4\U000E0067\U000E0062\U000E0073\U000E0063\U000E0074\U000E007F
+    |
+    \U0001F3F4\U000E0067\U000E0062\U000E0077\U000E006C\U000E0073\U000E007F
+  )
+"""
+
+PHONE_REGEX = r"""
+    (?:
+      (?:
+        \+?[01]
+        [ *\-.\)]*
+      )?
+      (?:
+        [\(]?
+        \d{3}
+        [ *\-.\)]*
+      )?
+      \d{3}
+      [ *\-.\)]*
+      \d{4}
+    )"""
+
+REGEXPS = (
+    URLS,
+    PHONE_REGEX,
+    EMOTICONS,
+    r"""<[^>\s]+>""",  # HTML tags
+    r"""[\-]+>|<[\-]+""",  # ASCII Arrows
+    r"""(?:@[\w_]+)""",  # Twitter username
+    r"""(?:\#+[\w_]+[\w\'_\-]*[\w_]+)""",  # Twitter hashtags
+    r"""[\w.+-]{1,64}@[\w-]{1,63}\.(?:[\w-]\.?){1,251}[\w-]""",  # email addresses
+    r""".(?:
+        [\U0001f3fb-\U0001f3ff]?(?:\u200d.[\U0001f3fb-\U0001f3ff]?)+
+        |
+        [\U0001f3fb-\U0001f3ff]
+    )""",  # Zero-Width-Joiner and Skin tone modifier emojis
+    FLAGS,
+    r"""
+    (?:[^\W\d_](?:[^\W\d_]|['\-_])+[^\W\d_]) # Words with apostrophes or dashes.
+    |
+    (?:[+\-]?\d+[,/.:-]\d+[+\-]?)  # Numbers, including fractions, decimals.
+    |
+    (?:[\w_]+)                     # Words without apostrophes or dashes.
+    |
+    (?:\.(?:\s*\.){1,})            # Ellipsis dots.
+    |
+    (?:\S)                         # Everything else that isn't whitespace.
+    """,
+)
+
+WORD_RE = re.compile(r"({})".format("|".join(REGEXPS)), re.VERBOSE | re.I | re.UNICODE)
+
+EMOTICON_RE = re.compile(EMOTICONS, re.VERBOSE | re.I | re.UNICODE)
+
+# [\W_] is the complement of [\p{L}\p{N}] (re does not support unicode properties)
+HANG_RE = re.compile(r"([\W_])\1{3,}")
+
+ENT_RE = re.compile(r"&(#?(x?))([^&;\s]+);")
+
+# Most questions only contain letters, spaces and final punctuation: none of the rules above apply but the words one
+PLAIN_TEXT_RE = re.compile(r"[a-zA-Z ?!,]*\Z")
+PLAIN_WORD_RE = re.compile(r"[a-zA-Z]+|[?!,]")
+
+
+def _convert_entity(match):
+    entity_body = match.group(3)
+    number = None
+    if match.group(1):
+        try:
+            number = int(entity_body, 16) if match.group(2) else int(entity_body, 10)
+            # Numeric references in the 80-9F range are mapped to the Windows-1252 characters
+            if 0x80 <= number <= 0x9F:
+                return bytes((number,)).decode("cp1252")
+        except ValueError:
+            number = None
+    else:
+        number = html.entities.name2codepoint.get(entity_body)
+
+    if number is not None:
+        try:
+            return chr(number)
+        except (ValueError, OverflowError):
+            pass
+    return ""
+
+
+def replace_html_entities(text):
+    return ENT_RE.sub(_convert_entity, text)
+
+
+class RegexTokenizer(object):
+    """Drop-in replacement of nltk TweetTokenizer(preserve_case=False)"""
+
+    def tokenize(self, text):
+        if PLAIN_TEXT_RE.match(text):
+            return PLAIN_WORD_RE.findall(HANG_RE.sub(r"\1\1\1", text).lower())
+
+        if "&" in text:
+            text = replace_html_entities(text)
+        text = HANG_RE.sub(r"\1\1\1", text)
+
+        # Emoticons keep their case (e.g. :D)
+        return [word if EMOTICON_RE.search(word) else word.lower() for word in WORD_RE.findall(text)]
+
+
+def create_word_tokenizer(name):
+    """
+    Create the tokenizer that splits questions into words
+
+    :param name: "regex" (RegexTokenizer) or "nltk" (TweetTokenizer)
+    """
+    if name == "regex":
+        return RegexTokenizer()
+    elif name == "nltk":
+        from nltk.tokenize import TweetTokenizer
+        return TweetTokenizer(preserve_case=False)
+    else:
+        assert False, "Invalid word tokenizer: {}".format(name)
@@ -0,0 +1,150 @@
+import collections
+import os
+import random
+import tempfile
+import numpy as np
+
+# Why shared memory?
+# Raw images require a process pool: by default, every batch pickles its full games (objects, segments, loaders...)
+# to the workers and pickles the numpy batch back to the main process.
+# With a game store, only game indices are sent to the workers, which rebuild the games from a memory-mapped file.
+# The numpy arrays of the batch are then written by the workers into a ring of pre-allocated slots of a
+# memory-mapped file that the main process reads without copy.
+
+# Ring buffers opened in the workers, by path: several iterators (e.g. train/valid) may share the same pool.
+# Only the last few are kept opened, the files of the closed iterators are unlinked by the main process.
+_worker_buffers = collections.OrderedDict()
+_max_worker_buffers = 4
+
+
+def get_default_shared_dir():
+    """Return /dev/shm (RAM-backed filesystem) when available, the default temporary directory otherwise"""
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return None
+
+
+class SharedArray(object):
+    """Location of a numpy array within a slot of a SharedBatchBuffer"""
+
+    __slots__ = ("offset", "shape", "dtype")
+
+    def __init__(self, offset, shape, dtype):
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+
+
+class SharedBatchBuffer(object):
+    """
+    Ring of fixed-size slots stored in a (sparse) memory-mapped file
+
+    A slot must not be reused while the main process is still reading it: the Iterator only gives free slots to
+    new batches (at most prefetch depth + 1 slots are in use). Arrays that do not fit into a slot are pickled.
+    """
+
+    alignment = 64
+
+    def __init__(self, no_slots, slot_bytes, shared_dir=None):
+        """
+        :param shared_dir: directory of the memory-mapped file (default: /dev/shm if available, cf. get_default_shared_dir)
+        """
+        self.no_slots = no_slots
+        self.slot_bytes = slot_bytes
+
+        if shared_dir is None:
+            shared_dir = get_default_shared_dir()
+
+        fd, self.path = tempfile.mkstemp(prefix="batch_buffer_", suffix=".bin", dir=shared_dir)
+        os.ftruncate(fd, no_slots * slot_bytes)
+        os.close(fd)
+
+        self.buffer = np.memmap(self.path, dtype=np.uint8, mode='r+', shape=(no_slots * slot_bytes,))
+        self.is_owner = True
+
+    # Only send the path to the workers
+    def __getstate__(self):
+        return dict(path=self.path, no_slots=self.no_slots, slot_bytes=self.slot_bytes)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.is_owner = False
+
+        if self.path not in _worker_buffers:
+            _worker_buffers[self.path] = np.memmap(self.path, dtype=np.uint8, mode='r+',
+                                                   shape=(self.no_slots * self.slot_bytes,))
+            while len(_worker_buffers) > _max_worker_buffers:
+                _worker_buffers.popitem(last=False)
+        else:
+            _worker_buffers.move_to_end(self.path)
+        self.buffer = _worker_buffers[self.path]
+
+    def write(self, slot, batch):
+        """Copy the numpy arrays of the batch into the slot and replace them by their SharedArray location"""
+        offset = slot * self.slot_bytes
+        end = offset + self.slot_bytes
+
+        shared_batch = dict()
+        for key, value in batch.items():
+            if isinstance(value, np.ndarray) and value.dtype != object and offset + value.nbytes <= end:
+                np.ndarray(value.shape, dtype=value.dtype, buffer=self.buffer, offset=offset)[...] = value
+                shared_batch[key] = SharedArray(offset, value.shape, value.dtype.str)
+                offset += -(-value.nbytes // self.alignment) * self.alignment
+            else:
+                shared_batch[key] = value
+
+        return shared_batch
+
+    def read(self, batch):
+        """Replace the SharedArray locations by (no copy) views on the buffer"""
+        for key, value in batch.items():
+            if isinstance(value, SharedArray):
+                batch[key] = np.ndarray(value.shape, dtype=np.dtype(value.dtype), buffer=self.buffer, offset=value.offset)
+        return batch
+
+    def close(self):
+        # The views that were already returned remain valid (the file is only unlinked)
+        if self.is_owner and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __del__(self):
+        self.close()
+
+
+def get_split_rng(split_seed, game_index):
+    """Random generator given to batchifier.split for one game: the workers split the same games as the main process"""
+    return random.Random("{}-{}".format(split_seed, game_index))
+
+
+class SharedBatchifier(object):
+    """
+    Worker-side task: rebuild the games from their indices, apply the batchifier and write the batch to the buffer
+
+    :param batchifier: batchifier (split/apply)
+    :param game_store: picklable object that rebuilds a game from its index (get_game)
+    :param batch_buffer: SharedBatchBuffer
+    :param split_seed: seed of the split of the games (cf. get_split_rng)
+    """
+
+    def __init__(self, batchifier, game_store, batch_buffer, split_seed=None):
+        self.batchifier = batchifier
+        self.game_store = game_store
+        self.batch_buffer = batch_buffer
+        self.split_seed = split_seed
+
+    def __call__(self, task):
+        slot, records = task
+
+        # records are (game index, index of the split game) ; split games of the same game are only rebuilt once
+        split_games = dict()
+        games = []
+        for game_index, split_index in records:
+            if game_index not in split_games:
+                split_games[game_index] = self.batchifier.split([self.game_store.get_game(game_index)],
+                                                                rng=get_split_rng(self.split_seed, game_index))
+            games.append(split_games[game_index][split_index])
+
+        batch = self.batchifier.apply(games)
+        batch.pop("raw", None)  # the main process already owns the games
+
+        return self.batch_buffer.write(slot, batch)
@@ -39,12 +39,7 @@ def extract_features(
             dataset = dataset_cstor(**dataset_args)
     
             # hack dataset to only keep one game by image
-            image_id_set = {}
-            games = []
-            for game in dataset.games:
-                if game.image.id not in image_id_set:
-                    games.append(game)
-                    image_id_set[game.image.id] = 1
+            games = dataset.one_game_per_image()
 
             dataset.games = games
             no_images = len(games)
@@ -5,11 +5,14 @@ import logging
 import argparse
 import json
 
+from generic.data_provider.iterator import PeriodicCheckpoint
+
 
 class ExperienceManager(object):
 
     status_filename = "status.json"
     params_filename = "params.ckpt"
+    iterator_state_filename = "iterator_state.json"
 
     def __init__(self, xp_id, xp_dir, args, config, user_data=None):
 
@@ -93,8 +96,23 @@ class ExperienceManager(object):
         else:
             logger.warning("Checkpoint could not be found in directory: '{}'.".format(dir_ckpt))
 
+        # The last checkpoint was saved within an epoch: this epoch is resumed (cf. get_iterator_state)
+        resume = self.data.get("resume")
+        if not load_best and resume is not None:
+            logger.info("Resume epoch {} after {} batches".format(resume["epoch"], resume["cursor"]))
+            return resume["epoch"]
+
         return self.data["epoch"]
 
+    def get_iterator_state(self, epoch):
+        """Return the state of the training iterator if the epoch was interrupted after a mid-epoch checkpoint"""
+        resume = self.data.get("resume")
+        if resume is None or resume["epoch"] != epoch:
+            return None
+
+        with open(os.path.join(self.dir_last_ckpt, self.iterator_state_filename), 'r') as f:
+            return json.load(f)
+
     def _save(self, sess, saver, dir_ckpt):
 
         # Create directory
@@ -107,6 +125,37 @@ class ExperienceManager(object):
         logger = logging.getLogger()
         logger.info("checkpoint saved... Directory: {}".format(dir_ckpt))
 
+    def _save_status(self):
+        # The status is written last: it must not refer to a checkpoint that is not fully saved
+        status_path = os.path.join(self.dir_xp, self.status_filename)
+        with open(status_path + ".tmp", 'w') as f_out:
+            f_out.write(json.dumps(self.data, allow_nan=True))
+        os.replace(status_path + ".tmp", status_path)
+
+    def save_iteration_checkpoint(self, sess, saver, epoch, iterator_state):
+        """
+        Save the parameters (last checkpoint) and the position of the training iterator within an epoch
+
+        :param iterator_state: Iterator.get_state()
+        """
+        if not os.path.isdir(self.dir_last_ckpt):
+            os.makedirs(self.dir_last_ckpt)
+
+        with open(os.path.join(self.dir_last_ckpt, self.iterator_state_filename), 'w') as f_out:
+            json.dump(iterator_state, f_out)
+
+        self._save(sess, saver, self.dir_last_ckpt)
+
+        self.data["resume"] = dict(epoch=epoch, cursor=iterator_state["cursor"])
+        self._save_status()
+
+    def checkpoint_iterator(self, iterator, sess, saver, epoch, no_batches):
+        """Save a mid-epoch checkpoint every no_batches batches of the training iterator (0: no checkpoint)"""
+        if no_batches <= 0:
+            return iterator
+        return PeriodicCheckpoint(iterator, no_batches,
+                                  save=lambda state: self.save_iteration_checkpoint(sess, saver, epoch, state))
+
     def save_checkpoint(self, sess, saver, epoch, losses):
 
         assert self.score_tracking, "Score tracking is not configured!"
@@ -115,8 +164,9 @@ class ExperienceManager(object):
         assert self.data["score_name"] in losses, "Missing tracking score {} in losses. Got {}".format(self.data["score_name"], losses.keys())
         running_score = losses[self.data["score_name"]]
 
-        # update data
+        # update data (the epoch is over: it must not be resumed)
         self.data["epoch"] = epoch
+        self.data.pop("resume", None)
 
         for key, value in losses.items():
             self.data["extra_losses"][key].append(value)
@@ -137,9 +187,7 @@ class ExperienceManager(object):
         self._save(sess, saver, self.dir_last_ckpt)
 
         # Save status
-        status_path = os.path.join(self.dir_xp, self.status_filename)
-        with open(status_path, 'w') as f_out:
-            f_out.write(json.dumps(self.data, allow_nan=True))
+        self._save_status()
 
         return self.stop_epoch
 
@@ -1,5 +1,6 @@
 from tqdm import tqdm
 import os
+import time
 from collections import OrderedDict
 import tensorflow as tf
 import numpy as np
@@ -38,10 +39,20 @@ class Evaluator(object):
             self.scope += "/"
         self.use_summary = False
 
+        # Data loading counters of the last processed iterator (cf. get_data_stats)
+        self.data_stats = dict()
+
         # Debug tools (should be removed on the long run)
         self.network = network
         self.tokenizer = tokenizer
 
+    def get_data_stats(self):
+        """
+        Time spent in the network (run_time) and prefetching counters of the last call to process
+        A high wait_ratio means that the training is waiting for the data (e.g. increase no_thread)
+        """
+        return self.data_stats
+
     def process(self, sess, iterator, outputs, listener=None, show_progress=True):
 
         assert isinstance(outputs, list), "outputs must be a list"
@@ -60,6 +71,7 @@ class Evaluator(object):
 
         # Showing progress is optional
         progress = tqdm if show_progress else lambda x: x
+        run_time = 0.
         for batch in progress(iterator):
 
             # Appending is_training flag to the feed_dict
@@ -67,7 +79,9 @@ class Evaluator(object):
             batch["is_dynamic"] = True
 
             # evaluate the network on the batch
+            start = time.time()
             results = self.execute(sess, outputs, batch)
+            run_time += time.time() - start
 
             # process the results
             i = 0
@@ -86,6 +100,10 @@ class Evaluator(object):
         if listener is not None:
             listener.after_epoch(is_training)
 
+        self.data_stats = dict(run_time=run_time)
+        if hasattr(iterator, "get_prefetch_stats"):
+            self.data_stats.update(iterator.get_prefetch_stats())
+
         aggregated_outputs = [sum(out) / mean_ratio for out in aggregated_outputs]
 
         return aggregated_outputs
@@ -0,0 +1,57 @@
+import collections
+import threading
+
+
+class LRUCache(object):
+    """
+    Thread-safe LRU cache (batchifiers may run in a thread pool)
+
+    Only the size of the cache is pickled: every process owns its own cache.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.data = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        return self.max_size
+
+    def __setstate__(self, max_size):
+        self.__init__(max_size)
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key, None)
+            if value is not None:
+                self.data.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self):
+        with self.lock:
+            no_calls = self.hits + self.misses
+            return dict(size=len(self.data), max_size=self.max_size, hits=self.hits, misses=self.misses,
+                        hit_rate=float(self.hits) / no_calls if no_calls > 0 else 0.)
+
+    def __len__(self):
+        return len(self.data)
@@ -1,4 +1,7 @@
-
+import atexit
+import logging
+import multiprocessing.pool
+import threading
 from multiprocessing.pool import ThreadPool
 from multiprocessing import Pool
 
@@ -17,3 +20,136 @@ def create_cpu_pool(no_thread, use_process, maxtasksperchild=1000):
         cpu_pool._maxtasksperchild = maxtasksperchild
 
     return cpu_pool
+
+
+# Why a CpuPool?
+# Training scripts used to create a new pool at every epoch (otherwise threads may become zombie - python bug) and never
+# closed the previous ones: every epoch paid the start of the workers and leaked threads/processes.
+# The CpuPool is created once per run and shared by all the train/eval phases. Workers are recycled after
+# maxtasksperchild tasks (leaks of the batchifiers/image loaders cannot accumulate), the pool is checked before being
+# used (it is recreated if it was terminated or if its handler threads died) and it is closed when leaving the
+# context manager (or at exit).
+
+class CpuPool(object):
+    """
+    Long-lived pool of workers (processes or threads) shared by the iterators of a run
+
+    :param no_thread: number of workers (0: the tasks are computed in the calling thread)
+    :param use_process: processes (e.g. raw images) or threads (e.g. h5 features)
+    :param maxtasksperchild: number of tasks after which a worker is replaced by a new one
+    """
+
+    def __init__(self, no_thread, use_process, maxtasksperchild=1000):
+        self.no_thread = no_thread
+        self.use_process = use_process
+        self.maxtasksperchild = maxtasksperchild
+
+        self.pool = None
+        self.no_restarts = 0
+        self.lock = threading.Lock()
+        self.is_closed = False
+
+        atexit.register(self.terminate)  # the workers must not outlive the main process
+
+    @property
+    def no_workers(self):
+        return max(self.no_thread, 1)
+
+    def is_healthy(self):
+        if self.pool is None:
+            return False
+        if self.pool._state != multiprocessing.pool.RUN:
+            return False
+        # Tasks are lost without error if one of the handler threads of the pool died
+        handlers = [self.pool._worker_handler, self.pool._task_handler, self.pool._result_handler]
+        return all(h.is_alive() for h in handlers)
+
+    def get(self):
+        """Return the underlying pool (created or recreated if needed), None if no_thread is 0"""
+        if self.no_thread == 0:
+            return None
+
+        with self.lock:
+            assert not self.is_closed, "CpuPool is closed"
+            if not self.is_healthy():
+                if self.pool is not None:
+                    logging.getLogger().warning("CpuPool is not healthy: restart the workers")
+                    self.pool.terminate()
+                    self.no_restarts += 1
+                self.pool = create_cpu_pool(self.no_thread, use_process=self.use_process,
+                                            maxtasksperchild=self.maxtasksperchild)
+            return self.pool
+
+    def apply_async(self, fct, args=(), callback=None, error_callback=None):
+        pool = self.get()
+        if pool is None:
+            try:
+                result = fct(*args)
+            except Exception as e:
+                if error_callback is None:
+                    raise
+                error_callback(e)
+                return None
+            if callback is not None:
+                callback(result)
+            return None
+        return pool.apply_async(fct, args, callback=callback, error_callback=error_callback)
+
+    def imap(self, fct, iterable):
+        pool = self.get()
+        if pool is None:
+            return (fct(x) for x in iterable)
+        return pool.imap(fct, iterable)
+
+    def map(self, fct, iterable):
+        return list(self.imap(fct, iterable))
+
+    def _shutdown(self, wait):
+        # The pool cannot be recreated by an ongoing iterator once is_closed is set
+        with self.lock:
+            self.is_closed = True
+            pool, self.pool = self.pool, None
+
+        if pool is not None:
+            if wait:
+                pool.close()
+            else:
+                pool.terminate()
+            pool.join()
+
+    def close(self):
+        """Wait for the ongoing tasks and stop the workers"""
+        self._shutdown(wait=True)
+
+    def terminate(self):
+        """Stop the workers immediately (ongoing tasks are lost)"""
+        self._shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Do not wait for the pending batches when leaving on error
+        if exc_type is not None:
+            self.terminate()
+        else:
+            self.close()
+
+
+def is_process_pool(pool):
+    if isinstance(pool, CpuPool):
+        return pool.use_process and pool.no_thread > 0
+    return pool is not None and not isinstance(pool, ThreadPool)
+
+
+def has_workers(pool):
+    """False if the tasks would be computed by the calling thread (no pool or CpuPool without worker)"""
+    if isinstance(pool, CpuPool):
+        return pool.no_thread > 0
+    return pool is not None
+
+
+def get_no_workers(pool):
+    if isinstance(pool, CpuPool):
+        return pool.no_workers
+    return getattr(pool, "_processes", 1) if pool is not None else 1
@@ -0,0 +1,47 @@
+"""Measure the memory footprint of a loaded GuessWhat dataset (bytes per game)
+
+example
+-------
+python src/guesswhat/benchmark/benchmark_dataset_memory.py -data_dir=/path/to/guesswhat -no_games_to_load=20000
+"""
+import argparse
+import gc
+import pickle
+import time
+import tracemalloc
+
+from guesswhat.data_provider.guesswhat_dataset import Dataset
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmark dataset memory..')
+
+    parser.add_argument("-data_dir", type=str, help="Path where are the Guesswhat dataset")
+    parser.add_argument("-set", type=str, default="train", help="Set to load (train/valid/test)")
+    parser.add_argument("-no_games_to_load", type=int, default=float("inf"), help="No games to load. Default : all")
+
+    args = parser.parse_args()
+
+    gc.collect()
+    tracemalloc.start()
+    start_mem, _ = tracemalloc.get_traced_memory()
+    start_time = time.time()
+
+    dataset = Dataset(args.data_dir, args.set, games_to_load=args.no_games_to_load)
+
+    load_time = time.time() - start_time
+    gc.collect()
+    end_mem, peak_mem = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    games = dataset.get_data()
+    no_games = len(games)
+
+    start_time = time.time()
+    pickled_games = pickle.dumps(games, protocol=pickle.HIGHEST_PROTOCOL)
+    pickle_time = time.time() - start_time
+
+    print("Games          : {}".format(no_games))
+    print("Loading time   : {:.2f}s".format(load_time))
+    print("Memory         : {:.1f} MB (peak: {:.1f} MB)".format((end_mem - start_mem) / 2**20, (peak_mem - start_mem) / 2**20))
+    print("Bytes per game : {:.0f}".format((end_mem - start_mem) / no_games))
+    print("Pickle per game: {:.0f} bytes ({:.2f}s)".format(len(pickled_games) / no_games, pickle_time))
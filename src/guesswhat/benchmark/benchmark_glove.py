@@ -0,0 +1,78 @@
+"""Compare the word by word lookup of GloveEmbeddings with the batch lookup of the memory-mapped GloveMatrix
+
+The glove matrix is built in a temporary directory from the glove pickle (cf. create_glove_matrix.py)
+
+example
+-------
+python src/guesswhat/benchmark/benchmark_glove.py -data_dir=/path/to/guesswhat -dict_file=/path/to/dict.json -glove_file=/path/to/glove_dict.pkl
+"""
+import argparse
+import shutil
+import tempfile
+import time
+import numpy as np
+
+from generic.data_provider.nlp_utils import GloveEmbeddings, GloveMatrix, padder, padder_3d
+from guesswhat.data_provider.guesswhat_dataset import Dataset
+from guesswhat.data_provider.guesswhat_tokenizer import GWTokenizer
+
+
+def timeit(fct, no_repeat):
+    start_time = time.time()
+    for _ in range(no_repeat):
+        res = fct()
+    return (time.time() - start_time) / no_repeat, res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmark glove..')
+
+    parser.add_argument("-data_dir", type=str, help="Path where are the Guesswhat dataset")
+    parser.add_argument("-dict_file", type=str, default="data/dict.json", help="Dictionary file name")
+    parser.add_argument("-glove_file", type=str, default="data/glove_dict.pkl", help="Glove file name")
+    parser.add_argument("-set", type=str, default="valid", help="Set to load (train/valid/test)")
+    parser.add_argument("-no_games_to_load", type=int, default=2000, help="No games to load")
+    parser.add_argument("-batch_size", type=int, default=64, help="Batch size")
+    parser.add_argument("-no_repeat", type=int, default=3, help="No repetition of every measure")
+
+    args = parser.parse_args()
+
+    tokenizer = GWTokenizer(args.dict_file)
+    dataset = Dataset(args.data_dir, args.set, games_to_load=args.no_games_to_load)
+
+    questions = [tokenizer.encode(q) for game in dataset.get_data() for q in game.questions]
+    batches = [questions[i:i + args.batch_size] for i in range(0, len(questions), args.batch_size)]
+    print("Questions: {} / Batches: {}".format(len(questions), len(batches)))
+
+    start = time.time()
+    glove = GloveEmbeddings(args.glove_file)
+    print("Load glove pickle: {:.2f}s".format(time.time() - start))
+
+    store_dir = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        no_found = GloveMatrix.build(glove.glove, tokenizer, store_dir, glove_dim=glove.glove_dim)
+        print("Build glove matrix: {:.2f}s ({}/{} words found)".format(time.time() - start, no_found, tokenizer.no_words))
+
+        start = time.time()
+        matrix = GloveMatrix(store_dir)
+        matrix.check_vocabulary(tokenizer)
+        print("Load glove matrix: {:.4f}s".format(time.time() - start))
+
+        # Both lookups start from the (padded) tokens of the batch
+        def lookup_per_word():
+            return [padder_3d([glove.get_embeddings([tokenizer.i2word[t] for t in q]) for q in b])[0] for b in batches]
+
+        def lookup_matrix():
+            return [matrix.lookup(padder(b, padding_symbol=tokenizer.padding_token)[0]) for b in batches]
+
+        t_word, res_word = timeit(lookup_per_word, args.no_repeat)
+        t_matrix, res_matrix = timeit(lookup_matrix, args.no_repeat)
+        for emb_word, emb_matrix in zip(res_word, res_matrix):
+            assert emb_word.shape == emb_matrix.shape
+            assert np.allclose(emb_word, emb_matrix)
+
+        print("lookup: per word {:.2f}ms/batch - matrix {:.2f}ms/batch".format(
+            1000 * t_word / len(batches), 1000 * t_matrix / len(batches)))
+    finally:
+        shutil.rmtree(store_dir)
@@ -0,0 +1,91 @@
+"""Check the vectorized mask_generate/compute_cumulative_rewards against the former loops and compare their speed
+
+example
+-------
+python src/guesswhat/benchmark/benchmark_hred_masks.py -batch_size 64 -no_turns 8
+"""
+import argparse
+import time
+import numpy as np
+
+from generic.data_provider.nlp_utils import mask_generate
+from guesswhat.data_provider.qgen_hred_batchifier import compute_cumulative_rewards
+
+
+# Former implementations
+def loop_mask_generate(lengths, feature_size=0):
+    seq_length = np.array([q.max() for q in lengths], dtype=np.int32)
+    turn_length = np.array([q.shape[0] for q in lengths], dtype=np.int32)
+
+    if feature_size == 0:
+        feature_size = seq_length.max()
+
+    B = len(lengths)
+    max_seq_length = turn_length.max()
+
+    padding_mask = np.zeros(shape=(B, max_seq_length, feature_size), dtype=np.float32)
+
+    for i, (end_of_question, r) in enumerate(zip(lengths, [1] * B)):
+        for j in range(max_seq_length):
+            idx = end_of_question[j]
+            padding_mask[i, j, :idx] = r  # gamma = 1
+
+    return padding_mask
+
+
+def loop_compute_cumulative_rewards(reward, gamma=1):
+    if not isinstance(gamma, list):
+        gamma = [gamma] * len(reward)
+
+    cum_reward = [reward[-1]]
+    for i, (r, g) in enumerate(zip(reversed(reward[:-1]), reversed(gamma[:-1]))):
+        cum_reward += [r + g * cum_reward[i]]
+
+    return cum_reward[::-1]
+
+
+def timeit(fct, no_repeat):
+    start_time = time.time()
+    for _ in range(no_repeat):
+        fct()
+    return 1000 * (time.time() - start_time) / no_repeat
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmark HRED masks..')
+
+    parser.add_argument("-batch_size", type=int, default=64, help="Batch size")
+    parser.add_argument("-no_turns", type=int, default=8, help="No questions per dialogue")
+    parser.add_argument("-no_checks", type=int, default=500, help="No random inputs to compare")
+    parser.add_argument("-no_repeat", type=int, default=100, help="No repetition of every measure")
+    parser.add_argument("-seed", type=int, default=0, help="Random seed")
+
+    args = parser.parse_args()
+    rnd = np.random.RandomState(args.seed)
+
+    # Property checks on random inputs (including empty and negative lengths, zero/non-unit gamma)
+    for _ in range(args.no_checks):
+        lengths = rnd.randint(-3, 15, size=(rnd.randint(1, 10), rnd.randint(1, 10)))
+        feature_size = rnd.choice([0, 10, 13])
+        if feature_size == 0 and lengths.max() <= 0:
+            continue
+        assert np.array_equal(loop_mask_generate(lengths, feature_size), mask_generate(lengths, feature_size))
+
+        reward = list(rnd.randint(-2, 3, size=rnd.randint(1, 15)).astype(float))
+        for gamma in [1, 0.9, 0., list(rnd.uniform(0, 1, size=len(reward)))]:
+            assert np.allclose(loop_compute_cumulative_rewards(reward, gamma), compute_cumulative_rewards(reward, gamma))
+    print("Outputs are identical")
+
+    lengths = rnd.randint(1, 14, size=(args.batch_size, args.no_turns)) - 1
+    print("mask_generate ({}x{}): loop {:.3f}ms - vectorized {:.3f}ms".format(
+        args.batch_size, args.no_turns,
+        timeit(lambda: loop_mask_generate(lengths, feature_size=10), args.no_repeat),
+        timeit(lambda: mask_generate(lengths, feature_size=10), args.no_repeat)))
+
+    rewards = rnd.uniform(size=(args.batch_size, args.no_turns))
+    assert np.allclose([loop_compute_cumulative_rewards(list(r), 0.9) for r in rewards],
+                       compute_cumulative_rewards(rewards, 0.9))
+    print("compute_cumulative_rewards ({}x{}): loop {:.3f}ms - vectorized {:.3f}ms".format(
+        args.batch_size, args.no_turns,
+        timeit(lambda: [loop_compute_cumulative_rewards(list(r), 0.9) for r in rewards], args.no_repeat),
+        timeit(lambda: compute_cumulative_rewards(rewards, 0.9), args.no_repeat)))
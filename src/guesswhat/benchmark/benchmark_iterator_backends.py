@@ -0,0 +1,53 @@
+"""Compare the backends of the Iterator (inline, thread, process, shared_memory) on the guesser batches
+
+The per-step cost of the inline backend is measured on small lists of games (as the looper does at every turn).
+
+example
+-------
+python src/guesswhat/benchmark/benchmark_iterator_backends.py -data_dir=/path/to/guesswhat -dict_file=/path/to/dict.json
+"""
+import argparse
+import time
+
+from generic.data_provider.iterator import Iterator
+from generic.data_provider.prefetcher import format_prefetch_stats
+from generic.utils.thread_pool import CpuPool
+from guesswhat.data_provider.guesswhat_dataset import Dataset
+from guesswhat.data_provider.guesswhat_tokenizer import GWTokenizer
+from guesswhat.data_provider.guesser_qa_batchifier import GuesserBatchifier_RAH
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmark iterator backends..')
+
+    parser.add_argument("-data_dir", type=str, help="Path where are the Guesswhat dataset")
+    parser.add_argument("-dict_file", type=str, default="data/dict.json", help="Dictionary file name")
+    parser.add_argument("-set", type=str, default="valid", help="Set to load (train/valid/test)")
+    parser.add_argument("-no_games_to_load", type=int, default=5000, help="No games to load")
+    parser.add_argument("-batch_size", type=int, default=64, help="Batch size")
+    parser.add_argument("-no_thread", type=int, default=4, help="No workers of the pools")
+    parser.add_argument("-step_size", type=int, default=16, help="No games of a looper step")
+    parser.add_argument("-no_steps", type=int, default=1000, help="No looper steps")
+
+    args = parser.parse_args()
+
+    tokenizer = GWTokenizer(args.dict_file)
+    dataset = Dataset(args.data_dir, args.set, games_to_load=args.no_games_to_load, use_cache=True)
+    batchifier = GuesserBatchifier_RAH(tokenizer, sources=["question", "obj_spat", "obj_cat"])
+
+    for backend, use_process in [("inline", False), ("thread", False), ("process", True), ("shared_memory", True)]:
+        with CpuPool(args.no_thread, use_process=use_process) as cpu_pool:
+            iterator = Iterator(dataset, batch_size=args.batch_size, batchifier=batchifier, pool=cpu_pool,
+                                backend=backend)
+            for _ in iterator:
+                pass
+            print("{:<14}: {}".format(backend, format_prefetch_stats(iterator.get_prefetch_stats())))
+
+    games = dataset.get_data()
+    steps = [games[i:i + args.step_size] for i in range(0, len(games), args.step_size)][:args.no_steps]
+
+    start = time.time()
+    for step in steps:
+        for _ in Iterator(step, batch_size=len(step), batchifier=batchifier):
+            pass
+    print("looper step (inline, {} games): {:.3f}ms".format(args.step_size, 1000 * (time.time() - start) / len(steps)))
@@ -0,0 +1,77 @@
+"""Measure the memory/time required to split a GuessWhat dataset into questions (copies of the games vs SplitGame views)
+
+example
+-------
+python src/guesswhat/benchmark/benchmark_split_memory.py -data_dir=/path/to/guesswhat -no_games_to_load=20000
+"""
+import argparse
+import copy
+import gc
+import time
+import tracemalloc
+
+from generic.data_provider.batchifier import batchifier_split_helper
+from guesswhat.data_provider.guesswhat_dataset import Dataset
+
+
+def copy_split(games, split_mode):
+    """Former batchifier_split_helper: one shallow copy of the game per question"""
+    new_games = []
+    for game in games:
+        for i in range(len(game.question_ids)):
+            new_game = copy.copy(game)  # Beware shallow copy!
+            if split_mode == 1:
+                new_game.questions = [game.questions[i]]
+                new_game.question_ids = [game.question_ids[i]]
+                new_game.answers = [game.answers[i]]
+                new_game.is_full_dialogue = False
+            else:
+                new_game.questions = game.questions[:i + 1]
+                new_game.question_ids = game.question_ids[:i + 1]
+                new_game.answers = game.answers[:i + 1]
+                new_game.is_full_dialogue = len(game.question_ids) == len(new_game.question_ids)
+            new_game.user_data = {"full_game": game}
+            new_games.append(new_game)
+    return new_games
+
+
+def measure(split_fct, games, split_mode):
+    gc.collect()
+    tracemalloc.start()
+    start_mem, _ = tracemalloc.get_traced_memory()
+    start_time = time.time()
+
+    split_games = split_fct(games, split_mode)
+
+    split_time = time.time() - start_time
+    gc.collect()
+    end_mem, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return split_games, split_time, end_mem - start_mem
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmark split memory..')
+
+    parser.add_argument("-data_dir", type=str, help="Path where are the Guesswhat dataset")
+    parser.add_argument("-set", type=str, default="train", help="Set to load (train/valid/test)")
+    parser.add_argument("-no_games_to_load", type=int, default=float("inf"), help="No games to load. Default : all")
+
+    args = parser.parse_args()
+
+    games = Dataset(args.data_dir, args.set, games_to_load=args.no_games_to_load).get_data()
+
+    for split_mode in [1, 2]:
+        copies, copy_time, copy_mem = measure(copy_split, games, split_mode)
+        views, view_time, view_mem = measure(batchifier_split_helper, games, split_mode)
+
+        # Both splits must expose the same dialogues
+        for c, v in zip(copies, views):
+            assert c.questions == v.questions and c.question_ids == v.question_ids and c.answers == v.answers
+            assert c.is_full_dialogue == v.is_full_dialogue and c.object is v.object
+        del copies, views
+
+        print("split_mode={} ({} samples)".format(split_mode, sum(len(g.question_ids) for g in games)))
+        print(" - copies: {:.2f}s {:.1f} MB".format(copy_time, copy_mem / 2**20))
+        print(" - views : {:.2f}s {:.1f} MB".format(view_time, view_mem / 2**20))
@@ -0,0 +1,64 @@
+"""Check that the regex tokenizer splits the GuessWhat questions as nltk TweetTokenizer and compare their throughput
+
+example
+-------
+python src/guesswhat/benchmark/benchmark_tokenizer.py -data_dir=/path/to/guesswhat
+"""
+import argparse
+import gzip
+import json
+import os
+import time
+
+from generic.data_provider.regex_tokenizer import create_word_tokenizer
+
+
+def load_questions(data_dir, sets):
+    questions = []
+    for one_set in sets:
+        with gzip.open(os.path.join(data_dir, "guesswhat.{}.jsonl.gz".format(one_set))) as f:
+            for line in f:
+                questions += [qa["question"] for qa in json.loads(line.decode("utf-8"))["qas"]]
+    return questions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmark word tokenizers..')
+
+    parser.add_argument("-data_dir", type=str, help="Path where are the Guesswhat dataset")
+    parser.add_argument("-sets", type=str, nargs="+", default=["train", "valid", "test"], help="Sets to check")
+    parser.add_argument("-no_repeat", type=int, default=1, help="No repetition of the throughput measure")
+    parser.add_argument("-max_errors", type=int, default=20, help="No mismatches to display")
+
+    args = parser.parse_args()
+
+    questions = load_questions(args.data_dir, args.sets)
+    print("Questions: {}".format(len(questions)))
+
+    # Import time (nltk loads its whole package)
+    tokenizers = dict()
+    for name in ["regex", "nltk"]:
+        start_time = time.time()
+        tokenizers[name] = create_word_tokenizer(name)
+        print("{}: import {:.3f}s".format(name, time.time() - start_time))
+
+    # Equivalence
+    no_errors = 0
+    for question in questions:
+        expected, tokens = tokenizers["nltk"].tokenize(question), tokenizers["regex"].tokenize(question)
+        if expected != tokens:
+            if no_errors < args.max_errors:
+                print("Mismatch: {} -> nltk: {} / regex: {}".format(repr(question), expected, tokens))
+            no_errors += 1
+    print("Mismatches: {}/{}".format(no_errors, len(questions)))
+
+    # Throughput
+    for name, tokenizer in tokenizers.items():
+        start_time = time.time()
+        for _ in range(args.no_repeat):
+            for question in questions:
+                tokenizer.tokenize(question)
+        duration = (time.time() - start_time) / args.no_repeat
+        print("{}: {:.0f} questions/s".format(name, len(questions) / duration))
+
+    assert no_errors == 0, "The regex tokenizer is not equivalent to nltk TweetTokenizer"
@@ -0,0 +1,87 @@
+"""Compare the per-question encode/decode of GWTokenizer with encode_batch/decode_batch
+
+example
+-------
+python src/guesswhat/benchmark/benchmark_tokenizer_batch.py -data_dir=/path/to/guesswhat -dict_file=/path/to/dict.json
+"""
+import argparse
+import time
+import numpy as np
+
+from generic.data_provider.nlp_utils import padder
+from guesswhat.data_provider.guesswhat_dataset import Dataset
+from guesswhat.data_provider.guesswhat_tokenizer import GWTokenizer
+
+
+def timeit(fct, no_repeat):
+    start_time = time.time()
+    for _ in range(no_repeat):
+        res = fct()
+    return (time.time() - start_time) / no_repeat, res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmark tokenizer..')
+
+    parser.add_argument("-data_dir", type=str, help="Path where are the Guesswhat dataset")
+    parser.add_argument("-dict_file", type=str, default="data/dict.json", help="Dictionary file name")
+    parser.add_argument("-set", type=str, default="valid", help="Set to load (train/valid/test)")
+    parser.add_argument("-no_games_to_load", type=int, default=2000, help="No games to load")
+    parser.add_argument("-batch_size", type=int, default=64, help="Batch size")
+    parser.add_argument("-no_repeat", type=int, default=3, help="No repetition of every measure")
+    parser.add_argument("-cache_size", type=int, default=100000, help="Size of the encode cache (0: no cache)")
+
+    args = parser.parse_args()
+
+    tokenizer = GWTokenizer(args.dict_file, cache_size=args.cache_size)
+    dataset = Dataset(args.data_dir, args.set, games_to_load=args.no_games_to_load)
+
+    questions = [q for game in dataset.get_data() for q in game.questions]
+    batches = [questions[i:i + args.batch_size] for i in range(0, len(questions), args.batch_size)]
+    print("Questions: {} / Batches: {}".format(len(questions), len(batches)))
+
+    # Encoding
+    def encode_per_item():
+        return [padder([tokenizer.encode(q, add_stop_token=True) for q in b], padding_symbol=tokenizer.padding_token)
+                for b in batches]
+
+    def encode_batch():
+        return [tokenizer.encode_batch(b, add_stop_token=True) for b in batches]
+
+    t_item, res_item = timeit(encode_per_item, args.no_repeat)
+    t_batch, res_batch = timeit(encode_batch, args.no_repeat)
+    for (tokens_item, length_item, _), (tokens_batch, length_batch) in zip(res_item, res_batch):
+        assert np.array_equal(tokens_item, tokens_batch) and np.array_equal(length_item, length_batch)
+
+    print("encode: per item {:.2f}ms/batch - batch {:.2f}ms/batch".format(
+        1000 * t_item / len(batches), 1000 * t_batch / len(batches)))
+
+    # Decoding (sampled questions: padded matrix ended by a stop token)
+    matrices = [tokens for tokens, _ in res_batch]
+
+    def decode_per_item():
+        decoded = []
+        for tokens in matrices:
+            for question_tokens in tokens:
+                l = len(question_tokens)
+                if tokenizer.stop_token in question_tokens:
+                    l = np.nonzero(question_tokens == tokenizer.stop_token)[0][0] + 1
+                elif tokenizer.padding_token in question_tokens:
+                    l = np.nonzero(question_tokens == tokenizer.padding_token)[0][0]
+                decoded.append(tokenizer.decode(question_tokens[:l]))
+        return decoded
+
+    def decode_batch():
+        decoded = []
+        for tokens in matrices:
+            decoded += tokenizer.decode_batch(tokens, stop_tokens=[tokenizer.stop_token])
+        return decoded
+
+    t_item, res_item = timeit(decode_per_item, args.no_repeat)
+    t_batch, res_batch = timeit(decode_batch, args.no_repeat)
+    assert res_item == res_batch
+
+    print("decode: per item {:.2f}ms/batch - batch {:.2f}ms/batch".format(
+        1000 * t_item / len(batches), 1000 * t_batch / len(batches)))
+
+    print("encode cache: {}".format(tokenizer.get_cache_stats()))
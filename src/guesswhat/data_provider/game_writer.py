@@ -0,0 +1,135 @@
+import gzip
+import json
+import threading
+import numpy as np
+
+try:
+    import queue
+except ImportError:  # python 2.X
+    import Queue as queue
+
+
+# Why a game writer?
+# Games used to be dumped game by game on the main thread (json + gzip), the looper even reopened its file at every batch.
+# The GameWriter receives whole batches of samples and encodes/compresses them in a background thread, one write per
+# batch. The samples are built by the caller (main thread): games may be updated as soon as they are queued.
+
+
+def round_probabilities(probabilities, decimals=3):
+    # decimal are not supported by default in json encoder
+    return [str(p) for p in np.round(np.asarray(probabilities, dtype=np.float64), decimals).tolist()]
+
+
+def image_to_dict(image, with_filename=False):
+    sample = {
+        "id": image.id,
+        "width": image.width,
+        "height": image.height,
+        "coco_url": image.url
+    }
+    if with_filename:
+        sample["file_name"] = image.filename
+    return sample
+
+
+def objects_to_list(objects, with_segment=True):
+    return [{"id": o.id,
+             "category_id": o.category_id,
+             "category": o.category,
+             "area": o.area,
+             "bbox": o.bbox.coco_bbox,
+             "segment": o.segment if with_segment else [],  # no segment to avoid making the file too big
+             } for o in objects]
+
+
+def game_to_dict(game, with_segment=True):
+    """Serialize a game with its current dialogue (as in the original GuessWhat files)"""
+    qas = [{"question": question, "answer": answer, "id": id, "p": 0}
+           for id, question, answer in zip(game.question_ids, game.questions, game.answers)]
+
+    return {"id": game.dialogue_id,
+            "qas": qas,
+            "image": image_to_dict(game.image),
+            "objects": objects_to_list(game.objects, with_segment=with_segment),
+            "object_id": game.object.id,
+            "guess_object_id": game.id_guess_object,
+            "status": game.status}
+
+
+class GameWriter(object):
+    """
+    Write samples (dict) as json lines from a background thread
+
+    :param filename: output file, it is gzip-compressed if the name ends with .gz
+    :param mode: 'w' to overwrite, 'a' to append to an existing file
+    :param max_pending: max number of batches waiting to be written (append blocks beyond)
+    """
+
+    def __init__(self, filename, mode='w', max_pending=16):
+        assert mode in ['w', 'a'], "Invalid mode: {}".format(mode)
+
+        self.filename = filename
+        if filename.endswith(".gz"):
+            self.file = gzip.open(filename, mode + 'b')
+        else:
+            self.file = open(filename, mode + 'b')
+
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _write(self, samples):
+        if len(samples) > 0:
+            lines = [json.dumps(sample) for sample in samples]
+            self.file.write(("\n".join(lines) + "\n").encode())
+
+    def _run(self):
+        while True:
+            samples = self.queue.get()
+            try:
+                if samples is None:
+                    return
+                if self.error is None:
+                    self._write(samples)
+            except Exception as e:  # the error is raised in the main thread (append/close)
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def append(self, samples):
+        """
+        Queue a batch of samples to be written (non-blocking as long as there are less than max_pending batches)
+
+        :param samples: list of json-compatible dicts (e.g. game_to_dict), only the json encoding is done in background
+        """
+        self._check_error()
+        self.queue.put(list(samples))
+
+    def flush(self):
+        """Wait until all the queued batches are written"""
+        self.queue.join()
+        self._check_error()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+        self._check_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,19 +1,20 @@
 import numpy as np
 import collections
 import copy
+import random
 from generic.data_provider.batchifier import AbstractBatchifier
 
-from generic.data_provider.image_preprocessors import get_spatial_feat
-from generic.data_provider.nlp_utils import padder, padder_3d
+from generic.data_provider.nlp_utils import padder_stack, padder_turns
 
 
 class GuesserBatchifier_RAH(AbstractBatchifier):
 
-    def __init__(self, tokenizer, sources, glove=None, status=list()):
+    def __init__(self, tokenizer, sources, glove=None, status=list(), token_store=None):
         self.sources = sources
         self.status = status
         self.tokenizer = tokenizer
         self.glove = glove
+        self.token_store = token_store
 
     def filter(self, games):
 
@@ -22,7 +23,18 @@ class GuesserBatchifier_RAH(AbstractBatchifier):
 
         return games
 
-    def split(self, games):
+    def filter_dataset(self, dataset):
+
+        if len(self.status) > 0 and dataset.has_index("status"):
+            return dataset.select(status=self.status)
+
+        return self.filter(dataset.get_data())
+
+    def bucket_key(self, game):
+        # questions are padded to 12 tokens
+        return len(game.questions), len(game.objects)
+
+    def split(self, games, rng=random):
         new_games = []
 
         for game in games:
@@ -30,8 +42,6 @@ class GuesserBatchifier_RAH(AbstractBatchifier):
             # Filter ill-formatted questions with stop_dialogues tokens
             if self.tokenizer.stop_dialogue_word in game.questions[-1]:
                 new_game = copy.copy(game)
-                game.questions[:-1] = game.questions[:-1]
-                new_game.questions_ids = game.question_ids[:-1]
             else:
                 new_game = game
 
@@ -45,45 +55,34 @@ class GuesserBatchifier_RAH(AbstractBatchifier):
         batch["raw"] = games
         batch_size = len(games)
 
+        # Encode question answers (the turns of all the dialogues at once)
+        questions = [q for game in games for q in game.questions]
+        question_ids = [q_id for game in games for q_id in game.question_ids]
+        q_tokens, q_lengths = self.tokenizer.encode_batch(questions, add_stop_token=True,
+                                                          question_ids=question_ids, token_store=self.token_store)
+        a_tokens, a_lengths = self.tokenizer.encode_batch([a for game in games for a in game.answers], is_answer=True)
+
+        # if self.generate:  # Add a dummy question at eval time to not ignore the last question
+        #     q_tokens.append([])
+        #     a_tokens.append([])
+
         for i, game in enumerate(games):
 
-            # Encode question answers
-            q_tokens = [self.tokenizer.encode(q, add_stop_token=True) for q in game.questions]
-            a_tokens = [self.tokenizer.encode(a, is_answer=True) for a in game.answers]
-
-            # if self.generate:  # Add a dummy question at eval time to not ignore the last question
-            #     q_tokens.append([])
-            #     a_tokens.append([])
-            #
-            a_tokens, a_lengths, _ = padder(a_tokens, padding_symbol=self.tokenizer.padding_token, max_seq_length=1)
-
-            # pad the question
-            q_tokens_pad, q_lengths, _ = padder(q_tokens, padding_symbol=self.tokenizer.padding_token,
-                                                max_seq_length=12)
-            # print(q_tokens_pad.shape)
-            batch["q_his"].append(q_tokens_pad)
-            batch["q_his_lengths"].append(q_lengths)
-            batch["a_his"].append(a_tokens)
-
-            # Object embedding
-            obj_spats, obj_cats = [], []
-            for index, obj in enumerate(game.objects):
-
-                bbox = obj.bbox
-                spatial = get_spatial_feat(bbox, game.image.width, game.image.height)
-                category = obj.category_id
-
-                #                    1 point                 width         height
-                bbox_coord = [bbox.x_left, bbox.y_upper, bbox.x_width, bbox.y_height]
-
-                if obj.id == game.object.id and not skip_targets:
-                    batch['target_category'].append(category)
-                    batch['target_spatial'].append(spatial)
-                    batch['target_index'].append(index)
+            # Object embedding (computed once per game)
+            obj_spats, obj_cats, obj_ids = game.get_object_tensors()
+
+            if not skip_targets:
+                for index in np.flatnonzero(obj_ids == game.object.id):
+                    bbox = game.objects[index].bbox
+
+                    #                    1 point                 width         height
+                    bbox_coord = [bbox.x_left, bbox.y_upper, bbox.x_width, bbox.y_height]
+
+                    batch['target_category'].append(int(obj_cats[index]))
+                    batch['target_spatial'].append(obj_spats[index])
+                    batch['target_index'].append(int(index))
                     batch['target_bbox'].append(bbox_coord)
 
-                obj_spats.append(spatial)
-                obj_cats.append(category)
             batch['obj_spat'].append(obj_spats)
             batch['obj_cat'].append(obj_cats)
 
@@ -95,13 +94,19 @@ class GuesserBatchifier_RAH(AbstractBatchifier):
                 batch["image"][i] = img
 
         # Pad dialogue tokens
-        batch["q_his"], max_turn = padder_3d(batch["q_his"])
-        batch["q_his_lengths"], batch["q_turn"], batch["max_turn"] = padder(batch["q_his_lengths"], padding_symbol=1)
-        batch["a_his"], _ = padder_3d(batch["a_his"], feature_size=1)
+        padding_token = self.tokenizer.padding_token
+        batch["q_his"], batch["q_his_lengths"], batch["q_turn"] = padder_turns(q_tokens, q_lengths,
+                                                                               [len(g.questions) for g in games],
+                                                                               max_seq_length=12,
+                                                                               padding_symbol=padding_token,
+                                                                               length_padding_symbol=1)
+        batch["max_turn"] = batch["q_his"].shape[1]
+        batch["a_his"], _, _ = padder_turns(a_tokens, a_lengths, [len(g.answers) for g in games], max_seq_length=1,
+                                            padding_symbol=padding_token)
         # print(batch["q_turn"])
 
         # Pad objects
-        batch['obj_spat'], _ = padder_3d(batch['obj_spat'])   # , max_seq_length=20)
-        batch['obj_cat'], obj_length, _ = padder(batch['obj_cat'])  # , max_seq_length=20)
+        batch['obj_spat'], _ = padder_stack(batch['obj_spat'], dtype=np.float32)   # , max_seq_length=20)
+        batch['obj_cat'], obj_length = padder_stack(batch['obj_cat'])  # , max_seq_length=20)
         batch['obj_seq_length'] = obj_length
         return batch
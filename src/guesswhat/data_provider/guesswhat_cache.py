@@ -0,0 +1,422 @@
+import gzip
+import json
+import os
+import shutil
+import numpy as np
+from multiprocessing import Pool
+
+
+# Why a binary cache?
+# Parsing guesswhat.{set}.jsonl.gz (gunzip + json.loads on every line) dominates the start-up time of every script.
+# The cache stores the very same information in a columnar layout (one flat numpy array per field) that can be
+# memory-mapped by the next runs:
+#  - games   : one row per game, with offsets into the objects/qas tables
+#  - objects : one row per object (id, category, area, bbox) with offsets into the polygon table
+#  - qas     : one row per question (id, answer) with offsets into the text blob
+#  - text    : a single utf-8 blob that stores every string (questions, filenames, urls, non-polygon segments)
+#
+# The cache is rebuilt whenever the source file signature (size + modification time), the number of games to load or
+# the cache version change. The source file is not hashed: hashing the full jsonl.gz would cost as much as a
+# large part of the parsing that the cache avoids.
+
+CACHE_VERSION = 2
+
+cache_meta_filename = "meta.json"
+
+
+def read_raw_games(file, games_to_load=float("inf")):
+    """
+    Iterate over the raw games (dict) of a GuessWhat jsonl file (optionally gzipped)
+
+    :param file: path to the jsonl (or jsonl.gz) file
+    :param games_to_load: stop after this number of games
+    """
+    if games_to_load is None:
+        games_to_load = float("inf")
+
+    open_fct = gzip.open if file.endswith(".gz") else open
+
+    no_games = 0
+    with open_fct(file, 'rb') as f:
+        for line in f:
+            if no_games >= games_to_load:
+                break
+            yield json.loads(line.decode("utf-8").strip('\n'))
+            no_games += 1
+
+
+def read_line_chunks(file, games_to_load=float("inf"), chunk_bytes=1 << 22):
+    """
+    Split the (decompressed) stream of a jsonl file into line-aligned chunks of bytes
+
+    :param file: path to the jsonl (or jsonl.gz) file
+    :param games_to_load: stop after this number of lines
+    :param chunk_bytes: approximate size of every chunk
+    """
+    if games_to_load is None:
+        games_to_load = float("inf")
+
+    open_fct = gzip.open if file.endswith(".gz") else open
+
+    no_lines = 0
+    remainder = b''
+    with open_fct(file, 'rb') as f:
+        while no_lines < games_to_load:
+            block = f.read(chunk_bytes)
+            if not block:
+                break
+
+            # Only keep full lines, the last (partial) line is prepended to the next chunk
+            block = remainder + block
+            end = block.rfind(b'\n') + 1
+            chunk, remainder = block[:end], block[end:]
+
+            # Truncate the last chunk to respect the number of games to load
+            no_new_lines = chunk.count(b'\n')
+            if no_lines + no_new_lines > games_to_load:
+                chunk = b'\n'.join(chunk.split(b'\n', games_to_load - no_lines)[:-1]) + b'\n'
+                no_new_lines = games_to_load - no_lines
+
+            no_lines += no_new_lines
+            if len(chunk) > 0:
+                yield chunk
+
+        if len(remainder.strip()) > 0 and no_lines < games_to_load:  # missing final end-of-line
+            yield remainder
+
+
+def _parse_chunk(args):
+    chunk, game_cstor = args
+    raw_games = [json.loads(line.decode("utf-8")) for line in chunk.split(b'\n') if len(line.strip()) > 0]
+    if game_cstor is None:
+        return raw_games
+    return [game_cstor(raw_game) for raw_game in raw_games]
+
+
+def load_games(file, game_cstor=None, games_to_load=float("inf"), num_workers=0):
+    """
+    Parse (and build) the games of a GuessWhat jsonl file with a pool of processes.
+    The file is split into line-aligned chunks that are parsed in parallel, games are returned in their original order.
+
+    :param file: path to the jsonl (or jsonl.gz) file
+    :param game_cstor: picklable function that turns a raw game (dict) into a game. None: return the raw games
+    :param games_to_load: stop after this number of games
+    :param num_workers: number of processes (0: parse in the current process)
+    """
+    if num_workers == 0:
+        raw_games = read_raw_games(file, games_to_load)
+        if game_cstor is None:
+            return list(raw_games)
+        return [game_cstor(raw_game) for raw_game in raw_games]
+
+    games = []
+    chunks = ((chunk, game_cstor) for chunk in read_line_chunks(file, games_to_load))
+    with Pool(num_workers) as pool:
+        for chunk_games in pool.imap(_parse_chunk, chunks):
+            games += chunk_games
+
+    return games
+
+
+def count_raw_games(file, games_to_load=float("inf")):
+    """Count the games of a GuessWhat jsonl file without parsing them"""
+    if games_to_load is None:
+        games_to_load = float("inf")
+
+    open_fct = gzip.open if file.endswith(".gz") else open
+
+    no_games = 0
+    with open_fct(file, 'rb') as f:
+        for _ in f:
+            no_games += 1
+            if no_games >= games_to_load:
+                break
+    return no_games
+
+
+def get_file_signature(file):
+    """Size and modification time of a file (a rewritten/replaced source file invalidates its cache)"""
+    stat = os.stat(file)
+    return "{}-{}".format(stat.st_size, int(stat.st_mtime * 1e6))
+
+
+def get_cache_dir(file, cache_dir=None):
+    """Cache of a file: next to the file, or in cache_dir (e.g. read-only or shared data directory)"""
+    if cache_dir is None:
+        return file + ".cache"
+    return os.path.join(cache_dir, os.path.basename(file) + ".cache")
+
+
+class _TextBuilder(object):
+    """Append-only utf-8 blob, strings are referenced by their (start, end) offsets"""
+
+    def __init__(self):
+        self.chunks = []
+        self.length = 0
+
+    def add(self, s):
+        b = s.encode("utf-8")
+        start = self.length
+        self.chunks.append(b)
+        self.length += len(b)
+        return start, self.length
+
+    def to_array(self):
+        return np.frombuffer(b"".join(self.chunks), dtype=np.uint8)
+
+
+class _Vocabulary(object):
+    """Map a (small) set of strings to int codes: status, answers, categories"""
+
+    def __init__(self, words=None):
+        self.words = list(words) if words is not None else []
+        self.word2i = {w: i for i, w in enumerate(self.words)}
+
+    def encode(self, word):
+        if word not in self.word2i:
+            self.word2i[word] = len(self.words)
+            self.words.append(word)
+        return self.word2i[word]
+
+
+class GameCache(object):
+    """Memory-mapped columnar image of a GuessWhat dataset file."""
+
+    def __init__(self, cache_dir, mmap=True):
+        self.cache_dir = cache_dir
+        self.mmap = mmap
+
+        with open(os.path.join(cache_dir, cache_meta_filename), 'r') as f:
+            self.meta = json.load(f)
+
+        mmap_mode = 'r' if mmap else None
+        self.arrays = {name: np.load(os.path.join(cache_dir, name + ".npy"), mmap_mode=mmap_mode)
+                       for name in self.meta["arrays"]}
+
+        self.status = self.meta["status"]
+        self.answers = self.meta["answers"]
+        self.categories = self.meta["categories"]
+
+    # Only send the path to other processes (memmap would be fully copied otherwise)
+    def __getstate__(self):
+        return dict(cache_dir=self.cache_dir, mmap=self.mmap)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        return self.meta["no_games"]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.get_game(i)
+
+    def _text(self, start, end):
+        return bytes(self.arrays["text"][start:end]).decode("utf-8")
+
+    def get_segment(self, obj_index):
+        a = self.arrays
+        seg_start, seg_end = a["obj_seg_offset"][obj_index], a["obj_seg_offset"][obj_index + 1]
+
+        # Non-polygon segments (RLE) are stored as json text
+        if seg_end - seg_start == 1 and a["poly_offset"][seg_start] < 0:
+            text_start, text_end = -a["poly_offset"][seg_start] - 1, a["poly_text_end"][seg_start]
+            return json.loads(self._text(text_start, text_end))
+
+        values = a["poly_values"]
+        poly_offset = a["poly_offset"]
+        return [values[poly_offset[p]:poly_offset[p + 1]].tolist() for p in range(seg_start, seg_end)]
+
+    def get_game(self, index):
+        """Rebuild the raw game (dict) as it would have been returned by json.loads"""
+        a = self.arrays
+
+        image_text = a["image_text"][index]
+        image = {"id": int(a["image_id"][index]),
+                 "width": int(a["image_width"][index]),
+                 "height": int(a["image_height"][index]),
+                 "file_name": self._text(image_text[0], image_text[1]),
+                 "coco_url": self._text(image_text[1], image_text[2])}
+
+        obj_start, obj_end = a["game_obj_offset"][index], a["game_obj_offset"][index + 1]
+        objects = []
+        for o in range(obj_start, obj_end):
+            objects.append({"id": int(a["obj_id"][o]),
+                            "category_id": int(a["obj_category_id"][o]),
+                            "category": self.categories[a["obj_category"][o]],
+                            "area": float(a["obj_area"][o]),
+                            "bbox": a["obj_bbox"][o].tolist(),
+                            "segment": self.get_segment(o)})
+
+        qa_start, qa_end = a["game_qa_offset"][index], a["game_qa_offset"][index + 1]
+        qas = []
+        for q in range(qa_start, qa_end):
+            question_text = a["qa_text"][q]
+            qas.append({"id": int(a["qa_id"][q]),
+                        "question": self._text(question_text[0], question_text[1]),
+                        "answer": self.answers[a["qa_answer"][q]]})
+
+        return {"id": int(a["game_id"][index]),
+                "object_id": int(a["game_object_id"][index]),
+                "guess_id": int(a["game_guess_id"][index]),
+                "status": self.status[a["game_status"][index]],
+                "image": image,
+                "objects": objects,
+                "qas": qas}
+
+    @staticmethod
+    def build(raw_games, cache_dir, source_signature, games_to_load=None):
+
+        text = _TextBuilder()
+        status, answers, categories = _Vocabulary(), _Vocabulary(), _Vocabulary()
+        columns = {name: [] for name in ["game_id", "game_object_id", "game_guess_id", "game_status",
+                                         "game_obj_offset", "game_qa_offset",
+                                         "image_id", "image_width", "image_height", "image_text",
+                                         "obj_id", "obj_category_id", "obj_category", "obj_area", "obj_bbox",
+                                         "obj_seg_offset",
+                                         "poly_offset", "poly_text_end", "poly_values",
+                                         "qa_id", "qa_text", "qa_answer"]}
+        c = columns
+        no_poly_values = 0
+
+        for game in raw_games:
+
+            c["game_id"].append(game["id"])
+            c["game_object_id"].append(game["object_id"])
+            c["game_guess_id"].append(game.get("guess_id", -1))
+            c["game_status"].append(status.encode(game["status"]))
+            c["game_obj_offset"].append(len(c["obj_id"]))
+            c["game_qa_offset"].append(len(c["qa_id"]))
+
+            image = game["image"]
+            c["image_id"].append(image["id"])
+            c["image_width"].append(image["width"])
+            c["image_height"].append(image["height"])
+            file_start, file_end = text.add(image["file_name"])
+            _, url_end = text.add(image.get("coco_url", ""))
+            c["image_text"].append((file_start, file_end, url_end))
+
+            for o in game["objects"]:
+                c["obj_id"].append(o["id"])
+                c["obj_category_id"].append(o["category_id"])
+                c["obj_category"].append(categories.encode(o["category"]))
+                c["obj_area"].append(o["area"])
+                c["obj_bbox"].append(o["bbox"])
+                c["obj_seg_offset"].append(len(c["poly_offset"]))
+
+                segment = o["segment"]
+                if isinstance(segment, list):
+                    for polygon in segment:
+                        c["poly_offset"].append(no_poly_values)
+                        c["poly_text_end"].append(0)
+                        c["poly_values"].append(polygon)
+                        no_poly_values += len(polygon)
+                else:  # RLE segments are kept as text (negative offset flag)
+                    seg_start, seg_end = text.add(json.dumps(segment))
+                    c["poly_offset"].append(-seg_start - 1)
+                    c["poly_text_end"].append(seg_end)
+
+            for qa in game["qas"]:
+                c["qa_id"].append(qa["id"])
+                c["qa_text"].append(text.add(qa["question"]))
+                c["qa_answer"].append(answers.encode(qa["answer"]))
+
+        # Close the offset tables
+        c["game_obj_offset"].append(len(c["obj_id"]))
+        c["game_qa_offset"].append(len(c["qa_id"]))
+        c["obj_seg_offset"].append(len(c["poly_offset"]))
+        c["poly_offset"].append(no_poly_values)
+        c["poly_text_end"].append(0)
+
+        arrays = dict(
+            game_id=np.array(c["game_id"], dtype=np.int64),
+            game_object_id=np.array(c["game_object_id"], dtype=np.int64),
+            game_guess_id=np.array(c["game_guess_id"], dtype=np.int64),
+            game_status=np.array(c["game_status"], dtype=np.int8),
+            game_obj_offset=np.array(c["game_obj_offset"], dtype=np.int64),
+            game_qa_offset=np.array(c["game_qa_offset"], dtype=np.int64),
+            image_id=np.array(c["image_id"], dtype=np.int64),
+            image_width=np.array(c["image_width"], dtype=np.int32),
+            image_height=np.array(c["image_height"], dtype=np.int32),
+            image_text=np.array(c["image_text"], dtype=np.int64).reshape(-1, 3),
+            obj_id=np.array(c["obj_id"], dtype=np.int64),
+            obj_category_id=np.array(c["obj_category_id"], dtype=np.int32),
+            obj_category=np.array(c["obj_category"], dtype=np.int16),
+            obj_area=np.array(c["obj_area"], dtype=np.float64),
+            obj_bbox=np.array(c["obj_bbox"], dtype=np.float64).reshape(-1, 4),
+            obj_seg_offset=np.array(c["obj_seg_offset"], dtype=np.int64),
+            poly_offset=np.array(c["poly_offset"], dtype=np.int64),
+            poly_text_end=np.array(c["poly_text_end"], dtype=np.int64),
+            poly_values=np.fromiter((v for polygon in c["poly_values"] for v in polygon),
+                                    dtype=np.float64, count=no_poly_values),
+            qa_id=np.array(c["qa_id"], dtype=np.int64),
+            qa_text=np.array(c["qa_text"], dtype=np.int64).reshape(-1, 2),
+            qa_answer=np.array(c["qa_answer"], dtype=np.int8),
+            text=text.to_array())
+
+        meta = dict(version=CACHE_VERSION,
+                    source_signature=source_signature,
+                    games_to_load=games_to_load,
+                    no_games=len(c["game_id"]),
+                    status=status.words,
+                    answers=answers.words,
+                    categories=categories.words,
+                    arrays=sorted(arrays.keys()))
+
+        # Write in a temporary directory first to never leave an half-written cache behind
+        tmp_dir = cache_dir + ".tmp{}".format(os.getpid())
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, name + ".npy"), array)
+        with open(os.path.join(tmp_dir, cache_meta_filename), 'w') as f:
+            json.dump(meta, f)
+
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.rename(tmp_dir, cache_dir)
+
+    @staticmethod
+    def is_valid(cache_dir, source_signature, games_to_load=None):
+        meta_path = os.path.join(cache_dir, cache_meta_filename)
+        if not os.path.exists(meta_path):
+            return False
+
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+
+        return meta.get("version") == CACHE_VERSION \
+            and meta.get("source_signature") == source_signature \
+            and meta.get("games_to_load") == games_to_load
+
+    @staticmethod
+    def load_or_build(file, games_to_load=float("inf"), cache_dir=None, num_workers=0):
+        """
+        Return the GameCache of a GuessWhat file, the cache is (re)built if it is missing or outdated
+
+        :param file: path to the jsonl (or jsonl.gz) file
+        :param games_to_load: number of games to store in the cache
+        :param cache_dir: directory where to store the cache (Default: next to the source file)
+        :param num_workers: number of processes used to parse the file when the cache is built
+        """
+        cache_dir = get_cache_dir(file, cache_dir)
+
+        # json does not support inf
+        if games_to_load is None or games_to_load == float("inf"):
+            games_to_load = None
+
+        source_signature = get_file_signature(file)
+        if not GameCache.is_valid(cache_dir, source_signature, games_to_load):
+            print("Building dataset cache: {}...".format(cache_dir))
+            if num_workers > 0:
+                raw_games = load_games(file, games_to_load=games_to_load, num_workers=num_workers)
+            else:
+                raw_games = read_raw_games(file, games_to_load)
+            GameCache.build(raw_games,
+                            cache_dir=cache_dir,
+                            source_signature=source_signature,
+                            games_to_load=games_to_load)
+
+        return GameCache(cache_dir, mmap=True)
@@ -1,12 +1,17 @@
-import gzip
-import json
 import copy
+import functools
 import os
+import sys
 import numpy as np
 import PIL.Image as PImage
 from PIL import ImageDraw
 
-from generic.data_provider.dataset import AbstractDataset
+from generic.data_provider.dataset import AbstractDataset, AbstractStreamingDataset
+from generic.data_provider.dataset import CropDataset as AbstractCropDataset
+from guesswhat.data_provider.guesswhat_cache import GameCache, read_raw_games, count_raw_games, load_games
+from generic.data_provider.image_preprocessors import resize_image, scaled_crop_and_pad, get_spatial_feats
+from guesswhat.data_provider.mask_cache import mask_cache
+from guesswhat.data_provider.game_writer import GameWriter, game_to_dict, image_to_dict, objects_to_list, round_probabilities
 
 try:
     import cocoapi.PythonAPI.pycocotools.mask as cocoapi
@@ -16,124 +21,43 @@ except ImportError:
     use_coco = False
     pass
 
-class Game_guesser_new(object):
+def load_game_cache(file, games_to_load=float("inf"), num_workers=0, cache_dir=None):
+    try:
+        return GameCache.load_or_build(file, games_to_load, cache_dir=cache_dir, num_workers=num_workers)
+    except (IOError, OSError) as e:  # e.g. read-only data directory
+        print("Dataset cache could not be used ({}) - fall back on the json file".format(e))
+        return read_raw_games(file, games_to_load)
 
-    def __init__(self, id, object_id, id_guess_object, image, objects, qas, status,
-                 success_turn, att=None):
-        self.dialogue_id = id
 
-        self.objects = []
-        self.att = att
-        for o in objects:
-            self.image = Image(id=image["id"],
-                               filename=image["file_name"],
-                               width=image["width"],
-                               height=image["height"],
-                               url=None,
-                               which_set=None,
-                               rcnn=False,
-                               image_builder=None)
-            new_obj = Object(id=o['id'],
-                             category=o['category'],
-                             category_id=o['category_id'],
-                             bbox=Bbox(o['bbox'], image["width"], image["height"]),
-                             area=None,
-                             segment=o['segment'],
-                             crop_builder=None,
-                             which_set=None,
-                             image=None)
+# Memory layout
+# Games are kept in memory for the whole training, so they must be as light as possible:
+#  - Game/Image/Object/Bbox use __slots__ (no per-instance __dict__)
+#  - Bbox only stores the COCO bbox, the other coordinates are computed on the fly
+#  - segments are stored as flat float64 numpy arrays instead of lists of python floats
+#  - strings (questions, answers, categories, status) are interned and thus shared among games
+#  - user_data and rle masks are only created when they are required
+# cf. src/guesswhat/benchmark/benchmark_dataset_memory.py
 
-            self.objects.append(new_obj)
-            if o['id'] == object_id:
-                self._object = new_obj  # Keep ref on the object to find
-
-        self.question_ids = [qa['id'] for qa in qas]
-        self.questions = [qa['question'] for qa in qas]
-        self.answers = [qa['answer'] for qa in qas]
-        self.status = status
-
-        self.id_guess_object = id_guess_object
-
-        self.is_full_dialogue = True
-        self.success_turn = success_turn
-
-        self.user_data = dict()
 
+class Game(object):
 
-class Game_new(object):
+    __slots__ = ("dialogue_id", "image", "objects", "att", "_object",
+                 "question_ids", "questions", "answers", "status",
+                 "id_guess_object", "is_full_dialogue", "success_turn", "_user_data", "_object_tensors")
 
-    def __init__(self, id, object_id, id_guess_object, image, objects, qas, status, att=None):
+    def __init__(self, rcnn, id, object_id, guess_id, image, objects, qas, status, which_set, image_builder,
+                 crop_builder, att=None):
         self.dialogue_id = id
-
-        self.objects = []
-        self.att = att
-        for o in objects:
+        self.image = None
+        if image is not None:
             self.image = Image(id=image["id"],
                                filename=image["file_name"],
                                width=image["width"],
                                height=image["height"],
-                               url=None,
-                               which_set=None,
-                               rcnn=False,
-                               image_builder=None)
-            new_obj = Object(id=o['id'],
-                             category=o['category'],
-                             category_id=o['category_id'],
-                             bbox=Bbox(o['bbox'], image["width"], image["height"]),
-                             area=None,
-                             segment=o['segment'],
-                             crop_builder=None,
-                             which_set=None,
-                             image=None)
-
-            self.objects.append(new_obj)
-            if o['id'] == object_id:
-                self._object = new_obj  # Keep ref on the object to find
-
-        self.question_ids = [qa['id'] for qa in qas]
-        self.questions = [qa['question'] for qa in qas]
-        self.answers = [qa['answer'] for qa in qas]
-        self.status = status
-
-        self.id_guess_object = id_guess_object
-
-        self.is_full_dialogue = True
-
-        self.user_data = dict()
-
-class Game_new2(object):
-
-    def __init__(self, id, object_id, guess_object_id, image, objects, qas, status, att=None):
-        self.dialogue_id = id
-
-        self.objects = []
-        self.att = att
-
-        self.question_ids = [qa['id'] for qa in qas]
-        self.questions = [qa['question'] for qa in qas]
-        self.answers = [qa['answer'] for qa in qas]
-        self.status = status
-
-        self.id_guess_object = guess_object_id
-
-        self.is_full_dialogue = True
-
-        self.user_data = dict()
-
-
-class Game(object):
-
-    def __init__(self, rcnn, id, object_id, guess_id, image, objects, qas, status, which_set, image_builder,
-                 crop_builder, att=None):
-        self.dialogue_id = id
-        self.image = Image(id=image["id"],
-                           filename=image["file_name"],
-                           width=image["width"],
-                           height=image["height"],
-                           url=image["coco_url"],
-                           which_set=which_set,
-                           rcnn=rcnn,
-                           image_builder=image_builder)
+                               url=image.get("coco_url", None),
+                               which_set=which_set,
+                               rcnn=rcnn,
+                               image_builder=image_builder)
         self.objects = []
         self.att = att
         for o in objects:
@@ -142,7 +66,7 @@ class Game(object):
                              category=o['category'],
                              category_id=o['category_id'],
                              bbox=Bbox(o['bbox'], image["width"], image["height"]),
-                             area=o['area'],
+                             area=o.get('area', None),
                              segment=o['segment'],
                              crop_builder=crop_builder,
                              which_set=which_set,
@@ -153,15 +77,45 @@ class Game(object):
                 self._object = new_obj  # Keep ref on the object to find
 
         self.question_ids = [qa['id'] for qa in qas]
-        self.questions = [qa['question'] for qa in qas]
-        self.answers = [qa['answer'] for qa in qas]
-        self.status = status
+        self.questions = [sys.intern(qa['question']) for qa in qas]
+        self.answers = [sys.intern(qa['answer']) for qa in qas]
+        self.status = sys.intern(status)
 
         self.id_guess_object = guess_id
 
         self.is_full_dialogue = True
+        self.success_turn = None
 
-        self.user_data = dict()
+        self._user_data = None
+        self._object_tensors = None
+
+    @property
+    def user_data(self):
+        if self._user_data is None:
+            self._user_data = dict()
+        return self._user_data
+
+    @user_data.setter
+    def user_data(self, user_data):
+        self._user_data = user_data
+
+    def get_object_tensors(self):
+        """
+        Spatial features (n_objects x 8), category ids and ids of the objects
+
+        They are computed at the first call and shared by the copies of the game (looper, batchifier splits...)
+        """
+        if self._object_tensors is None:
+            if len(self.objects) > 0:
+                spatials = get_spatial_feats([o.bbox.coco_bbox for o in self.objects], self.image.width, self.image.height)
+            else:
+                spatials = np.zeros((0, 8))
+            self._object_tensors = (spatials,
+                                    np.array([o.category_id for o in self.objects], dtype=np.int32),
+                                    np.array([o.id for o in self.objects], dtype=np.int64))
+            for array in self._object_tensors:
+                array.setflags(write=False)
+        return self._object_tensors
 
     # Optimization to pre-load image/crop inside the memory
     def bufferize(self):
@@ -211,107 +165,68 @@ class Game(object):
         return s
 
 
-class Game_guesser(object):
+# The following games only differ from Game by their constructor
 
-    def __init__(self, rcnn, id, object_id, id_guess_object, image, objects, qas, status, which_set, image_builder,
-                 crop_builder, att=None):
-        self.dialogue_id = id
-        self.image = Image(id=image["id"],
-                           filename=image["file_name"],
-                           width=image["width"],
-                           height=image["height"],
-                           url=image["coco_url"],
-                           which_set=which_set,
-                           rcnn=rcnn,
-                           image_builder=image_builder)
-        self.objects = []
-        self.att = att
-        for o in objects:
 
-            new_obj = Object(id=o['id'],
-                             category=o['category'],
-                             category_id=o['category_id'],
-                             bbox=Bbox(o['bbox'], image["width"], image["height"]),
-                             area=o['area'],
-                             segment=o['segment'],
-                             crop_builder=crop_builder,
-                             which_set=which_set,
-                             image=self.image)
+class Game_guesser(Game):
 
-            self.objects.append(new_obj)
-            if o['id'] == object_id:
-                self._object = new_obj  # Keep ref on the object to find
-
-        self.question_ids = [qa['id'] for qa in qas]
-        self.questions = [qa['question'] for qa in qas]
-        self.answers = [qa['answer'] for qa in qas]
-        self.status = status
+    __slots__ = ()
 
-        self.id_guess_object = id_guess_object
+    def __init__(self, rcnn, id, object_id, id_guess_object, image, objects, qas, status, which_set, image_builder,
+                 crop_builder, att=None):
+        super(Game_guesser, self).__init__(rcnn=rcnn, id=id, object_id=object_id, guess_id=id_guess_object,
+                                           image=image, objects=objects, qas=qas, status=status,
+                                           which_set=which_set, image_builder=image_builder,
+                                           crop_builder=crop_builder, att=att)
 
-        self.is_full_dialogue = True
-        self.success_turn = None
 
-        self.user_data = dict()
+class Game_new(Game):
 
-    # Optimization to pre-load image/crop inside the memory
-    def bufferize(self):
-        if self.image.image_loader is not None:
-            self.image.image_loader.bufferize()
-        if self.object.crop_loader is not None:
-            self.object.crop_loader.bufferize()
+    __slots__ = ()
 
-    # Optimization to unload image/crop outside the memory
-    def flush(self):
-        if self.image.image_loader is not None:
-            self.image.image_loader.flush()
-        if self.object.crop_loader is not None:
-            self.object.crop_loader.flush()
+    def __init__(self, id, object_id, id_guess_object, image, objects, qas, status, att=None):
+        super(Game_new, self).__init__(rcnn=False, id=id, object_id=object_id, guess_id=id_guess_object,
+                                       image=image, objects=objects, qas=qas, status=status,
+                                       which_set=None, image_builder=None, crop_builder=None, att=att)
 
-    @property
-    def object(self):
-        return self._object
 
-    @object.setter
-    def object(self, obj):
+class Game_guesser_new(Game):
 
-        assert isinstance(obj, Object), "Invalid object type"
-        self._object = obj
+    __slots__ = ()
 
-    def show(self, img_raw_dir, display_index=False, display_mask=False):
-        image_path = os.path.join(img_raw_dir, self.image.filename)
+    def __init__(self, id, object_id, id_guess_object, image, objects, qas, status,
+                 success_turn, att=None):
+        super(Game_guesser_new, self).__init__(rcnn=False, id=id, object_id=object_id, guess_id=id_guess_object,
+                                               image=image, objects=objects, qas=qas, status=status,
+                                               which_set=None, image_builder=None, crop_builder=None, att=att)
+        self.success_turn = success_turn
 
-        img = PImage.open(image_path)
-        draw = ImageDraw.Draw(img)
 
-        for i, obj in enumerate(self.objects):
-            if display_index:
-                draw.text((obj.bbox.x_center, self.image.height - obj.bbox.y_center), str(i))
-            if display_mask:
-                print("Show mask: Not yet implemented... sry")
+class Game_new2(Game):
 
-        img.show()
+    __slots__ = ()
 
-    def __str__(self):
-        s = "Game = id: {} / status: {}\n".format(self.dialogue_id, self.status)
-        s += " - {} \n".format(self.image)
-        s += " - {} \n".format(self.object)
-        s += " - Dialogue :\n"
-        for i, (q, a) in enumerate(zip(self.questions, self.answers + [""])):
-            s += "   {}) {} -> {}\n".format(i, q, a)
-        return s
+    def __init__(self, id, object_id, guess_object_id, image, objects, qas, status, att=None):
+        # Neither the image nor the objects are loaded
+        super(Game_new2, self).__init__(rcnn=False, id=id, object_id=object_id, guess_id=guess_object_id,
+                                        image=None, objects=[], qas=qas, status=status,
+                                        which_set=None, image_builder=None, crop_builder=None, att=att)
 
 
 class Image(object):
+
+    __slots__ = ("id", "rcnn", "filename", "width", "height", "old_url", "image_builder", "image_loader")
+
     def __init__(self, id, filename, width, height, url, which_set, rcnn, image_builder=None):
         self.id = id
         self.rcnn = rcnn
         self.filename = filename
         self.width = width
         self.height = height
-        self.url = "http://cocodataset.org/#explore?id={}".format(id)
         self.old_url = url
 
+        self.image_builder = None
+        self.image_loader = None
         if rcnn:
             self.image_builder = image_builder
         else:
@@ -319,6 +234,10 @@ class Image(object):
                 # self.filename = "{}.jpg".format(id)
                 self.image_loader = image_builder.build(id, which_set=which_set, filename=self.filename, optional=False)
 
+    @property
+    def url(self):
+        return "http://cocodataset.org/#explore?id={}".format(self.id)
+
     def get_image(self, **kwargs):
 
         if self.rcnn:
@@ -334,54 +253,109 @@ class Image(object):
 
 
 class Bbox(object):
+
+    __slots__ = ("x", "y", "width", "height", "im_height")
+
     def __init__(self, bbox, im_width, im_height):
         # Retrieve features (COCO format)
-        self.x_width = bbox[2]
-        self.y_height = bbox[3]
-        self.x_left = bbox[0]
-
         self.x = bbox[0]
         self.y = bbox[1]
         self.width = bbox[2]
         self.height = bbox[3]
 
-        self.x_right = self.x_left + self.x_width
+        self.im_height = im_height
 
-        self.y_upper = im_height - bbox[1]
-        self.y_lower = self.y_upper - self.y_height
+    # Other coordinates are computed on the fly
+    @property
+    def coco_bbox(self):
+        return [self.x, self.y, self.width, self.height]
+
+    @property
+    def x_width(self):
+        return self.width
+
+    @property
+    def y_height(self):
+        return self.height
+
+    @property
+    def x_left(self):
+        return self.x
 
-        self.x_center = self.x_left + 0.5 * self.x_width
-        self.y_center = self.y_lower + 0.5 * self.y_height
+    @property
+    def x_right(self):
+        return self.x + self.width
 
-        self.coco_bbox = bbox
+    @property
+    def y_upper(self):
+        return self.im_height - self.y
+
+    @property
+    def y_lower(self):
+        return self.im_height - self.y - self.height
+
+    @property
+    def x_center(self):
+        return self.x + 0.5 * self.width
+
+    @property
+    def y_center(self):
+        return self.y_lower + 0.5 * self.height
 
     def __str__(self):
         return "{0:5.2f}/{1:5.2f}".format(self.x_center, self.y_center)
 
 
+def compact_segment(segment):
+    """Store the polygons of a segment as a single flat float64 array (and the polygon split positions)"""
+    if not isinstance(segment, list) or len(segment) == 0 \
+            or not all(isinstance(polygon, list) for polygon in segment):
+        return segment, None  # e.g. RLE segment
+
+    splits = tuple(np.cumsum([len(polygon) for polygon in segment[:-1]]).tolist())
+    values = np.fromiter((v for polygon in segment for v in polygon), dtype=np.float64)
+    return values, splits
+
+
 class Object(object):
+
+    __slots__ = ("id", "category", "category_id", "bbox", "area", "_segment", "_segment_splits", "_rle_mask",
+                 "_image", "crop_loader", "crop_scale")
+
     def __init__(self, id, category, category_id, bbox, area, segment, crop_builder, image, which_set):
         self.id = id
-        self.category = category
+        self.category = sys.intern(category)
         self.category_id = category_id
         self.bbox = bbox
         self.area = area
-        self.segment = segment
+        self._segment, self._segment_splits = compact_segment(segment)
 
-        # https://github.com/cocodataset/cocoapi/blob/master/PythonAPI/pycocotools/mask.py
-        self.rle_mask = None
-        if use_coco:
-            self.rle_mask = cocoapi.frPyObjects(self.segment,
-                                                h=image.height,
-                                                w=image.width)
+        self._image = image
+        self._rle_mask = None
 
         self.crop_loader = None
+        self.crop_scale = None
         if crop_builder is not None:
             filename = "{}.jpg".format(image.id)
             self.crop_loader = crop_builder.build(id, filename=filename, which_set=which_set, bbox=bbox)
             self.crop_scale = crop_builder.scale
 
-    def get_mask(self):
+    @property
+    def segment(self):
+        if self._segment_splits is None:
+            return self._segment
+        return [polygon.tolist() for polygon in np.split(self._segment, self._segment_splits)]
+
+    # https://github.com/cocodataset/cocoapi/blob/master/PythonAPI/pycocotools/mask.py
+    @property
+    def rle_mask(self):
+        if self._rle_mask is None and use_coco:
+            self._rle_mask = cocoapi.frPyObjects(self.segment,
+                                                 h=self._image.height,
+                                                 w=self._image.width)
+        return self._rle_mask
+
+    def decode_mask(self):
         assert self.rle_mask is not None, "Mask option are not available, please compile and link cocoapi (cf. cocoapi/PythonAPI/setup.py)"
         tmp_mask = cocoapi.decode(self.rle_mask)
         if len(tmp_mask.shape) > 2:  # concatenate several mask into a single one
@@ -390,6 +364,26 @@ class Object(object):
 
         return tmp_mask.astype(np.float32)
 
+    def get_mask(self):
+        return mask_cache.get_mask(self.id, decode=self.decode_mask)
+
+    def get_image_mask(self, height, width):
+        """Return the mask resized to the image feature shape"""
+        def compute():
+            mask = resize_image(PImage.fromarray(self.get_mask()), height=height, width=width)
+            return np.array(mask)
+
+        return mask_cache.get_resized_mask((self.id, "image", height, width), compute)
+
+    def get_crop_mask(self, height, width):
+        """Return the mask cropped around the object and resized to the crop feature shape"""
+        def compute():
+            mask = scaled_crop_and_pad(raw_img=PImage.fromarray(self.get_mask()), bbox=self.bbox, scale=self.crop_scale)
+            mask = resize_image(mask, height=height, width=width)
+            return np.array(mask)
+
+        return mask_cache.get_resized_mask((self.id, "crop", height, width, self.crop_scale), compute)
+
     def get_crop(self, **kwargs):
         assert self.crop_loader is not None, "Invalid crop loader"
         return self.crop_loader.get_image(**kwargs)
@@ -398,76 +392,172 @@ class Object(object):
         return "Object = category: {} / center: {}".format(self.category, self.bbox)
 
 
+def create_game(raw_game, rcnn, which_set, image_builder, crop_builder):
+    return Game(rcnn=rcnn, id=raw_game['id'],
+                object_id=raw_game['object_id'],
+                guess_id=raw_game.get('guess_id', -1),
+                objects=raw_game['objects'],
+                qas=raw_game['qas'],
+                image=raw_game['image'],
+                status=raw_game['status'],
+                which_set=which_set,
+                image_builder=image_builder,
+                crop_builder=crop_builder)
+
+
+def create_game_guesser(raw_game, rcnn, which_set, image_builder, crop_builder):
+    return Game_guesser(rcnn=rcnn, id=raw_game['id'],
+                        object_id=raw_game['object_id'],
+                        id_guess_object=raw_game.get('id_guess_object', -1),
+                        objects=raw_game['objects'],
+                        qas=raw_game['qas'],
+                        image=raw_game['image'],
+                        status=raw_game['status'],
+                        which_set=which_set,
+                        image_builder=image_builder,
+                        crop_builder=crop_builder)
+
+
+def load_dataset_games(file, game_cstor, games_to_load, image_builder, crop_builder, num_workers=0):
+    """
+    Load the games of a file with num_workers processes (the binary cache is opened by Dataset, cf. load_game_cache)
+
+    :param game_cstor: create_game/create_game_guesser
+    """
+    game_cstor = functools.partial(game_cstor, image_builder=image_builder, crop_builder=crop_builder)
+
+    # Image/crop builders (e.g. h5py file handlers) cannot always be sent to other processes:
+    # games are then built in the main process, only the json parsing is parallelized.
+    if image_builder is None and crop_builder is None:
+        return load_games(file, game_cstor=game_cstor, games_to_load=games_to_load, num_workers=num_workers)
+    else:
+        raw_games = load_games(file, game_cstor=None, games_to_load=games_to_load, num_workers=num_workers)
+        return [game_cstor(raw_game) for raw_game in raw_games]
+
+
+_opened_caches = dict()  # GameCache opened by the current process
+
+# Secondary indexes of the GuessWhat datasets (cf. AbstractDataset.get_index)
+game_index_keys = dict(AbstractDataset.index_keys,
+                       game_id=lambda game: game.dialogue_id,
+                       status=lambda game: game.status,
+                       no_objects=lambda game: len(game.objects),
+                       last_answer=lambda game: game.answers[-1] if len(game.answers) > 0 else None)
+
+
+class CachedGameStore(object):
+    """Rebuild the games of a dataset from its memory-mapped cache (only the cache path is sent to other processes)"""
+
+    def __init__(self, cache, game_cstor):
+        self.cache = cache
+        self.game_cstor = game_cstor
+
+    def __getstate__(self):
+        return dict(cache_dir=self.cache.cache_dir, game_cstor=self.game_cstor)
+
+    def __setstate__(self, state):
+        cache_dir = state["cache_dir"]
+        if cache_dir not in _opened_caches:
+            _opened_caches[cache_dir] = GameCache(cache_dir, mmap=True)
+
+        self.cache = _opened_caches[cache_dir]
+        self.game_cstor = state["game_cstor"]
+
+    def __len__(self):
+        return len(self.cache)
+
+    def get_game(self, index):
+        return self.game_cstor(self.cache.get_game(index))
+
+
 class Dataset(AbstractDataset):
     """Loads the dataset."""
 
-    def __init__(self, folder, which_set, image_builder=None, crop_builder=None, rcnn=False, games_to_load=float("inf")):
+    index_keys = game_index_keys
+
+    def __init__(self, folder, which_set, image_builder=None, crop_builder=None, rcnn=False, games_to_load=float("inf"),
+                 use_cache=False, num_workers=0, cache_dir=None):
         file = '{}/guesswhat.{}.jsonl.gz'.format(folder, which_set)
-        games = []
 
         if games_to_load is None:
             games_to_load = float("inf")
 
         self.set = which_set
 
-        with gzip.open(file) as f:
-            for line in f:
-                line = line.decode("utf-8")
-                game = json.loads(line.strip('\n'))
+        game_cstor = functools.partial(create_game, rcnn=rcnn, which_set=which_set)
 
-                g = Game(rcnn=rcnn, id=game['id'],
-                         object_id=game['object_id'],
-                         guess_id=game.get('guess_id', -1),
-                         objects=game['objects'],
-                         qas=game['qas'],
-                         image=game['image'],
-                         status=game['status'],
-                         which_set=which_set,
-                         image_builder=image_builder,
-                         crop_builder=crop_builder)
-
-                games.append(g)
-
-                # If no_games_to_load is defined : Loading a certain number of games
-                if len(games) >= games_to_load:
-                    break
+        # With a cache, process pools can rebuild the games from their index (cf. generic/data_provider/shared_memory.py)
+        cache = load_game_cache(file, games_to_load, num_workers=num_workers, cache_dir=cache_dir) if use_cache else None
+        if isinstance(cache, GameCache):
+            self.game_store = CachedGameStore(cache, functools.partial(game_cstor,
+                                                                       image_builder=image_builder,
+                                                                       crop_builder=crop_builder))
+            games = [self.game_store.get_game(i) for i in range(len(cache))]
+        else:
+            games = load_dataset_games(file, game_cstor, games_to_load,
+                                       image_builder=image_builder,
+                                       crop_builder=crop_builder,
+                                       num_workers=num_workers)
 
         print("{} games were loaded...".format(len(games)))
         super(Dataset, self).__init__(games)
 
 
+class StreamingDataset(AbstractStreamingDataset):
+    """Streams the dataset: games are rebuilt from the jsonl.gz (or its binary cache) at every epoch."""
+
+    def __init__(self, folder, which_set, image_builder=None, crop_builder=None, rcnn=False, games_to_load=float("inf"),
+                 use_cache=False, num_workers=0, cache_dir=None):
+        self.file = '{}/guesswhat.{}.jsonl.gz'.format(folder, which_set)
+
+        if games_to_load is None:
+            games_to_load = float("inf")
+
+        self.set = which_set
+        self.games_to_load = games_to_load
+        self.game_cstor = functools.partial(create_game, rcnn=rcnn, which_set=which_set,
+                                            image_builder=image_builder, crop_builder=crop_builder)
+
+        # The cache is memory-mapped: it is not loaded into memory and provides the number of games for free
+        self.cache = None
+        if use_cache:
+            self.cache = load_game_cache(self.file, games_to_load, num_workers=num_workers, cache_dir=cache_dir)
+            no_games = len(self.cache)
+        else:
+            no_games = count_raw_games(self.file, games_to_load)
+
+        print("{} games will be streamed...".format(no_games))
+        super(StreamingDataset, self).__init__(no_games=no_games)
+
+    def generate_games(self):
+
+        if self.cache is not None:
+            raw_games = iter(self.cache)
+        else:
+            raw_games = read_raw_games(self.file, self.games_to_load)
+
+        for raw_game in raw_games:
+            yield self.game_cstor(raw_game)
+
+
 class Dataset_visg(AbstractDataset):
     """Loads the dataset."""
 
+    index_keys = game_index_keys
+
     def __init__(self, file, image_builder=None, crop_builder=None, rcnn=False,
-                 games_to_load=float("inf")):
-        games = []
+                 games_to_load=float("inf"), num_workers=0):
 
         if games_to_load is None:
             games_to_load = float("inf")
 
         self.set = 'visg'
 
-        with open(file) as f:
-            for line in f:
-                game = json.loads(line.strip('\n'))
-
-                g = Game(rcnn=rcnn, id=game['id'],
-                         object_id=game['object_id'],
-                         guess_id=game.get('guess_id', -1),
-                         objects=game['objects'],
-                         qas=game['qas'],
-                         image=game['image'],
-                         status=game['status'],
-                         which_set='visg',
-                         image_builder=image_builder,
-                         crop_builder=crop_builder)
-
-                games.append(g)
-
-                # If no_games_to_load is defined : Loading a certain number of games
-                if len(games) >= games_to_load:
-                    break
+        game_cstor = functools.partial(create_game, rcnn=rcnn, which_set='visg')
+        games = load_dataset_games(file, game_cstor, games_to_load,
+                                   image_builder=image_builder,
+                                   crop_builder=crop_builder,
+                                   num_workers=num_workers)
 
         print("{} games were loaded...".format(len(games)))
         super(Dataset_visg, self).__init__(games)
@@ -476,237 +566,108 @@ class Dataset_visg(AbstractDataset):
 class anaDataset(AbstractDataset):
     """Loads the dataset."""
 
+    index_keys = game_index_keys
+
     def __init__(self, file, image_builder=None, crop_builder=None, rcnn=False,
-                 games_to_load=float("inf")):
-        # file = '{}/guesswhat.{}.jsonl.gz'.format(folder, which_set)
-        games = []
+                 games_to_load=float("inf"), num_workers=0):
 
         if games_to_load is None:
             games_to_load = float("inf")
 
         self.set = "ana"
 
-        with open(file) as f:
-            for line in f:
-                # line = line.decode("utf-8")
-                game = json.loads(line.strip('\n'))
-
-                g = Game_guesser(rcnn=rcnn, id=game['id'],
-                         object_id=game['object_id'],
-                         id_guess_object=game.get('id_guess_object', -1),
-                         objects=game['objects'],
-                         qas=game['qas'],
-                         image=game['image'],
-                         status=game['status'],
-                         which_set='ana',
-                         image_builder=image_builder,
-                         crop_builder=crop_builder)
-
-                games.append(g)
-
-                # If no_games_to_load is defined : Loading a certain number of games
-                if len(games) >= games_to_load:
-                    break
+        game_cstor = functools.partial(create_game_guesser, rcnn=rcnn, which_set='ana')
+        games = load_dataset_games(file, game_cstor, games_to_load,
+                                   image_builder=image_builder,
+                                   crop_builder=crop_builder,
+                                   num_workers=num_workers)
 
         print("{} games were loaded...".format(len(games)))
         super(anaDataset, self).__init__(games)
 
 
-class CropDataset(AbstractDataset):
+class CropDataset(AbstractCropDataset):
     """
     Each game contains no question/answers but a new object
     """
 
-    def __init__(self, dataset, expand_objects):
-        old_games = dataset.get_data()
-        new_games = []
-
-        for g in old_games:
-            if expand_objects:
-                new_games += self.split(g)
-            else:
-                new_games += self.update_ref(g)
-        super(CropDataset, self).__init__(new_games)
+    index_keys = game_index_keys
 
     @classmethod
     def load(cls, folder, which_set, image_builder=None, crop_builder=None, expand_objects=False, games_to_load=float("inf")):
-        return CropDataset(Dataset(folder, which_set, image_builder, crop_builder, games_to_load), expand_objects=expand_objects)
+        return CropDataset(Dataset(folder, which_set, image_builder, crop_builder, games_to_load=games_to_load),
+                           expand_objects=expand_objects)
 
-    def split(self, game):
-        games = []
-        for obj in game.objects:
-            new_game = copy.copy(game)
-            new_game.questions = [""]
-            new_game.question_ids = [0]
-            new_game.answers = [""]
+    @staticmethod
+    def create_crop_game(game, object_index):
+        new_game = AbstractCropDataset.create_crop_game(game, object_index)
+        new_game.questions = [""]
+        new_game.question_ids = [0]
+        new_game.answers = [""]
 
-            # update object reference
-            new_game.object = [o for o in game.objects if o.id == obj.id][0]
+        return new_game
 
-            # Hack the image id to differentiate objects
-            new_game.image = copy.copy(game.image)
-            new_game.image.id = obj.id
 
-            games.append(new_game)
+def dump_samples_into_dataset(data, save_path, tokenizer, name="model", true_id=False):
 
-        return games
+    def to_dict(d):
+        dialogue = d["dialogue"]
+        game = d["game"]
 
-    def update_ref(self, game):
+        qas = []
+        start = 1
+        for k, word in enumerate(dialogue):
+            if word == tokenizer.yes_token or \
+                    word == tokenizer.no_token or \
+                    word == tokenizer.non_applicable_token:
+                q = tokenizer.decode(dialogue[start:k - 1])
+                a = tokenizer.decode([dialogue[k]])
 
-        new_game = copy.copy(game)  # Beware shallow copy!
-        new_game.questions = [""]
-        new_game.question_ids = [0]
-        new_game.answers = [""]
+                prob_obj = round_probabilities(d["prob_objects"][len(qas), :len(game.objects)])
 
-        # Hack the image id to differentiate objects
-        new_game.image = copy.copy(game.image)  # Beware shallow copy!
-        new_game.image.id = game.object.id
+                qas.append({"question": q,
+                            "answer": a[1:-1],
+                            "id": k,
+                            "p": prob_obj})
 
-        return [new_game]
+                start = k + 1
 
+        return {"id": game.dialogue_id if true_id else 0,
+                "qas": qas,
+                "image": image_to_dict(game.image),
+                "objects": objects_to_list(game.objects, with_segment=False),
+                "object_id": d["object_id"],
+                "guess_object_id": d["guess_object_id"],
+                "status": "success" if d["success"] else "failure"}
 
-def dump_samples_into_dataset(data, save_path, tokenizer, name="model", true_id=False):
-    with gzip.open(save_path.format('guesswhat.' + name + '.jsonl.gz'), 'wb') as f:
-        for _, d in enumerate(data):
-            dialogue = d["dialogue"]
-            game = d["game"]
-            object_id = d["object_id"]
-            success = d["success"]
-            prob_objects = d["prob_objects"]
-            guess_object_id = d["guess_object_id"]
-
-            sample = {}
-
-            qas = []
-            start = 1
-            for k, word in enumerate(dialogue):
-                if word == tokenizer.yes_token or \
-                        word == tokenizer.no_token or \
-                        word == tokenizer.non_applicable_token:
-                    q = tokenizer.decode(dialogue[start:k - 1])
-                    a = tokenizer.decode([dialogue[k]])
-
-                    prob_obj = list(prob_objects[len(qas), :len(game.objects)])
-                    prob_obj = [str(round(p, 3)) for p in prob_obj]  # decimal are not supported y default in json encoder
-
-                    qas.append({"question": q,
-                                "answer": a[1:-1],
-                                "id": k,
-                                "p": prob_obj})
-
-                    start = k + 1
-
-            sample["id"] = game.dialogue_id if true_id else 0
-            sample["qas"] = qas
-            sample["image"] = {
-                "id": game.image.id,
-                "width": game.image.width,
-                "height": game.image.height,
-                "coco_url": game.image.url
-            }
-
-            sample["objects"] = [{"id": o.id,
-                                  "category_id": o.category_id,
-                                  "category": o.category,
-                                  "area": o.area,
-                                  "bbox": o.bbox.coco_bbox,
-                                  "segment": [],  # no segment to avoid making the file to big
-                                  } for o in game.objects]
-
-            sample["object_id"] = object_id
-            sample["guess_object_id"] = guess_object_id
-            sample["status"] = "success" if success else "failure"
-
-            f.write(str(json.dumps(sample)).encode())
-            f.write(b'\n')
+    with GameWriter(save_path.format('guesswhat.' + name + '.jsonl.gz')) as writer:
+        writer.append([to_dict(d) for d in data])
 
 
 def dump_oracle(oracle_data, games, save_path, name="oracle"):
-    with gzip.open(save_path.format('guesswhat.' + name + '.jsonl.gz'), 'wb') as f:
-        for game in games:
 
-            qas = oracle_data[game.dialogue_id]
-            sample = {}
+    def to_dict(game):
+        qas = oracle_data[game.dialogue_id]
 
-            # check that question/answer are correctly sorted
-            for qa, q_id in zip(qas, game.question_ids):
-                assert qa["id"] == q_id
+        # check that question/answer are correctly sorted
+        for qa, q_id in zip(qas, game.question_ids):
+            assert qa["id"] == q_id
 
-            for qo, qh in zip(qas, game.questions):
-                assert qo["question"] == qh, "{} vs {}".format(qo, qh)
+        for qo, qh in zip(qas, game.questions):
+            assert qo["question"] == qh, "{} vs {}".format(qo, qh)
 
-            sample["id"] = game.dialogue_id
-            sample["qas"] = qas
-            sample["image"] = {
-                "id": game.image.id,
-                "width": game.image.width,
-                "height": game.image.height,
-                "coco_url": game.image.url
-            }
+        return {"id": game.dialogue_id,
+                "qas": qas,
+                "image": image_to_dict(game.image),
+                "objects": objects_to_list(game.objects),
+                "object_id": game.object.id,
+                "guess_object_id": game.object.id,
+                "status": game.status}
 
-            sample["objects"] = [{"id": o.id,
-                                  "category_id": o.category_id,
-                                  "category": o.category,
-                                  "area": o.area,
-                                  "bbox": o.bbox.coco_bbox,
-                                  "segment": o.segment,
-                                  } for o in game.objects]
-
-            sample["object_id"] = game.object.id
-            sample["guess_object_id"] = game.object.id
-            sample["status"] = game.status
-
-            f.write(str(json.dumps(sample)).encode())
-            f.write(b'\n')
+    with GameWriter(save_path.format('guesswhat.' + name + '.jsonl.gz')) as writer:
+        writer.append([to_dict(game) for game in games])
 
 
 def dump_dataset(games, save_path, tokenizer, name="model"):
-
-    with gzip.open(save_path.format('guesswhat.' + name + '.jsonl.gz'), 'wb') as f:
-
-        for _, game in enumerate(games):
-
-            sample = {}
-
-            qas = []
-            start = 1
-            for k, word in enumerate(dialogue):
-                if word == tokenizer.yes_token or \
-                        word == tokenizer.no_token or \
-                        word == tokenizer.non_applicable_token:
-                    q = tokenizer.decode(dialogue[start:k - 1])
-                    a = tokenizer.decode([dialogue[k]])
-
-                    prob_obj = list(prob_objects[len(qas), :len(game.objects)])
-                    prob_obj = [str(round(p, 3)) for p in prob_obj]  # decimal are not supported y default in json encoder
-
-                    qas.append({"question": q,
-                                "answer": a[1:-1],
-                                "id": k,
-                                "p": prob_obj})
-
-                    start = k + 1
-
-            sample["id"] = game.dialogue_id if true_id else 0
-            sample["qas"] = qas
-            sample["image"] = {
-                "id": game.image.id,
-                "width": game.image.width,
-                "height": game.image.height,
-                "coco_url": game.image.url
-            }
-
-            sample["objects"] = [{"id": o.id,
-                                  "category_id": o.category_id,
-                                  "category": o.category,
-                                  "area": o.area,
-                                  "bbox": o.bbox.coco_bbox,
-                                  "segment": [],  # no segment to avoid making the file to big
-                                  } for o in game.objects]
-
-            sample["object_id"] = object_id
-            sample["guess_object_id"] = guess_object_id
-            sample["status"] = "success" if success else "failure"
-
-            f.write(str(json.dumps(sample)).encode())
-            f.write(b'\n')
\ No newline at end of file
+    with GameWriter(save_path.format('guesswhat.' + name + '.jsonl.gz')) as writer:
+        writer.append([game_to_dict(game, with_segment=False) for game in games])
@@ -1,13 +1,21 @@
-from nltk.tokenize import TweetTokenizer
 import json
 import numpy as np
 
+from generic.data_provider.regex_tokenizer import create_word_tokenizer
+from generic.utils.lru_cache import LRUCache
+from guesswhat.data_provider.question_store import encode_question
+
 
 class GWTokenizer:
-    def __init__(self, dictionary_file):
+    def __init__(self, dictionary_file, word_tokenizer="nltk", cache_size=100000):
         with open(dictionary_file, 'r') as f:
             self.word2i = json.load(f)['word2i']
-        self.wpt = TweetTokenizer(preserve_case=False)
+        self.word_tokenizer = word_tokenizer
+        self.wpt = create_word_tokenizer(word_tokenizer)
+
+        # The same questions are encoded again and again (frequent questions, dialogue history of the looper...)
+        # Tokens are stored as tuples without start/stop tokens (0 to disable the cache)
+        self.encode_cache = LRUCache(cache_size)
 
         if "<stop_dialogue>" not in self.word2i:
             self.word2i["<stop_dialogue>"] = len(self.word2i)
@@ -38,6 +46,7 @@ class GWTokenizer:
         self.yes_token = self.word2i[self.yes_word]
         self.no_token = self.word2i[self.no_word]
         self.non_applicable_token = self.word2i[self.non_applicable_word]
+        self.unk_token = self.word2i.get("<unk>")  # None: unknown words raise a KeyError (as before)
 
         assert self.padding_token == 0, "Padding token must be equal to zero"
 
@@ -50,6 +59,9 @@ class GWTokenizer:
 
         self.oracle_idx_to_answers = {v: k for k, v in self.oracle_answers_to_idx.items()}
 
+        # Vocabulary as an array to decode token matrices at once
+        self.i2word_array = np.array([self.i2word.get(i, "<unk>") for i in range(max(self.i2word) + 1)], dtype=object)
+
     def encode(self, question, is_answer=False, add_start_token=False, add_stop_token=False):
 
         if add_start_token:
@@ -60,16 +72,90 @@ class GWTokenizer:
             token = self.format_answer(question)
             tokens.append(self.word2i[token])
         else:
-            for token in self.wpt.tokenize(question):
-                if token not in self.word2i:
-                    token = '<unk>'
-                tokens.append(self.word2i[token])
+            tokens += self.encode_words(question)
 
             if add_stop_token and tokens[-1] != self.stop_token:
                 tokens += [self.stop_token]
 
         return tokens
 
+    def encode_words(self, question):
+        words = self.encode_cache.get(question)
+        if words is None:
+            if self.unk_token is not None:
+                words = tuple(self.word2i.get(token, self.unk_token) for token in self.wpt.tokenize(question))
+            else:
+                words = tuple(self.word2i[token] if token in self.word2i else self.word2i['<unk>']
+                              for token in self.wpt.tokenize(question))
+            self.encode_cache.put(question, words)
+        return words
+
+    def get_cache_stats(self):
+        """Hit/miss statistics of the encode cache (of the current process)"""
+        return self.encode_cache.get_stats()
+
+    def encode_batch(self, questions, is_answer=False, add_start_token=False, add_stop_token=False, max_seq_length=0,
+                     question_ids=None, token_store=None):
+        """
+        Encode a list of questions (or answers) into a padded matrix
+
+        :param question_ids: ids of the questions, to read their tokens from the token store (if any)
+        :param token_store: QuestionTokenStore (cf. question_store.py)
+        :return: int32 matrix (batch x max_seq_length) padded with padding_token, int32 lengths (after truncation)
+        """
+        if token_store is not None and not is_answer:
+            tokens = [encode_question(self, token_store, q_id, q,
+                                      add_start_token=add_start_token, add_stop_token=add_stop_token)
+                      for q_id, q in zip(question_ids, questions)]
+        else:
+            tokens = [self.encode(q, is_answer=is_answer,
+                                  add_start_token=add_start_token, add_stop_token=add_stop_token)
+                      for q in questions]
+
+        seq_length = np.array([len(t) for t in tokens], dtype=np.int32)
+        if max_seq_length > 0:
+            seq_length = np.minimum(seq_length, max_seq_length)
+            tokens = [t[:max_seq_length] for t in tokens]
+        else:
+            max_seq_length = seq_length.max() if len(tokens) > 0 else 0
+
+        padded_tokens = np.full((len(tokens), max_seq_length), fill_value=self.padding_token, dtype=np.int32)
+        mask = np.arange(max_seq_length) < seq_length[:, None]
+        padded_tokens[mask] = np.fromiter((t for seq in tokens for t in seq), dtype=np.int32, count=seq_length.sum())
+
+        return padded_tokens, seq_length
+
+    def get_lengths(self, tokens, seq_length=None, stop_tokens=None):
+        """
+        Compute the length of every sequence of a token matrix
+
+        :param tokens: token matrix (batch x time)
+        :param seq_length: length of the sequences. If None, the sequences end before the first padding token
+        :param stop_tokens: if a sequence contains a stop token, it ends after the first one (included)
+        """
+        tokens = np.asarray(tokens)
+        no_steps = tokens.shape[1]
+
+        if seq_length is None:
+            is_padding = tokens == self.padding_token
+            seq_length = np.where(is_padding.any(axis=1), is_padding.argmax(axis=1), no_steps)
+        seq_length = np.asarray(seq_length).astype(np.int64)
+
+        if stop_tokens is not None and len(stop_tokens) > 0:
+            is_stop = np.isin(tokens, stop_tokens)
+            seq_length = np.where(is_stop.any(axis=1), is_stop.argmax(axis=1) + 1, seq_length)
+
+        return seq_length
+
+    def decode_batch(self, tokens, seq_length=None, stop_tokens=None):
+        """
+        Decode a token matrix (batch x time) into a list of strings (cf. get_lengths for the truncation)
+        """
+        tokens = np.asarray(tokens)
+        seq_length = self.get_lengths(tokens, seq_length=seq_length, stop_tokens=stop_tokens)
+        words = self.i2word_array[tokens]
+        return [' '.join(w[:l]) for w, l in zip(words, seq_length)]
+
     @staticmethod
     def format_answer(answer):
         return '<' + answer.lower() + '>'
@@ -20,12 +20,28 @@ class LooperBatchifier(AbstractBatchifier):
             for game in games:
                 new_games_dict[game.image.id] = game
 
+            # The order is kept: the Iterator shuffles the games with its own (seeded) rng
             games = [game for game in new_games_dict.values()]
-            random.shuffle(games)
 
         return games
 
-    def split(self, games):
+    def filter_dataset(self, dataset):
+
+        if self.generate_new_games:
+            # Same as filter: keep the last game of every image
+            return dataset.one_game_per_image(keep_last=True)
+
+        return list(dataset.get_data())
+
+    def cost_profile(self):
+        # the batch is the list of games (the dialogues are generated by the looper)
+        return "io" if self.bufferize else "light"
+
+    def bucket_key(self, game):
+        # the dialogues are generated: only the objects of the guesser are padded
+        return len(game.objects),
+
+    def split(self, games, rng=random):
 
         new_games = []
         for i, g in enumerate(games):
@@ -44,7 +60,7 @@ class LooperBatchifier(AbstractBatchifier):
 
             # Pick random new object
             if self.generate_new_games:
-                random_index = random.randint(0, len(g.objects) - 1)
+                random_index = rng.randint(0, len(g.objects) - 1)
                 g.object = g.objects[random_index]
 
             new_games.append(g)
@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import numpy as np
+
+from generic.utils.lru_cache import LRUCache
+
+
+# Why a mask cache?
+# Object.get_mask decodes the COCO polygons (cocoapi) at every call and the batchifiers resize the full-size mask
+# (PIL) for every batch. Decoded masks are kept run-length encoded (a few KB instead of a full float32 image)
+# in a LRU cache, and the resized masks (a few hundred bytes) in a second LRU cache keyed by the target shape.
+# The RLE masks of a whole split can also be precomputed once (cf. guesswhat/preprocess_data/extract_masks.py)
+# and memory-mapped from disk.
+
+MASK_STORE_VERSION = 1
+
+mask_store_meta_filename = "meta.json"
+
+
+def encode_rle(mask):
+    """
+    Run-length encode a binary mask (row-major order), the first run counts zeros
+
+    :return: (shape, run lengths)
+    """
+    flat = np.asarray(mask).ravel() > 0
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate([[0], changes, [flat.size]])
+    counts = np.diff(bounds)
+    if flat.size > 0 and flat[0]:
+        counts = np.concatenate([[0], counts])
+    return tuple(np.asarray(mask).shape), counts.astype(np.uint32)
+
+
+def decode_rle(rle, dtype=np.float32):
+    shape, counts = rle
+    values = np.arange(len(counts)) % 2
+    return np.repeat(values.astype(dtype), counts).reshape(shape)
+
+
+class MaskStore(object):
+    """Memory-mapped RLE masks of a split (keyed by object id)"""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+        with open(os.path.join(store_dir, mask_store_meta_filename), 'r') as f:
+            self.meta = json.load(f)
+
+        self.object_ids = np.load(os.path.join(store_dir, "object_ids.npy"), mmap_mode='r')
+        self.shapes = np.load(os.path.join(store_dir, "shapes.npy"), mmap_mode='r')
+        self.offsets = np.load(os.path.join(store_dir, "offsets.npy"), mmap_mode='r')
+        self.counts = np.load(os.path.join(store_dir, "counts.npy"), mmap_mode='r')
+
+    # Only send the path to other processes (memmap would be fully copied otherwise)
+    def __getstate__(self):
+        return self.store_dir
+
+    def __setstate__(self, store_dir):
+        self.__init__(store_dir)
+
+    def __len__(self):
+        return len(self.object_ids)
+
+    def get(self, object_id):
+        row = np.searchsorted(self.object_ids, object_id)
+        if row >= len(self.object_ids) or self.object_ids[row] != object_id:
+            return None
+        return tuple(self.shapes[row].tolist()), np.array(self.counts[self.offsets[row]:self.offsets[row + 1]])
+
+    @staticmethod
+    def build(objects, store_dir):
+        """
+        Precompute the RLE masks of objects
+
+        :param objects: iterator over Object (the masks are decoded with get_mask)
+        :param store_dir: where to store the masks
+        """
+        rles = dict()
+        for obj in objects:
+            if obj.id not in rles:
+                rles[obj.id] = encode_rle(obj.get_mask())
+
+        object_ids = np.array(sorted(rles.keys()), dtype=np.int64)
+        counts = [rles[i][1] for i in object_ids]
+        lengths = np.array([len(c) for c in counts], dtype=np.int64)
+
+        arrays = dict(object_ids=object_ids,
+                      shapes=np.array([rles[i][0] for i in object_ids], dtype=np.int32).reshape(-1, 2),
+                      offsets=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+                      counts=np.concatenate(counts).astype(np.uint32) if len(counts) > 0
+                      else np.zeros(0, dtype=np.uint32))
+
+        tmp_dir = store_dir + ".tmp{}".format(os.getpid())
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, name + ".npy"), array)
+        with open(os.path.join(tmp_dir, mask_store_meta_filename), 'w') as f:
+            json.dump(dict(version=MASK_STORE_VERSION, no_masks=len(object_ids)), f)
+
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)
+        os.rename(tmp_dir, store_dir)
+
+
+class MaskCache(object):
+    """
+    Two-level cache of the object masks
+     - decoded masks are stored as RLE (LRU bounded by max_masks), precomputed stores are looked up first
+     - resized masks are stored as arrays (LRU bounded by max_resized_masks) keyed by (object, kind, shape)
+    """
+
+    def __init__(self, max_masks=20000, max_resized_masks=100000):
+        self.masks = LRUCache(max_masks)
+        self.resized_masks = LRUCache(max_resized_masks)
+        self.stores = []
+
+    def add_store(self, store):
+        self.stores.append(store)
+
+    def get_mask(self, object_id, decode):
+        """
+        Return the full-size mask of an object
+
+        :param object_id: id of the object
+        :param decode: function that decodes the mask if it is neither cached nor precomputed
+        """
+        rle = self.masks.get(object_id)
+
+        if rle is None:
+            for store in self.stores:
+                rle = store.get(object_id)
+                if rle is not None:
+                    break
+
+        if rle is None:
+            mask = decode()
+            self.masks.put(object_id, encode_rle(mask))
+            return mask
+
+        self.masks.put(object_id, rle)
+        return decode_rle(rle)
+
+    def get_resized_mask(self, key, compute):
+        """
+        Return a resized mask
+
+        :param key: (object id, kind, height, width)
+        :param compute: function that computes the resized mask if it is not cached
+        """
+        mask = self.resized_masks.get(key)
+        if mask is None:
+            mask = compute()
+            mask.setflags(write=False)  # the same array is shared by several batches
+            self.resized_masks.put(key, mask)
+        return mask
+
+    def clear(self):
+        self.masks.clear()
+        self.resized_masks.clear()
+
+
+# Cache shared by all the objects of the current process
+mask_cache = MaskCache()
+
+
+def load_mask_store(store_dir):
+    """Use the precomputed masks of store_dir (cf. guesswhat/preprocess_data/extract_masks.py)"""
+    store = MaskStore(store_dir)
+    mask_cache.add_store(store)
+    return store
@@ -1,25 +1,27 @@
 import numpy as np
 import collections
-from PIL import Image
+import random
 
 from generic.data_provider.batchifier import AbstractBatchifier, batchifier_split_helper
 
-from generic.data_provider.image_preprocessors import get_spatial_feat, resize_image, scaled_crop_and_pad
-from generic.data_provider.nlp_utils import padder, padder_3d
+from generic.data_provider.image_preprocessors import get_spatial_feat
+from generic.data_provider.nlp_utils import padder_3d, GloveMatrix
+from guesswhat.data_provider.question_store import encode_question
 from itertools import chain
 
 
 class OracleBatchifier(AbstractBatchifier):
 
-    def __init__(self, tokenizer, sources, glove=None, ignore_NA=False, status=list(), split_mode=0):
+    def __init__(self, tokenizer, sources, glove=None, ignore_NA=False, status=list(), split_mode=0, token_store=None):
         self.sources = sources
         self.status = status
         self.tokenizer = tokenizer
         self.ignore_NA = ignore_NA
         self.glove = glove
         self.split_mode = split_mode
+        self.token_store = token_store
 
-    def split(self, games):
+    def split(self, games, rng=random):
         return batchifier_split_helper(games, split_mode=self.split_mode)
 
     def filter(self, games):
@@ -32,26 +34,52 @@ class OracleBatchifier(AbstractBatchifier):
 
         return games
 
+    def filter_dataset(self, dataset):
+
+        if not dataset.has_index("status"):
+            return self.filter(dataset.get_data())
+
+        criteria = dict()
+        if len(self.status) > 0:
+            criteria["status"] = self.status
+
+        if self.ignore_NA:
+            criteria["last_answer"] = [a for a in dataset.get_index("last_answer") if a != "N/A"]
+
+        return dataset.select(**criteria)
+
+    def bucket_key(self, game):
+        if 'question' not in self.sources:
+            return ()
+        return len(encode_question(self.tokenizer, self.token_store, game.question_ids[0], game.questions[0])),
+
     def apply(self, games, skip_targets=False):
 
         batch = collections.defaultdict(list)
         batch["raw"] = games
         batch_size = len(games)
 
+        # Encode and pad the questions of the batch at once
+        if 'question' in self.sources or 'glove' in self.sources:
+            assert all(len(game.questions) == 1 for game in games)
+            questions, seq_length = self.tokenizer.encode_batch([game.questions[0] for game in games],
+                                                                question_ids=[game.question_ids[0] for game in games],
+                                                                token_store=self.token_store)
+
+        if 'question' in self.sources:
+            batch['question'], batch['seq_length'] = questions, seq_length
+            # questions = []
+            # for q, a in zip(game.questions[:-1], game.answers[:-1]):
+            #     questions.append(self.tokenizer.encode(q, add_stop_token=True))
+            #     questions.append(self.tokenizer.encode(a, is_answer=True))
+            # questions.append(self.tokenizer.encode(game.questions[-1], add_stop_token=True))
+            # batch['question'].append(list(chain.from_iterable(questions)))
+
         for i, game in enumerate(games):
 
-            if 'question' in self.sources:
-                assert len(game.questions) == 1
-                batch['question'].append(self.tokenizer.encode(game.questions[0]))
-                # questions = []
-                # for q, a in zip(game.questions[:-1], game.answers[:-1]):
-                #     questions.append(self.tokenizer.encode(q, add_stop_token=True))
-                #     questions.append(self.tokenizer.encode(a, is_answer=True))
-                # questions.append(self.tokenizer.encode(game.questions[-1], add_stop_token=True))
-                # batch['question'].append(list(chain.from_iterable(questions)))
-
-            if 'glove' in self.sources:
-                words = self.tokenizer.decode(batch['question'][i])
+            if 'glove' in self.sources and not isinstance(self.glove, GloveMatrix):
+                # (the whole padded question matrix is looked up at once with a GloveMatrix, see below)
+                words = self.tokenizer.decode(questions[i][:seq_length[i]])
                 glove_vectors = self.glove.get_embeddings(words)
                 batch['glove'].append(glove_vectors)
 
@@ -79,32 +107,27 @@ class OracleBatchifier(AbstractBatchifier):
 
             if 'image_mask' in self.sources:
                 assert "image" in batch, "mask input require the image source"
-                mask = game.object.get_mask()
-
                 ft_width, ft_height = img.shape[1], img.shape[0]
                 # ft_width, ft_height = batch['image'][-1].shape[1], \
                 #                       batch['image'][-1].shape[0]  # Use the image feature size (not the original img size)
 
-                mask = resize_image(Image.fromarray(mask), height=ft_height, width=ft_width)
+                # decoded/resized masks are cached (cf. mask_cache.py)
+                mask = game.object.get_image_mask(height=ft_height, width=ft_width)
                 batch['image_mask'].append(np.array(mask))
 
             if 'crop_mask' in self.sources:
                 assert "crop" in batch, "mask input require the crop source"
-                cmask = game.object.get_mask()
-
                 ft_width, ft_height = batch['crop'][-1].shape[1], \
                                       batch['crop'][-1].shape[0]  # Use the crop feature size (not the original img size)
 
-                cmask = scaled_crop_and_pad(raw_img=Image.fromarray(cmask), bbox=game.object.bbox, scale=game.object.crop_scale)
-                cmask = resize_image(cmask, height=ft_height, width=ft_width)
+                cmask = game.object.get_crop_mask(height=ft_height, width=ft_width)
                 batch['crop_mask'].append(np.array(cmask))
 
-        # Pad the questions
-        if 'question' in self.sources:
-            batch['question'], batch['seq_length'], _ = padder(batch['question'], padding_symbol=self.tokenizer.padding_token)
-
         if 'glove' in self.sources:
             # (?, 16, 300)   (batch, max num word, glove emb size)
-            batch['glove'], _ = padder_3d(batch['glove'])
+            if isinstance(self.glove, GloveMatrix):
+                batch['glove'] = self.glove.lookup(questions)
+            else:
+                batch['glove'], _ = padder_3d(batch['glove'])
 
         return batch
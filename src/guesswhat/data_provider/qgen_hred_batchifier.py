@@ -4,30 +4,42 @@ import collections
 
 from generic.data_provider.batchifier import AbstractBatchifier, BatchifierSplitMode, batchifier_split_helper
 
-from generic.data_provider.nlp_utils import padder, padder_3d, mask_generate
+from generic.data_provider.nlp_utils import padder_ragged_3d, mask_generate
+from guesswhat.data_provider.question_store import encode_question
 import copy
+import random
 
 
 def compute_cumulative_rewards(reward, gamma=1):
-    if not isinstance(gamma, list):
-        gamma = [gamma] * len(reward)
+    """
+    Discounted cumulative rewards: cum_reward[i] = reward[i] + gamma[i] * cum_reward[i+1]
 
-    cum_reward = [reward[-1]]
-    for i, (r, g) in enumerate(zip(reversed(reward[:-1]), reversed(gamma[:-1]))):
-        cum_reward += [r + g * cum_reward[i]]
+    :param reward: rewards of the steps (..., no_steps), e.g. a whole batch of dialogues at once
+    :param gamma: discount factor (float or one per step)
+    :return: float array with the shape of reward
+    """
+    reward = np.asarray(reward, dtype=np.float64)
+    gamma = np.broadcast_to(np.asarray(gamma, dtype=np.float64), reward.shape)
 
-    return cum_reward[::-1]
+    # discount[..., i, k] = gamma[i] * ... * gamma[k-1] for k >= i (cumulative products along the rows)
+    steps = np.arange(reward.shape[-1])
+    shifted_gamma = np.concatenate([np.ones(gamma.shape[:-1] + (1,)), gamma[..., :-1]], axis=-1)
+    discount = np.cumprod(np.where(steps[None, :] > steps[:, None], shifted_gamma[..., None, :], 1.), axis=-1)
+    discount[..., steps[None, :] < steps[:, None]] = 0.
+
+    return np.einsum('...ik,...k->...i', discount, reward)
 
 
 class HREDBatchifier(AbstractBatchifier):
 
-    def __init__(self, tokenizer, sources, status=list(), glove=None, generate=False, supervised=False):
+    def __init__(self, tokenizer, sources, status=list(), glove=None, generate=False, supervised=False, token_store=None):
         self.sources = sources
         self.status = status
         self.tokenizer = tokenizer
         self.glove = glove
         self.generate = generate
         self.supervised = supervised
+        self.token_store = token_store
 
     def filter(self, games):
 
@@ -36,7 +48,18 @@ class HREDBatchifier(AbstractBatchifier):
 
         return games
 
-    def split(self, games):
+    def filter_dataset(self, dataset):
+
+        if len(self.status) > 0 and dataset.has_index("status"):
+            return dataset.select(status=self.status)
+
+        return self.filter(dataset.get_data())
+
+    def bucket_key(self, game):
+        # questions are padded to 13 tokens, only the number of turns varies (+ the dummy question)
+        return len(game.questions) + int(self.generate),
+
+    def split(self, games, rng=random):
 
         games = batchifier_split_helper(games, split_mode=0)
         # games = batchifier_split_helper(games, split_mode=BatchifierSplitMode.DialogueHistory)
@@ -78,7 +101,8 @@ class HREDBatchifier(AbstractBatchifier):
         for i, game in enumerate(games):
 
             # Encode question answers
-            q_tokens = [self.tokenizer.encode(q, add_start_token=True, add_stop_token=True) for q in game.questions]
+            q_tokens = [encode_question(self.tokenizer, self.token_store, q_id, q, add_start_token=True, add_stop_token=True)
+                        for q_id, q in zip(game.question_ids, game.questions)]
             a_tokens = [self.tokenizer.encode(a, is_answer=True) for a in game.answers]
 
             # reward
@@ -88,21 +112,13 @@ class HREDBatchifier(AbstractBatchifier):
                 # total_number_question = len(full_game.question_ids) - int(game.user_data["has_stop_token"])
                 # number_question_left = total_number_question - len(game.question_ids)
                 #  - number_question_left * 0.1
-                reward = int(game.status == "success")
-                cum_reward = [[reward] * len(q) for q in q_tokens]
-                if self.generate:
-                    cum_reward.append([])
-                cum_reward_pad, _, _ = padder(cum_reward, padding_symbol=self.tokenizer.padding_token,
-                                                    max_seq_length=13)
-
-                batch["cum_reward"].append(cum_reward_pad)
+                # the reward is spread over the tokens of every question (cf. cum_reward below)
+                batch["reward"].append(int(game.status == "success"))
 
             if self.generate:  # Add a dummy question at eval time to not ignore the last question
                 q_tokens.append([])
                 a_tokens.append([])
 
-                a_tokens, a_lengths, _ = padder(a_tokens, padding_symbol=self.tokenizer.padding_token, max_seq_length=1)
-
             # no need for dialog
             # # Flatten questions/answers except the last one
             # dialogue = [self.tokenizer.start_token]  # Add start token (to avoid empty dialogue at the beginning)
@@ -113,11 +129,8 @@ class HREDBatchifier(AbstractBatchifier):
             # Extract question to predict
             # question = [self.tokenizer.start_token] + q_tokens[-1]
 
-            # pad the question
-            q_tokens_pad, q_lengths, _ = padder(q_tokens, padding_symbol=self.tokenizer.padding_token, max_seq_length=13)
-            # print(q_tokens_pad.shape)
-            batch["q_his"].append(q_tokens_pad)
-            batch["q_his_lengths"].append(q_lengths)
+            # pad the question (the whole batch is padded at once below)
+            batch["q_his"].append(q_tokens)
             batch["a_his"].append(a_tokens)
 
             # image
@@ -128,11 +141,13 @@ class HREDBatchifier(AbstractBatchifier):
                 batch["image"][i] = img
 
         # Pad dialogue tokens
-        batch["q_his"], max_turn = padder_3d(batch["q_his"])
+        padding_token = self.tokenizer.padding_token
+        batch["q_his"], q_his_lengths_true, no_turns = padder_ragged_3d(batch["q_his"], max_seq_length=13,
+                                                                        padding_symbol=padding_token,
+                                                                        length_padding_symbol=1)
         # print("turn", max_turn)
-        q_his_lengths_true, _, _ = padder(batch["q_his_lengths"], padding_symbol=1)
-        batch["q_his_lengths"], _, batch["q_turn"] = padder(batch["q_his_lengths"], padding_symbol=1)
-        batch["a_his"], _ = padder_3d(batch["a_his"], feature_size=1)
+        batch["q_his_lengths"], batch["q_turn"] = q_his_lengths_true, batch["q_his"].shape[1]
+        batch["a_his"], _, _ = padder_ragged_3d(batch["a_his"], max_seq_length=1, padding_symbol=padding_token)
         batch["q_his_mask"] = mask_generate(lengths=q_his_lengths_true-1, feature_size=10)
         # print("-------")
         # print("hisq")
@@ -144,7 +159,11 @@ class HREDBatchifier(AbstractBatchifier):
         # print("mask")
         # print(batch["q_mask"][:4])
 
-        if 'cum_reward' in batch:
-            batch['cum_reward'], _ = padder_3d(batch['cum_reward'])
+        if 'reward' in batch:
+            # cum_reward[i, j, k] = reward[i] for every token k of the question j (the dummy question is empty)
+            is_turn = np.arange(batch["q_his"].shape[1]) < no_turns[:, None]
+            token_mask = mask_generate(np.where(is_turn, np.minimum(q_his_lengths_true, 13), 0), feature_size=13)
+            rewards = np.array(batch.pop("reward"), dtype=np.float32)
+            batch['cum_reward'] = np.where(token_mask > 0, rewards[:, None, None], padding_token).astype(np.float32)
 
         return batch
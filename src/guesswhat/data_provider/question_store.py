@@ -0,0 +1,145 @@
+import os
+import json
+import shutil
+import hashlib
+import zlib
+import numpy as np
+
+
+# Why a question store?
+# Batchifiers tokenize (NLTK) every question of every game at every epoch while the questions of a dataset never change.
+# The store encodes them once and keeps the tokens as a flat int32 array (+ offsets) that is memory-mapped.
+# Questions are retrieved by question_id, the crc32 of the question is checked to never return the tokens of
+# another question (e.g. the looper generates new questions with small question_ids).
+
+STORE_VERSION = 1
+
+store_meta_filename = "meta.json"
+
+
+def get_dictionary_hash(tokenizer):
+    return hashlib.md5(json.dumps(tokenizer.word2i, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_question_crc(question):
+    return zlib.crc32(question.encode('utf-8'))
+
+
+def encode_question(tokenizer, token_store, question_id, question, add_start_token=False, add_stop_token=False):
+    """Encode a question with the token store if it is available, with the tokenizer otherwise"""
+    if token_store is not None:
+        tokens = token_store.get(question_id, question)
+        if tokens is not None:
+            if add_start_token:
+                tokens = [tokenizer.start_token] + tokens
+            if add_stop_token and tokens[-1] != tokenizer.stop_token:
+                tokens += [tokenizer.stop_token]
+            return tokens
+
+    return tokenizer.encode(question, add_start_token=add_start_token, add_stop_token=add_stop_token)
+
+
+class QuestionTokenStore(object):
+    """Memory-mapped tokens of the questions of one or several datasets (keyed by question_id)"""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+        with open(os.path.join(store_dir, store_meta_filename), 'r') as f:
+            self.meta = json.load(f)
+
+        self.question_ids = np.load(os.path.join(store_dir, "question_ids.npy"), mmap_mode='r')
+        self.crc = np.load(os.path.join(store_dir, "crc.npy"), mmap_mode='r')
+        self.offsets = np.load(os.path.join(store_dir, "offsets.npy"), mmap_mode='r')
+        self.tokens = np.load(os.path.join(store_dir, "tokens.npy"), mmap_mode='r')
+
+    # Only send the path to other processes (memmap would be fully copied otherwise)
+    def __getstate__(self):
+        return self.store_dir
+
+    def __setstate__(self, store_dir):
+        self.__init__(store_dir)
+
+    def __len__(self):
+        return len(self.question_ids)
+
+    def get(self, question_id, question):
+        """Return the tokens of the question (list) or None if the question is not in the store"""
+        start = np.searchsorted(self.question_ids, question_id, side='left')
+        end = np.searchsorted(self.question_ids, question_id, side='right')
+
+        crc = get_question_crc(question)
+        for row in range(start, end):
+            if self.crc[row] == crc:
+                return self.tokens[self.offsets[row]:self.offsets[row + 1]].tolist()
+
+        return None
+
+    @staticmethod
+    def build(datasets, tokenizer, store_dir, key):
+
+        question_ids, crc, lengths, tokens = [], [], [], []
+        for dataset in datasets:
+            for game in dataset.get_data():
+                for question_id, question in zip(game.question_ids, game.questions):
+                    question_tokens = tokenizer.encode(question)
+
+                    question_ids.append(question_id)
+                    crc.append(get_question_crc(question))
+                    lengths.append(len(question_tokens))
+                    tokens += question_tokens
+
+        # Sort by question_id to retrieve the questions by dichotomy
+        question_ids = np.array(question_ids, dtype=np.int64)
+        lengths = np.array(lengths, dtype=np.int64)
+        tokens = np.array(tokens, dtype=np.int32)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+
+        order = np.argsort(question_ids, kind="stable")
+        sorted_tokens = np.concatenate([tokens[starts[i]:starts[i] + lengths[i]] for i in order]) \
+            if len(order) > 0 else tokens
+
+        arrays = dict(question_ids=question_ids[order],
+                      crc=np.array(crc, dtype=np.uint32)[order],
+                      offsets=np.concatenate([[0], np.cumsum(lengths[order])]).astype(np.int64),
+                      tokens=sorted_tokens.astype(np.int32))
+
+        tmp_dir = store_dir + ".tmp{}".format(os.getpid())
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, name + ".npy"), array)
+        with open(os.path.join(tmp_dir, store_meta_filename), 'w') as f:
+            json.dump(dict(version=STORE_VERSION, key=key, no_questions=len(question_ids)), f)
+
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)
+        os.rename(tmp_dir, store_dir)
+
+    @staticmethod
+    def load_or_build(datasets, tokenizer, store_dir):
+        """
+        Return the token store of the datasets, the store is (re)built if it is missing or outdated
+
+        :param datasets: list of datasets whose questions are stored
+        :param tokenizer: GWTokenizer
+        :param store_dir: where to store the tokens
+        """
+        key = dict(dictionary=get_dictionary_hash(tokenizer),
+                   word_tokenizer=tokenizer.word_tokenizer,
+                   datasets=sorted([dataset.set, dataset.n_examples()] for dataset in datasets))
+
+        meta_path = os.path.join(store_dir, store_meta_filename)
+        is_valid = False
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            is_valid = meta.get("version") == STORE_VERSION and meta.get("key") == key
+
+        if not is_valid:
+            print("Building question token store: {}...".format(store_dir))
+            QuestionTokenStore.build(datasets, tokenizer, store_dir, key)
+
+        return QuestionTokenStore(store_dir)
@@ -13,7 +13,7 @@ from guesswhat.models.qgen.qgen_factory import create_qgen
 from guesswhat.models.guesser.guesser_factory import create_guesser
 from guesswhat.models.oracle.oracle_factory import create_oracle
 
-from generic.data_provider.iterator import BasicIterator
+from generic.data_provider.iterator import Iterator
 # from generic.tf_utils.evaluator import Evaluator
 # from generic.data_provider.image_loader import get_img_builder
 # from generic.data_provider.iterator import Iterator
@@ -48,6 +48,7 @@ if __name__ == '__main__':
     parser.add_argument("-exp_dir", type=str, required=False, help="Directory to output dialogue")
     parser.add_argument("-config", type=str, default="config/looper/config.uaqrah8g.json", help='Config file')
     parser.add_argument("-dict_file", type=str, default="dict.json", help="Dictionary file name")
+    parser.add_argument("-tokenizer", type=str, default="nltk", choices=["nltk", "regex"], help="Word tokenizer (regex: faster equivalent of nltk TweetTokenizer, opt-in)")
 
     parser.add_argument("-networks_dir", type=str, help="Directory with pretrained networks")
     parser.add_argument("-qgen_identifier", type=str, default="3dc053450598749026e2ce6119e47d48_v1", required=False)
@@ -95,7 +96,7 @@ if __name__ == '__main__':
 
     # Load dictionary
     logger.info('Loading dictionary..')
-    tokenizer = GWTokenizer(os.path.join(args.data_dir, args.dict_file))
+    tokenizer = GWTokenizer(os.path.join(args.data_dir, args.dict_file), word_tokenizer=args.tokenizer)
 
 
 
@@ -201,7 +202,7 @@ if __name__ == '__main__':
 
             game.object = obj
 
-            iterator = BasicIterator([game], batch_size=1, batchifier=batchifier)
+            iterator = Iterator([game], batch_size=1, batchifier=batchifier)
             success = looper_evaluator.process(sess, iterator, mode="greedy")
 
 
@@ -1,4 +1,4 @@
-from generic.data_provider.iterator import BasicIterator
+from generic.data_provider.iterator import Iterator
 from generic.tf_utils.evaluator import Evaluator
 
 
@@ -17,9 +17,9 @@ class GuesserWrapper(object):
     def find_object(self, sess, games):
 
         # the guesser may need to split the input
-        iterator = BasicIterator(games,
-                                 batch_size=len(games),
-                                 batchifier=self.batchifier)
+        iterator = Iterator(games,
+                            batch_size=len(games),
+                            batchifier=self.batchifier)
 
         # sample
         self.evaluator.process(sess, iterator, outputs=[], listener=self.listener, show_progress=False)
@@ -1,5 +1,8 @@
+import os
 from tqdm import tqdm
 
+from guesswhat.data_provider.game_writer import GameWriter, image_to_dict, objects_to_list
+
 
 class BasicLooper(object):
     def __init__(self, config, oracle_wrapper, qgen_wrapper, guesser_wrapper, tokenizer, batch_size):
@@ -22,6 +25,11 @@ class BasicLooper(object):
 
         games = []
 
+        # Games are serialized/written by a background thread (one write per batch)
+        writer = None
+        if store_games:
+            writer = create_looper_writer(save_path, name=name + "." + mode)
+
         score, total_elem = 0, 0
         for game_data in tqdm(iterator):
 
@@ -47,11 +55,8 @@ class BasicLooper(object):
             ongoing_games = self.guesser.find_object(sess, ongoing_games)
             # games.extend(ongoing_games)
             if store_games:
-                dump_dataset(ongoing_games, att_dict,
-                # dump_dataset(ongoing_games, att_dict, beta_dict,
-                             save_path=save_path,
-                             # tokenizer=looper.tokenizer,
-                             name=name + "." + mode)
+                writer.append([looper_game_to_dict(g, att_dict) for g in ongoing_games])
+                # writer.append([looper_game_to_dict(g, att_dict, beta_dict) for g in ongoing_games])
 
             # Step 3 : Apply gradient
             if optimizer is not None:
@@ -64,6 +69,9 @@ class BasicLooper(object):
             # for game in ongoing_games:
             #     game.flush()
 
+        if writer is not None:
+            writer.close()
+
         score = 1.0 * score / iterator.n_examples
 
         return score, games
@@ -90,6 +98,11 @@ class BasicLooperC(object):
 
         games = []
 
+        # Games are serialized/written by a background thread (one write per batch)
+        writer = None
+        if store_games:
+            writer = create_looper_writer(save_path, name=name + "." + mode)
+
         score, total_elem = 0, 0
         for game_data in tqdm(iterator):
 
@@ -122,11 +135,8 @@ class BasicLooperC(object):
             ongoing_games, _ = self.guesser.find_object(sess, ongoing_games)
             # games.extend(ongoing_games)
             if store_games:
-                dump_dataset(ongoing_games, att_dict,
-                             # dump_dataset(ongoing_games, att_dict, beta_dict,
-                             save_path=save_path,
-                             # tokenizer=looper.tokenizer,
-                             name=name + "." + mode)
+                writer.append([looper_game_to_dict(g, att_dict) for g in ongoing_games])
+                # writer.append([looper_game_to_dict(g, att_dict, beta_dict) for g in ongoing_games])
 
             # Step 3 : Apply gradient
             if optimizer is not None:
@@ -139,6 +149,9 @@ class BasicLooperC(object):
             # for game in ongoing_games:
             #     game.flush()
 
+        if writer is not None:
+            writer.close()
+
         score = 1.0 * score / iterator.n_examples
 
         return score, games
@@ -165,6 +178,11 @@ class BasicLooperCR(object):
 
         games = []
 
+        # Games are serialized/written by a background thread (one write per batch)
+        writer = None
+        if store_games:
+            writer = create_looper_writer(save_path, name=name + "." + mode)
+
         score, total_elem = 0, 0
         for game_data in tqdm(iterator):
 
@@ -199,11 +217,8 @@ class BasicLooperCR(object):
             ongoing_games, _ = self.guesser.find_object(sess, ongoing_games)
             # games.extend(ongoing_games)
             if store_games:
-                dump_dataset(ongoing_games, att_dict,
-                             # dump_dataset(ongoing_games, att_dict, beta_dict,
-                             save_path=save_path,
-                             # tokenizer=looper.tokenizer,
-                             name=name + "." + mode)
+                writer.append([looper_game_to_dict(g, att_dict) for g in ongoing_games])
+                # writer.append([looper_game_to_dict(g, att_dict, beta_dict) for g in ongoing_games])
 
             # Step 3 : Apply gradient
             if optimizer is not None:
@@ -216,53 +231,38 @@ class BasicLooperCR(object):
             # for game in ongoing_games:
             #     game.flush()
 
+        if writer is not None:
+            writer.close()
+
         score = 1.0 * score / iterator.n_examples
 
         return score, games
 
 
-def dump_dataset(games, att_dict, save_path, name="model"):
-# def dump_dataset(games, att_dict, beta_dict, save_path, name="model"):
-    import gzip
-    import os
-    import json
-
-    with open(os.path.join(save_path, 'guesswhat_att.' + name + '.json'), 'a', encoding='utf-8') as f:
-
-        for _, game in enumerate(games):
-
-            sample = {}
-
-            qas = []
-            for id, question, answers in zip(game.question_ids, game.questions, game.answers):
-                qas.append({"question": question,
-                            "answer": answers,
-                            "id": id,
-                            "p": 0})
-
-            sample["id"] = game.dialogue_id
-            sample["qas"] = qas
-            sample["image"] = {
-                "id": game.image.id,
-                "width": game.image.width,
-                "height": game.image.height,
-                "coco_url": game.image.url,
-                "file_name": game.image.filename
-            }
-
-            sample["objects"] = [{"id": o.id,
-                                  "category_id": o.category_id,
-                                  "category": o.category,
-                                  "area": o.area,
-                                  "bbox": o.bbox.coco_bbox,
-                                  "segment": o.segment,  # no segment to avoid making the file too big
-                                  } for o in game.objects]
-
-            sample["object_id"] = game.object.id
-            sample["id_guess_object"] = game.id_guess_object
-            sample["status"] = game.status
-            sample["att"] = att_dict[game.dialogue_id]
-            # sample["beta"] = beta_dict[game.dialogue_id]
-
-            f.write(json.dumps(sample))
-            f.write('\n')
+def create_looper_writer(save_path, name="model"):
+    # Games are appended to the same file at every call (e.g. one call per epoch)
+    return GameWriter(os.path.join(save_path, 'guesswhat_att.' + name + '.json'), mode='a')
+
+
+def looper_game_to_dict(game, att_dict):
+# def looper_game_to_dict(game, att_dict, beta_dict):
+
+    qas = []
+    for id, question, answers in zip(game.question_ids, game.questions, game.answers):
+        qas.append({"question": question,
+                    "answer": answers,
+                    "id": id,
+                    "p": 0})
+
+    sample = {}
+    sample["id"] = game.dialogue_id
+    sample["qas"] = qas
+    sample["image"] = image_to_dict(game.image, with_filename=True)
+    sample["objects"] = objects_to_list(game.objects)
+    sample["object_id"] = game.object.id
+    sample["id_guess_object"] = game.id_guess_object
+    sample["status"] = game.status
+    sample["att"] = att_dict[game.dialogue_id]
+    # sample["beta"] = beta_dict[game.dialogue_id]
+
+    return sample
@@ -1,6 +1,5 @@
 from generic.tf_utils.evaluator import Evaluator
-from generic.data_provider.batchifier import BatchifierSplitMode
-import copy
+from generic.data_provider.batchifier import BatchifierSplitMode, SplitGame
 
 
 class OracleWrapper(object):
@@ -17,14 +16,9 @@ class OracleWrapper(object):
 
     def answer_question(self, sess, games):
 
-        # create the training batch #TODO: hack -> to remove
-        oracle_games = []
+        # create the training batch: the oracle only answers the last question (no copy of the games)
         if self.batchifier.split_mode == 1:
-            for game in games:
-                g = copy.copy(game)
-                g.questions = [game.questions[-1]]
-                g.question_ids = [game.question_ids[-1]]
-                oracle_games.append(g)
+            oracle_games = [SplitGame(game, turn=len(game.questions) - 1, split_mode=1) for game in games]
         else:
             oracle_games = games
 
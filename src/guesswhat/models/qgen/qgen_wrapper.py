@@ -1,7 +1,7 @@
 import numpy as np
 import copy
 from generic.tf_utils.optimizer import AccOptimizer
-from generic.data_provider.iterator import BasicIterator
+from generic.data_provider.iterator import Iterator
 from generic.tf_utils.evaluator import Evaluator, EvaluatorC, EvaluatorCR
 import numpy as np
 
@@ -46,7 +46,7 @@ class QGenWrapper(object):
         batchifier.generate = False
         batchifier.supervised = False
 
-        iterator = BasicIterator(games, batch_size=len(games), batchifier=batchifier)
+        iterator = Iterator(games, batch_size=len(games), batchifier=batchifier)
 
         # Check whether the gradient is accumulated
         if isinstance(optimizer, AccOptimizer):
@@ -77,19 +77,23 @@ class QGenWrapper(object):
         tokens, seq_length, state_values, atts = self.evaluator.execute(sess, output=self.ops[mode], batch=batch)
         # tokens, seq_length, state_values, atts, betas = self.evaluator.execute(sess, output=self.ops[mode], batch=batch)
 
+        # Decode all the questions at once: a question ends after its first stop_dialogue token
+        has_stop_tokens = np.any(tokens == self.tokenizer.stop_dialogue, axis=1)
+        seq_length = self.tokenizer.get_lengths(tokens, seq_length=seq_length, stop_tokens=[self.tokenizer.stop_dialogue])
+        questions = self.tokenizer.decode_batch(tokens, seq_length=seq_length)
+
         # Update game
         new_games = []
-        for game, question_tokens, l, state_value, att in zip(games, tokens, seq_length, state_values, atts):
+        for game, question, has_stop_token, l, state_value, att in zip(games, questions, has_stop_tokens, seq_length, state_values, atts):
         # for game, question_tokens, l, state_value, att, beta in zip(games, tokens, seq_length, state_values, atts, betas):
 
             if not game.user_data["has_stop_token"]:  # stop adding question if dialogue is over
 
                 # clean tokens after stop_dialogue_tokens
-                if self.tokenizer.stop_dialogue in question_tokens:
+                if has_stop_token:
                     game.user_data["has_stop_token"] = True
-                    l = np.nonzero(question_tokens == self.tokenizer.stop_dialogue)[0][0] + 1  # find the first stop_dialogue occurrence
                 # Append the newly generated question
-                game.questions.append(self.tokenizer.decode(question_tokens[:l]))
+                game.questions.append(question)
                 game.question_ids.append(len(game.question_ids))
 
                 game.user_data["state_values"] = game.user_data.get("state_values", [])
@@ -155,7 +159,7 @@ class QGenWrapperC(object):
         batchifier.generate = False
         batchifier.supervised = False
 
-        iterator = BasicIterator(games, batch_size=len(games), batchifier=batchifier)
+        iterator = Iterator(games, batch_size=len(games), batchifier=batchifier)
 
         # Check whether the gradient is accumulated
         if isinstance(optimizer, AccOptimizer):
@@ -186,20 +190,23 @@ class QGenWrapperC(object):
         tokens, seq_length, state_values, atts = self.evaluator.execute(sess, output=self.ops[mode], batch=batch)
         # tokens, seq_length, state_values, atts, betas = self.evaluator.execute(sess, output=self.ops[mode], batch=batch)
 
+        # Decode all the questions at once: a question ends after its first stop_dialogue token
+        has_stop_tokens = np.any(tokens == self.tokenizer.stop_dialogue, axis=1)
+        seq_length = self.tokenizer.get_lengths(tokens, seq_length=seq_length, stop_tokens=[self.tokenizer.stop_dialogue])
+        questions = self.tokenizer.decode_batch(tokens, seq_length=seq_length)
+
         # Update game
         new_games = []
-        for game, question_tokens, l, state_value, att in zip(games, tokens, seq_length, state_values, atts):
+        for game, question, has_stop_token, l, state_value, att in zip(games, questions, has_stop_tokens, seq_length, state_values, atts):
             # for game, question_tokens, l, state_value, att, beta in zip(games, tokens, seq_length, state_values, atts, betas):
 
             if not game.user_data["has_stop_token"]:  # stop adding question if dialogue is over
 
                 # clean tokens after stop_dialogue_tokens
-                if self.tokenizer.stop_dialogue in question_tokens:
+                if has_stop_token:
                     game.user_data["has_stop_token"] = True
-                    l = np.nonzero(question_tokens == self.tokenizer.stop_dialogue)[0][
-                            0] + 1  # find the first stop_dialogue occurrence
                 # Append the newly generated question
-                game.questions.append(self.tokenizer.decode(question_tokens[:l]))
+                game.questions.append(question)
                 game.question_ids.append(len(game.question_ids))
 
                 game.user_data["state_values"] = game.user_data.get("state_values", [])
@@ -265,7 +272,7 @@ class QGenWrapperCR(object):
         batchifier.generate = False
         batchifier.supervised = False
 
-        iterator = BasicIterator(games, batch_size=len(games), batchifier=batchifier)
+        iterator = Iterator(games, batch_size=len(games), batchifier=batchifier)
 
         # Check whether the gradient is accumulated
         if isinstance(optimizer, AccOptimizer):
@@ -296,25 +303,28 @@ class QGenWrapperCR(object):
         tokens, seq_length, state_values, atts = self.evaluator.execute(sess, output=self.ops[mode], batch=batch)
         # tokens, seq_length, state_values, atts, betas = self.evaluator.execute(sess, output=self.ops[mode], batch=batch)
 
+        # Decode all the questions at once: a question ends after its first stop_dialogue token
+        has_stop_tokens = np.any(tokens == self.tokenizer.stop_dialogue, axis=1)
+        seq_length = self.tokenizer.get_lengths(tokens, seq_length=seq_length, stop_tokens=[self.tokenizer.stop_dialogue])
+        questions = self.tokenizer.decode_batch(tokens, seq_length=seq_length)
+
         # Update game
         new_games = []
         q_flag = []
-        for game, question_tokens, l, state_value, att in zip(games, tokens, seq_length, state_values, atts):
+        for game, question, has_stop_token, l, state_value, att in zip(games, questions, has_stop_tokens, seq_length, state_values, atts):
             # for game, question_tokens, l, state_value, att, beta in zip(games, tokens, seq_length, state_values, atts, betas):
 
             if not game.user_data["has_stop_token"]:  # stop adding question if dialogue is over
 
                 # clean tokens after stop_dialogue_tokens
-                if self.tokenizer.stop_dialogue in question_tokens:
+                if has_stop_token:
                     game.user_data["has_stop_token"] = True
-                    l = np.nonzero(question_tokens == self.tokenizer.stop_dialogue)[0][
-                            0] + 1  # find the first stop_dialogue occurrence
                 # Append the newly generated question
-                if self.tokenizer.decode(question_tokens[:l]) in game.questions:
+                if question in game.questions:
                     q_flag.append(0)
                 else:
                     q_flag.append(1)
-                game.questions.append(self.tokenizer.decode(question_tokens[:l]))
+                game.questions.append(question)
                 game.question_ids.append(len(game.question_ids))
 
                 game.user_data["state_values"] = game.user_data.get("state_values", [])
@@ -1,16 +1,54 @@
 """Create a dictionary file from specified GuessWhat dataset
 
+Only the questions are read from the raw jsonl.gz files (no game is built) and they are tokenized by a pool of processes.
+Use -update to add the words of new data to an existing dictionary (indices of existing words are kept).
+
 example
 -------
 python src/guesswhat/preprocess_data/create_dictionary.py -data_dir=/path/to/guesswhat
+python src/guesswhat/preprocess_data/create_dictionary.py -data_dir=/path/to/guesswhat -sets new_train -update=True
 """
 import argparse
 import collections
+import gzip
 import io
+import itertools
 import json
 import os
-from guesswhat.data_provider.guesswhat_dataset import Dataset
-from nltk.tokenize import TweetTokenizer
+from distutils.util import strtobool
+from multiprocessing import Pool
+
+from generic.data_provider.regex_tokenizer import create_word_tokenizer
+
+_tokenizers = dict()  # one tokenizer per worker
+
+
+def count_words(task):
+    lines, tokenizer_name, all_questions = task
+
+    if tokenizer_name not in _tokenizers:
+        _tokenizers[tokenizer_name] = create_word_tokenizer(tokenizer_name)
+    tknzr = _tokenizers[tokenizer_name]
+
+    word2occ = collections.Counter()
+    for line in lines:
+        qas = json.loads(line.decode('utf-8'))["qas"]
+        if not all_questions:
+            qas = qas[:1]
+        for qa in qas:
+            word2occ.update(tknzr.tokenize(qa["question"]))
+
+    return word2occ
+
+
+def read_chunks(file, chunk_size):
+    with gzip.open(file) as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if len(lines) == 0:
+                break
+            yield lines
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser('Creating dictionary..')
@@ -19,9 +57,17 @@ if __name__ == '__main__':
     parser.add_argument("-dict_file", type=str, default="dict.json", help="Name of the dictionary file")
     parser.add_argument("-min_occ", type=int, default=3,
                         help='Minimum number of occurences to add word to dictionary')
+    parser.add_argument("-tokenizer", type=str, default="nltk", choices=["nltk", "regex"], help="Word tokenizer (regex: faster equivalent of nltk TweetTokenizer, opt-in)")
+    parser.add_argument("-sets", type=str, nargs="+", default=["train"], help="Sets whose questions are counted (guesswhat.{set}.jsonl.gz)")
+    parser.add_argument("-all_questions", type=lambda x: bool(strtobool(x)), default="False", help="Count all the questions of the games (default: first question only)")
+    parser.add_argument("-update", type=lambda x: bool(strtobool(x)), default="False", help="Add the words of the sets to the existing dictionary?")
+    parser.add_argument("-no_thread", type=int, default=4, help="No process to tokenize the questions (0: main process only)")
+    parser.add_argument("-chunk_size", type=int, default=2000, help="No games per task")
 
     args = parser.parse_args()
 
+    dict_path = os.path.join(args.data_dir, 'dict.json')
+
     # Set default values
     word2i = {'<padding>': 0,
               '<start>': 1,
@@ -33,32 +79,41 @@ if __name__ == '__main__':
               '<n/a>': 6,
               }
 
-    word2occ = collections.defaultdict(int)
+    word2occ = collections.Counter()
+
+    if args.update:
+        print("Loading dictionary: {}...".format(dict_path))
+        with io.open(dict_path, 'r', encoding='utf8') as f_in:
+            data = json.load(f_in)
+        word2i = data['word2i']
+        word2occ.update(data.get('word2occ', dict()))
 
-    tknzr = TweetTokenizer(preserve_case=False)
+    pool = Pool(args.no_thread) if args.no_thread > 0 else None
 
+    for one_set in args.sets:
+        print("Processing {} dataset...".format(one_set))
+        tasks = ((lines, args.tokenizer, args.all_questions)
+                 for lines in read_chunks(os.path.join(args.data_dir, 'guesswhat.{}.jsonl.gz'.format(one_set)), args.chunk_size))
 
-    print("Processing train dataset...")
-    trainset = Dataset(args.data_dir, "train")
-    games = trainset.get_data()
-    for game in games:
-        question = game.questions[0]
-        tokens = tknzr.tokenize(question)
-        for tok in tokens:
-            word2occ[tok] += 1
+        # Ordered merge: words keep the order of their first occurrence
+        for counter in (pool.imap(count_words, tasks) if pool is not None else map(count_words, tasks)):
+            word2occ.update(counter)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
 
     print("filter words...")
     for word, occ in word2occ.items():
-        if occ >= args.min_occ and word.count('.') <= 1:
+        if occ >= args.min_occ and word.count('.') <= 1 and word not in word2i:
             word2i[word] = len(word2i)
 
     print("Number of words (occ >= 1): {}".format(len(word2occ)))
     print("Number of words (occ >= {}): {}".format(args.min_occ, len(word2i)))
 
-    dict_path = os.path.join(args.data_dir, 'dict.json')
     print("Dump file: {} ...".format(dict_path))
     with io.open(dict_path, 'wb') as f_out:
-        data = json.dumps({'word2i': word2i}, ensure_ascii=False)
+        data = json.dumps({'word2i': word2i, 'word2occ': word2occ}, ensure_ascii=False)
         f_out.write(data.encode('utf8', 'replace'))
 
     print("Done!")
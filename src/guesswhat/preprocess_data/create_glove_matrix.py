@@ -0,0 +1,41 @@
+"""Extract the glove vectors of the dictionary words as a memory-mapped matrix (row i = token i of dict.json)
+
+The matrix must be rebuilt whenever the dictionary is updated (the training scripts check the vocabulary).
+
+example
+-------
+python src/guesswhat/preprocess_data/create_glove_matrix.py -data_dir=/path/to/guesswhat -glove_file=/path/to/glove_dict.pkl
+python src/guesswhat/train/train_oracle.py ... -glove_file=/path/to/guesswhat/glove_matrix
+"""
+import argparse
+import os
+
+from generic.data_provider.nlp_utils import GloveEmbeddings, GloveMatrix
+from guesswhat.data_provider.guesswhat_tokenizer import GWTokenizer
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Creating glove matrix..')
+
+    parser.add_argument("-data_dir", type=str, help="Path where are the Guesswhat dataset")
+    parser.add_argument("-dict_file", type=str, default="dict.json", help="Name of the dictionary file")
+    parser.add_argument("-glove_file", type=str, default="glove_dict.pkl", help="Glove file name (pickled dict word -> vector)")
+    parser.add_argument("-glove_dim", type=int, default=300, help="Size of the glove vectors")
+    parser.add_argument("-out_dir", type=str, default=None, help="Where to store the matrix (Default: data_dir/glove_matrix)")
+
+    args = parser.parse_args()
+
+    out_dir = args.out_dir if args.out_dir is not None else os.path.join(args.data_dir, "glove_matrix")
+
+    print("Loading dictionary...")
+    tokenizer = GWTokenizer(os.path.join(args.data_dir, args.dict_file))
+
+    print("Loading glove: {}...".format(args.glove_file))
+    glove = GloveEmbeddings(args.glove_file, glove_dim=args.glove_dim)
+
+    print("Dump matrix: {} ...".format(out_dir))
+    no_found = GloveMatrix.build(glove.glove, tokenizer, out_dir, glove_dim=args.glove_dim)
+
+    print("Number of words: {}".format(tokenizer.no_words))
+    print("Number of words found in glove: {}".format(no_found))
+
+    print("Done!")
@@ -0,0 +1,34 @@
+"""Precompute the (RLE) segmentation masks of the objects of GuessWhat datasets
+
+example
+-------
+python src/guesswhat/preprocess_data/extract_masks.py -data_dir=/path/to/guesswhat -set train valid test
+"""
+import argparse
+import os
+from guesswhat.data_provider.guesswhat_dataset import Dataset
+from guesswhat.data_provider.mask_cache import MaskStore, mask_cache
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Extracting masks..')
+
+    parser.add_argument("-data_dir", type=str, help="Path where are the Guesswhat dataset")
+    parser.add_argument("-out_dir", type=str, default=None, help="Where to store the masks (Default: data_dir)")
+    parser.add_argument("-set", type=str, nargs='+', default=["train", "valid", "test"], help="Sets to process")
+
+    args = parser.parse_args()
+
+    out_dir = args.out_dir if args.out_dir is not None else args.data_dir
+
+    # The masks are decoded once: no need to keep them in the LRU cache
+    mask_cache.masks.max_size = 0
+
+    for one_set in args.set:
+        print("Processing {} dataset...".format(one_set))
+        dataset = Dataset(args.data_dir, one_set)
+
+        store_dir = os.path.join(out_dir, "guesswhat.{}.masks".format(one_set))
+        print("Dump masks: {} ...".format(store_dir))
+        MaskStore.build((obj for game in dataset.get_data() for obj in game.objects), store_dir)
+
+    print("Done!")
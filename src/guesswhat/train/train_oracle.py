@@ -6,16 +6,20 @@ from distutils.util import strtobool
 
 import tensorflow as tf
 
+from generic.data_provider.epoch_scheduler import EpochScheduler
 from generic.data_provider.iterator import Iterator
+from generic.data_provider.prefetcher import format_prefetch_stats
 from generic.tf_utils.evaluator import Evaluator
 from generic.tf_utils.optimizer import create_optimizer
 from generic.tf_utils.ckpt_loader import create_resnet_saver
 from generic.utils.config import load_config
 from generic.data_provider.image_loader import get_img_builder
-from generic.data_provider.nlp_utils import GloveEmbeddings
-from generic.utils.thread_pool import create_cpu_pool
+from generic.data_provider.nlp_utils import load_glove
+from generic.utils.thread_pool import CpuPool
 
-from guesswhat.data_provider.guesswhat_dataset import Dataset
+from guesswhat.data_provider.guesswhat_dataset import Dataset, StreamingDataset
+from guesswhat.data_provider.question_store import QuestionTokenStore
+from guesswhat.data_provider.mask_cache import load_mask_store
 # from generic.data_provider.batchifier import BatchifierSplitMode
 # from guesswhat.data_provider.oracle_batchifier import BatchifierSplitMode
 from guesswhat.data_provider.guesswhat_tokenizer_orig import GWTokenizer
@@ -35,15 +39,25 @@ if __name__ == '__main__':
     parser.add_argument("-out_dir", type=str, default="out/oracle", help="Directory in which experiments are stored")
     parser.add_argument("-config", type=str, default="config/oracle/config.baseline.json", help='Config file')
     parser.add_argument("-dict_file", type=str, default="data/dict.json", help="Dictionary file name")
-    parser.add_argument("-glove_file", type=str, default="glove_dict.pkl", help="Glove file name")
+    parser.add_argument("-tokenizer", type=str, default="nltk", choices=["nltk", "regex"], help="Word tokenizer (regex: faster equivalent of nltk TweetTokenizer, opt-in)")
+    parser.add_argument("-glove_file", type=str, default="glove_dict.pkl", help="Glove file name (pickle) or glove matrix directory (cf. create_glove_matrix.py)")
     parser.add_argument("-img_dir", default='data/features/vgg16/image.hdf5', type=str, help='Directory with images')
     parser.add_argument("-crop_dir", default='data/features/vgg16/crop.hdf5', type=str, help='Directory with crops')
+    parser.add_argument("-mask_dir", default=None, type=str, help='Directory with precomputed masks (cf. extract_masks.py)')
     parser.add_argument("-load_checkpoint", type=str, help="Load model parameters from specified checkpoint")
     parser.add_argument("-continue_exp", type=lambda x: bool(strtobool(x)), default="False", help="Continue previously started experiment?")
     parser.add_argument("-gpu_ratio", type=float, default=0.45, help="How many GPU ram is required? (ratio)")
     parser.add_argument("-early_stop", type=int, default=5)
     parser.add_argument("-no_thread", type=int, default=2, help="No thread to load batch")
+    parser.add_argument("-ckpt_every", type=int, default=0, help="Save a checkpoint every N training batches to resume an interrupted epoch (0: end of epoch only)")
+    parser.add_argument("-bucketing", type=lambda x: bool(strtobool(x)), default="False", help="Group the training games of similar sizes into the same batches?")
+    parser.add_argument("-max_tokens", type=int, default=None, help="Cap the padded size of the training batches (with bucketing)")
     parser.add_argument("-no_games_to_load", type=int, default=float("inf"), help="No games to use during training Default : all")
+    parser.add_argument("-use_cache", type=lambda x: bool(strtobool(x)), default="False", help="Cache the parsed dataset on disk?")
+    parser.add_argument("-cache_dir", type=str, default=None, help="Directory of the dataset cache (Default: next to the dataset files)")
+    parser.add_argument("-token_store", type=str, default=None, help="Directory of the pre-tokenized questions, built if missing or outdated (Default: questions are tokenized on the fly)")
+    parser.add_argument("-stream_dataset", type=lambda x: bool(strtobool(x)), default="False", help="Stream the games from disk instead of loading them in memory?")
+    parser.add_argument("-num_workers", type=int, default=0, help="No process to parse the dataset (0: main process only)")
     parser.add_argument("-skip_training",  type=lambda x: bool(strtobool(x)), default="False", help="Start from checkpoint?")
 
     args = parser.parse_args()
@@ -79,19 +93,32 @@ if __name__ == '__main__':
 
     # Load data
     logger.info('Loading data..')
-    trainset = Dataset(args.data_dir, "train", image_builder, crop_builder, False, args.no_games_to_load)
-    validset = Dataset(args.data_dir, "valid", image_builder, crop_builder, False, args.no_games_to_load)
-    testset = Dataset(args.data_dir, "test", image_builder, crop_builder, False, args.no_games_to_load)
+    dataset_cstor = StreamingDataset if args.stream_dataset else Dataset
+    trainset = dataset_cstor(args.data_dir, "train", image_builder, crop_builder, False, args.no_games_to_load, use_cache=args.use_cache, cache_dir=args.cache_dir, num_workers=args.num_workers)
+    validset = dataset_cstor(args.data_dir, "valid", image_builder, crop_builder, False, args.no_games_to_load, use_cache=args.use_cache, cache_dir=args.cache_dir, num_workers=args.num_workers)
+    testset = dataset_cstor(args.data_dir, "test", image_builder, crop_builder, False, args.no_games_to_load, use_cache=args.use_cache, cache_dir=args.cache_dir, num_workers=args.num_workers)
+
+    # Load precomputed masks
+    if args.mask_dir is not None:
+        logger.info('Loading masks..')
+        for one_set in ["train", "valid", "test"]:
+            load_mask_store(os.path.join(args.mask_dir, "guesswhat.{}.masks".format(one_set)))
 
     # Load dictionary
     logger.info('Loading dictionary..')
-    tokenizer = GWTokenizer(args.dict_file)
+    tokenizer = GWTokenizer(args.dict_file, word_tokenizer=args.tokenizer)
+
+    # Load pre-tokenized questions
+    token_store = None
+    if args.token_store is not None:
+        logger.info('Loading question tokens..')
+        token_store = QuestionTokenStore.load_or_build([trainset, validset, testset], tokenizer, args.token_store)
 
     # Load glove
     glove = None
     if config["model"]["question"]['glove']:
         logger.info('Loading glove..')
-        glove = GloveEmbeddings(args.glove_file)
+        glove = load_glove(args.glove_file, tokenizer=tokenizer)
 
     # Build Network
     logger.info('Building network..')
@@ -112,7 +139,8 @@ if __name__ == '__main__':
     config_gpu = tf.ConfigProto()
     config_gpu.gpu_options.allow_growth = True
 
-    with tf.Session(config=config_gpu) as sess:
+    # The same workers are used by all the iterators of the run
+    with tf.Session(config=config_gpu) as sess, CpuPool(args.no_thread, use_process=use_process) as cpu_pool:
 
         sources = network.get_sources(sess)
         logger.info("Sources: " + ', '.join(sources))
@@ -125,28 +153,34 @@ if __name__ == '__main__':
 
         # create training tools
         evaluator = Evaluator(sources, network.scope_name, network=network, tokenizer=tokenizer)
-        batchifier = batchifier_cstor(tokenizer, sources, glove=glove, status=config['status'], split_mode=split_mode)
+        batchifier = batchifier_cstor(tokenizer, sources, glove=glove, status=config['status'], split_mode=split_mode,
+                                      token_store=token_store)
         xp_manager.configure_score_tracking("valid_accuracy", max_is_best=True)
 
+        # The iterator of the next phase/epoch is prepared in advance, with one seed per epoch (cf. epoch_scheduler.py)
+        scheduler = EpochScheduler(seed=config.get("seed", -1), no_epoch=no_epoch)
+        scheduler.add_phase("train", lambda seed, state=None: Iterator(trainset,
+                                                                       batch_size=batch_size, pool=cpu_pool,
+                                                                       batchifier=batchifier,
+                                                                       shuffle=True, seed=seed, state=state,
+                                                                       bucketing=args.bucketing, max_tokens=args.max_tokens))
+        scheduler.add_phase("valid", lambda seed: Iterator(validset, pool=cpu_pool,
+                                                           batch_size=batch_size*2,
+                                                           batchifier=batchifier,
+                                                           shuffle=False, seed=seed))
+
         for t in range(start_epoch, no_epoch):
             if args.skip_training:
                 logger.info("Skip training...")
                 break
             logger.info('Epoch {}..'.format(t + 1))
 
-            # Create cpu pools (at each iteration otherwise threads may become zombie - python bug)
-            cpu_pool = create_cpu_pool(args.no_thread, use_process=use_process)
-
-            train_iterator = Iterator(trainset,
-                                      batch_size=batch_size, pool=cpu_pool,
-                                      batchifier=batchifier,
-                                      shuffle=True)
+            train_iterator = scheduler.get(t, "train", state=xp_manager.get_iterator_state(t))
+            train_iterator = xp_manager.checkpoint_iterator(train_iterator, sess, saver, epoch=t, no_batches=args.ckpt_every)
             train_loss, train_accuracy = evaluator.process(sess, train_iterator, outputs=outputs + [optimizer])
+            logger.info("Training data   : {}".format(format_prefetch_stats(evaluator.get_data_stats())))
 
-            valid_iterator = Iterator(validset, pool=cpu_pool,
-                                      batch_size=batch_size*2,
-                                      batchifier=batchifier,
-                                      shuffle=False)
+            valid_iterator = scheduler.get(t, "valid")
             valid_loss, valid_accuracy = evaluator.process(sess, valid_iterator, outputs=outputs)
 
             logger.info("Training loss   : {}".format(train_loss))
@@ -165,10 +199,10 @@ if __name__ == '__main__':
             if stop_flag >= args.early_stop:
                 logger.info("==================early stopping===================")
                 break
+        scheduler.close()
 
         # Load early stopping
         xp_manager.load_checkpoint(sess, saver, load_best=True)
-        cpu_pool = create_cpu_pool(args.no_thread, use_process=use_process)
 
         # Create Listener
         oracle_listener = OracleListener(tokenizer=tokenizer, require=network.prediction)
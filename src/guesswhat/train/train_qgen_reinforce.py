@@ -6,13 +6,15 @@ from distutils.util import strtobool
 
 import tensorflow as tf
 
-from generic.utils.thread_pool import create_cpu_pool
+from generic.utils.thread_pool import CpuPool
 from generic.utils.config import load_config, get_config_from_xp
 
 from generic.tf_utils.optimizer import create_optimizer
 
 from generic.data_provider.image_loader import get_img_builder, _create_image_builder_rcnn
+from generic.data_provider.epoch_scheduler import EpochScheduler
 from generic.data_provider.iterator import Iterator
+from generic.data_provider.prefetcher import format_prefetch_stats
 from generic.tf_utils.evaluator import Evaluator
 
 from guesswhat.models.qgen.rl_module import PolicyGradient
@@ -27,7 +29,7 @@ from guesswhat.models.oracle.oracle_wrapper import OracleWrapper
 from guesswhat.models.guesser.guesser_wrapper import GuesserWrapper
 
 # from guesswhat.data_provider.oracle_batchifier import BatchifierSplitMode
-from guesswhat.data_provider.guesswhat_dataset import Dataset
+from guesswhat.data_provider.guesswhat_dataset import Dataset, StreamingDataset
 from guesswhat.data_provider.looper_batchifier import LooperBatchifier
 from guesswhat.data_provider.guesswhat_tokenizer import GWTokenizer
 
@@ -44,6 +46,7 @@ if __name__ == '__main__':
     parser.add_argument("-crop_dir", type=str, help='Directory with images')
     parser.add_argument("-config", type=str, default="config/looper/config.rnn.json", help='Config file')
     parser.add_argument("-dict_file", type=str, default="dict.json", help="Dictionary file name")
+    parser.add_argument("-tokenizer", type=str, default="nltk", choices=["nltk", "regex"], help="Word tokenizer (regex: faster equivalent of nltk TweetTokenizer, opt-in)")
 
     parser.add_argument("-networks_dir", type=str, default='out', help="Directory with pretrained networks")
 
@@ -55,9 +58,16 @@ if __name__ == '__main__':
     parser.add_argument("-evaluate_all", type=lambda x: bool(strtobool(x)), default="False", help="Evaluate sampling, greedy and BeamSearch?")  #TODO use an input list
     # parser.add_argument("-store_games", type=lambda x: bool(strtobool(x)), default="True", help="Should we dump the game at evaluation times")
     parser.add_argument("-no_games_to_load", type=int, default=float("inf"), help="No games to use during training Default : all")
+    parser.add_argument("-use_cache", type=lambda x: bool(strtobool(x)), default="False", help="Cache the parsed dataset on disk?")
+    parser.add_argument("-cache_dir", type=str, default=None, help="Directory of the dataset cache (Default: next to the dataset files)")
+    parser.add_argument("-stream_dataset", type=lambda x: bool(strtobool(x)), default="False", help="Stream the games from disk instead of loading them in memory?")
+    parser.add_argument("-num_workers", type=int, default=0, help="No process to parse the dataset (0: main process only)")
 
     parser.add_argument("-gpu_ratio", type=float, default=0.95, help="How muany GPU ram is required? (ratio)")
     parser.add_argument("-no_thread", type=int, default=4, help="No thread to load batch")
+    parser.add_argument("-ckpt_every", type=int, default=0, help="Save a checkpoint every N training batches to resume an interrupted epoch (0: end of epoch only)")
+    parser.add_argument("-bucketing", type=lambda x: bool(strtobool(x)), default="False", help="Group the training games of similar sizes into the same batches?")
+    parser.add_argument("-max_tokens", type=int, default=None, help="Cap the padded size of the training batches (with bucketing)")
     parser.add_argument("-load_new",  type=lambda x: bool(strtobool(x)), default="True", help="Start from checkpoint?")
     parser.add_argument("-test_ini",  type=lambda x: bool(strtobool(x)), default="True", help="Start from checkpoint?")
     parser.add_argument("-use_redis",  type=lambda x: bool(strtobool(x)), default="False", help="Start from checkpoint?")
@@ -101,13 +111,14 @@ if __name__ == '__main__':
 
     # Load data
     logger.info('Loading data..')
-    trainset = Dataset(args.data_dir, "train", image_builder, crop_builder, rcnn, args.no_games_to_load)
-    validset = Dataset(args.data_dir, "valid", image_builder, crop_builder, rcnn, args.no_games_to_load)
-    testset = Dataset(args.data_dir, "test", image_builder, crop_builder, rcnn, args.no_games_to_load)
+    dataset_cstor = StreamingDataset if args.stream_dataset else Dataset
+    trainset = dataset_cstor(args.data_dir, "train", image_builder, crop_builder, rcnn, args.no_games_to_load, use_cache=args.use_cache, cache_dir=args.cache_dir, num_workers=args.num_workers)
+    validset = dataset_cstor(args.data_dir, "valid", image_builder, crop_builder, rcnn, args.no_games_to_load, use_cache=args.use_cache, cache_dir=args.cache_dir, num_workers=args.num_workers)
+    testset = dataset_cstor(args.data_dir, "test", image_builder, crop_builder, rcnn, args.no_games_to_load, use_cache=args.use_cache, cache_dir=args.cache_dir, num_workers=args.num_workers)
 
     # Load dictionary
     logger.info('Loading dictionary..')
-    tokenizer = GWTokenizer(os.path.join(args.data_dir, args.dict_file))
+    tokenizer = GWTokenizer(os.path.join(args.data_dir, args.dict_file), word_tokenizer=args.tokenizer)
 
     ###############################
     #  LOAD NETWORKS
@@ -157,7 +168,8 @@ if __name__ == '__main__':
     gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=args.gpu_ratio)
     config = tf.ConfigProto(gpu_options=gpu_options)
 
-    with tf.Session(config=config) as sess:
+    # The same workers are used by all the iterators of the run
+    with tf.Session(config=config) as sess, CpuPool(args.no_thread, use_process=image_builder.require_multiprocess()) as cpu_pool:
 
         ###############################
         #  LOAD PRE-TRAINED NETWORK
@@ -209,7 +221,6 @@ if __name__ == '__main__':
         if args.test_ini:
             logger.info(">>>-------------- INITIAL SCORE ---------------------<<<")
             # evaluator = Evaluator(loop_sources, qgen_network.scope_name, network=qgen_network, tokenizer=tokenizer)
-            cpu_pool = create_cpu_pool(args.no_thread, use_process=False)
 
             logger.info(">>>  Initial models  <<<")
             test_models(sess, testset, cpu_pool=cpu_pool, batch_size=batch_size*2,
@@ -229,35 +240,42 @@ if __name__ == '__main__':
             logger.info(">>>------------------------------------------------<<<")
 
 
+        # The iterator of the next phase/epoch is prepared in advance, with one seed per epoch (cf. epoch_scheduler.py)
+        scheduler = EpochScheduler(seed=loop_config.get("seed", -1), no_epoch=no_epoch)
+        scheduler.add_phase("train", lambda seed, state=None: Iterator(trainset,
+                                                                       batch_size=batch_size,
+                                                                       pool=cpu_pool,
+                                                                       shuffle=True, seed=seed, state=state,
+                                                                       batchifier=train_batchifier,
+                                                                       bucketing=args.bucketing, max_tokens=args.max_tokens))
+        scheduler.add_phase("valid", lambda seed: Iterator(validset, pool=cpu_pool,
+                                                           batch_size=batch_size,
+                                                           batchifier=eval_batchifier,
+                                                           shuffle=False, seed=seed))
+
         logs = []
         # Start training
         final_val_score = 0.
-        for epoch in range(no_epoch):
+        for epoch in range(start_epoch, no_epoch):
             if args.skip_training:
                 logger.info("Skip training...")
                 break
             logger.info("Epoch {}/{}".format(epoch, no_epoch))
 
-            cpu_pool = create_cpu_pool(args.no_thread, use_process=False)
-
-            train_iterator = Iterator(trainset,
-                                      batch_size=batch_size,
-                                      pool=cpu_pool,
-                                      shuffle=True,
-                                      batchifier=train_batchifier)
+            train_iterator = scheduler.get(epoch, "train", state=xp_manager.get_iterator_state(epoch))
+            train_iterator = xp_manager.checkpoint_iterator(train_iterator, sess, qgen_saver, epoch=epoch, no_batches=args.ckpt_every)
 
             [train_accuracy, _] = game_engine.process(sess, train_iterator,
                                                       optimizer=optimizer,
                                                       mode="sampling")
 
-            valid_iterator = Iterator(validset, pool=cpu_pool,
-                                      batch_size=batch_size,
-                                      batchifier=eval_batchifier,
-                                      shuffle=False)
+            valid_iterator = scheduler.get(epoch, "valid")
             [val_accuracy, games] = game_engine.process(sess, valid_iterator, mode="sampling")
 
             logger.info("Accuracy (train - sampling) : {}".format(train_accuracy))
             logger.info("Accuracy (valid - sampling) : {}".format(val_accuracy))
+            logger.info("Training data : {}".format(format_prefetch_stats(train_iterator.get_prefetch_stats())))
+            logger.info("Tokenizer cache (main process) : {}".format(tokenizer.get_cache_stats()))
             # val_accuracy = train_accuracy
 
             xp_manager.save_checkpoint(sess, qgen_saver,
@@ -267,11 +285,12 @@ if __name__ == '__main__':
                                            valid_accuracy=val_accuracy,
                                        ))
 
+        scheduler.close()
+
         logger.info(">>>-------------- FINAL SCORE ---------------------<<<")
 
         # Load early stopping
         xp_manager.load_checkpoint(sess, qgen_saver, load_best=True)
-        cpu_pool = create_cpu_pool(args.no_thread, use_process=image_builder.require_multiprocess())
 
         logger.info(">>>  New Objects  <<<")
         compute_qgen_accuracy(sess, trainset, batchifier=train_batchifier, looper=game_engine,
@@ -6,16 +6,19 @@ from distutils.util import strtobool
 
 import tensorflow as tf
 
+from generic.data_provider.epoch_scheduler import EpochScheduler
 from generic.data_provider.iterator import Iterator
+from generic.data_provider.prefetcher import format_prefetch_stats
 from generic.tf_utils.evaluator import Evaluator
 from generic.tf_utils.optimizer import create_optimizer
 from generic.utils.config import load_config, get_config_from_xp
 from generic.data_provider.image_loader import get_img_builder, _create_image_builder_rcnn
 from generic.data_provider.nlp_utils import GloveEmbeddings
-from generic.utils.thread_pool import create_cpu_pool
+from generic.utils.thread_pool import CpuPool
 from guesswhat.train.eval_listener import QGenListener
 
-from guesswhat.data_provider.guesswhat_dataset import Dataset
+from guesswhat.data_provider.guesswhat_dataset import Dataset, StreamingDataset
+from guesswhat.data_provider.question_store import QuestionTokenStore
 from guesswhat.data_provider.guesswhat_tokenizer import GWTokenizer
 from guesswhat.models.qgen.qgen_factory import create_qgen
 from guesswhat.models.guesser.guesser_factory import create_guesser
@@ -43,15 +46,24 @@ if __name__ == '__main__':
     parser.add_argument("-out_dir", default="out/qgen", type=str, help="Directory in which experiments are stored")
     parser.add_argument("-config", type=str, default="config/qgen/config.rnn.json", help='Config file')
     parser.add_argument("-dict_file", type=str, default="data/dict.json", help="Dictionary file name")
+    parser.add_argument("-tokenizer", type=str, default="nltk", choices=["nltk", "regex"], help="Word tokenizer (regex: faster equivalent of nltk TweetTokenizer, opt-in)")
     parser.add_argument("-glove_file", type=str, default="glove_dict.pkl", help="Glove file name")
     parser.add_argument("-img_dir", type=str, default='data/features/vgg16/image.hdf5', help='Directory with images')
     parser.add_argument("-load_checkpoint", type=str, help="Load model parameters from specified checkpoint")
     parser.add_argument("-continue_exp", type=lambda x: bool(strtobool(x)), default="False", help="Continue previously started experiment?")
     parser.add_argument("-gpu_ratio", type=float, default=0.95, help="How many GPU ram is required? (ratio)")
     parser.add_argument("-no_thread", type=int, default=4, help="No thread to load batch")
+    parser.add_argument("-ckpt_every", type=int, default=0, help="Save a checkpoint every N training batches to resume an interrupted epoch (0: end of epoch only)")
+    parser.add_argument("-bucketing", type=lambda x: bool(strtobool(x)), default="False", help="Group the training games of similar sizes into the same batches?")
+    parser.add_argument("-max_tokens", type=int, default=None, help="Cap the padded size of the training batches (with bucketing)")
     parser.add_argument("-train_epoch", type=int, default=40)
     parser.add_argument("-early_stop", type=int, default=5)
     parser.add_argument("-no_games_to_load", type=int, default=float("inf"), help="No games to use during training Default : all")
+    parser.add_argument("-use_cache", type=lambda x: bool(strtobool(x)), default="False", help="Cache the parsed dataset on disk?")
+    parser.add_argument("-cache_dir", type=str, default=None, help="Directory of the dataset cache (Default: next to the dataset files)")
+    parser.add_argument("-token_store", type=str, default=None, help="Directory of the pre-tokenized questions, built if missing or outdated (Default: questions are tokenized on the fly)")
+    parser.add_argument("-stream_dataset", type=lambda x: bool(strtobool(x)), default="False", help="Stream the games from disk instead of loading them in memory?")
+    parser.add_argument("-num_workers", type=int, default=0, help="No process to parse the dataset (0: main process only)")
     parser.add_argument("-skip_training",  type=lambda x: bool(strtobool(x)), default="False", help="Start from checkpoint?")
     parser.add_argument("-load_new",  type=lambda x: bool(strtobool(x)), default="True", help="Start from checkpoint?")
 
@@ -82,16 +94,24 @@ if __name__ == '__main__':
         logger.info('Loading images..')
         image_builder = get_img_builder(config['model']['image'], args.img_dir)
         use_resnet = image_builder.is_raw_image()
+        use_multiproc = image_builder.require_multiprocess()
 
     # Load data
     logger.info('Loading data..')
-    trainset = Dataset(args.data_dir, "train", image_builder, crop_builder, rcnn, args.no_games_to_load)
-    validset = Dataset(args.data_dir, "valid", image_builder, crop_builder, rcnn, args.no_games_to_load)
-    testset = Dataset(args.data_dir, "test", image_builder, crop_builder, rcnn, args.no_games_to_load)
+    dataset_cstor = StreamingDataset if args.stream_dataset else Dataset
+    trainset = dataset_cstor(args.data_dir, "train", image_builder, crop_builder, rcnn, args.no_games_to_load, use_cache=args.use_cache, cache_dir=args.cache_dir, num_workers=args.num_workers)
+    validset = dataset_cstor(args.data_dir, "valid", image_builder, crop_builder, rcnn, args.no_games_to_load, use_cache=args.use_cache, cache_dir=args.cache_dir, num_workers=args.num_workers)
+    testset = dataset_cstor(args.data_dir, "test", image_builder, crop_builder, rcnn, args.no_games_to_load, use_cache=args.use_cache, cache_dir=args.cache_dir, num_workers=args.num_workers)
 
     # Load dictionary
     logger.info('Loading dictionary..')
-    tokenizer = GWTokenizer(args.dict_file)
+    tokenizer = GWTokenizer(args.dict_file, word_tokenizer=args.tokenizer)
+
+    # Load pre-tokenized questions
+    token_store = None
+    if args.token_store is not None:
+        logger.info('Loading question tokens..')
+        token_store = QuestionTokenStore.load_or_build([trainset, validset, testset], tokenizer, args.token_store)
 
     # Build Network
     logger.info('Building network..')
@@ -112,6 +132,9 @@ if __name__ == '__main__':
     config_gpu = tf.ConfigProto()
     config_gpu.gpu_options.allow_growth = True
 
+    # The same workers are used by all the iterators of the run (training, test and loop)
+    cpu_pool = CpuPool(args.no_thread, use_process=use_multiproc)
+
     with tf.Session(config=config_gpu) as sess:
 
         sources = network.get_sources(sess)
@@ -125,31 +148,36 @@ if __name__ == '__main__':
 
         # create training tools
         evaluator = Evaluator(sources, network.scope_name, network=network, tokenizer=tokenizer)
-        batchifier = batchifier_cstor(tokenizer, sources, status=('success',), supervised=True)
+        batchifier = batchifier_cstor(tokenizer, sources, status=('success',), supervised=True, token_store=token_store)
         xp_manager.configure_score_tracking("valid_loss", max_is_best=False)
 
         idx, _, _, _ = network.create_greedy_graph(start_token=tokenizer.start_token, stop_token=tokenizer.stop_token, max_tokens=10)
         listener = QGenListener(require=idx)
 
+        # The iterator of the next phase/epoch is prepared in advance, with one seed per epoch (cf. epoch_scheduler.py)
+        scheduler = EpochScheduler(seed=config.get("seed", -1), no_epoch=no_epoch)
+        scheduler.add_phase("train", lambda seed, state=None: Iterator(trainset,
+                                                                       batch_size=batch_size, pool=cpu_pool,
+                                                                       batchifier=batchifier,
+                                                                       shuffle=True, seed=seed, state=state,
+                                                                       bucketing=args.bucketing, max_tokens=args.max_tokens))
+        scheduler.add_phase("valid", lambda seed: Iterator(validset, pool=cpu_pool,
+                                                           batch_size=batch_size*2,
+                                                           batchifier=batchifier,
+                                                           shuffle=False, seed=seed))
+
         for t in range(start_epoch, no_epoch):
             if args.skip_training:
                 logger.info("Skip training...")
                 break
             logger.info('Epoch {}..'.format(t + 1))
 
-            # Create cpu pools (at each iteration otherwise threads may become zombie - python bug)
-            cpu_pool = create_cpu_pool(args.no_thread, use_process=image_builder.require_multiprocess())
-
-            train_iterator = Iterator(trainset,
-                                      batch_size=batch_size, pool=cpu_pool,
-                                      batchifier=batchifier,
-                                      shuffle=True)
+            train_iterator = scheduler.get(t, "train", state=xp_manager.get_iterator_state(t))
+            train_iterator = xp_manager.checkpoint_iterator(train_iterator, sess, saver, epoch=t, no_batches=args.ckpt_every)
             [train_loss, _] = evaluator.process(sess, train_iterator, outputs=outputs + [optimizer])
+            logger.info("Training data   : {}".format(format_prefetch_stats(evaluator.get_data_stats())))
 
-            valid_iterator = Iterator(validset, pool=cpu_pool,
-                                      batch_size=batch_size*2,
-                                      batchifier=batchifier,
-                                      shuffle=False)
+            valid_iterator = scheduler.get(t, "valid")
             [valid_loss] = evaluator.process(sess, valid_iterator, outputs=outputs, listener=listener)
 
             for qt in listener.get_questions()[:5]:
@@ -163,11 +191,11 @@ if __name__ == '__main__':
             if stop_flag >= args.early_stop:
                 logger.info("==================early stopping===================")
                 break
+        scheduler.close()
 
         # Load early stopping
         logger.info("==================test===================")
         xp_manager.load_checkpoint(sess, saver, load_best=True)
-        cpu_pool = create_cpu_pool(args.no_thread, use_process=use_multiproc)
 
         # Create Listener
         test_iterator = Iterator(testset, pool=cpu_pool,
@@ -190,7 +218,6 @@ if __name__ == '__main__':
         # compute the loop accuracy
         logger.info("==================loop===================")
         mode_to_evaluate = ["sampling", "greedy", "beam"]
-        cpu_pool = create_cpu_pool(args.no_thread, use_process=False)
 
         train_batchifier = LooperBatchifier(tokenizer, generate_new_games=True)
         eval_batchifier = LooperBatchifier(tokenizer, generate_new_games=False)
@@ -254,3 +281,4 @@ if __name__ == '__main__':
                               mode=mode_to_evaluate, cpu_pool=cpu_pool, batch_size=batch_size,
                               name="ini.new_images", save_path=xp_manager.dir_xp, store_games=True)
 
+    cpu_pool.close()
@@ -2,8 +2,10 @@ from __future__ import unicode_literals
 
 from generic.data_provider.iterator import Iterator
 from generic.tf_utils.evaluator import Evaluator
+from guesswhat.data_provider.game_writer import GameWriter, game_to_dict
 import logging
 import copy
+import os
 
 
 def test_one_model(sess, dataset, cpu_pool, batch_size, network, batchifier, loss, listener=None):
@@ -74,46 +76,8 @@ def compute_qgen_accuracy(sess, dataset, batchifier, looper, mode, cpu_pool, bat
 
 
 def dump_dataset(games, save_path, tokenizer, name="model"):
-    import gzip
-    import os
-    import json
-
-    with gzip.open(os.path.join(save_path, 'guesswhat.' + name + '.jsonl.gz'), 'wb') as f:
-
-        for _, game in enumerate(games):
-
-            sample = {}
-
-            qas = []
-            for id, question, answers in zip(game.question_ids, game.questions, game.answers):
-                qas.append({"question": question,
-                            "answer": answers,
-                            "id": id,
-                            "p": 0})
-
-            sample["id"] = game.dialogue_id
-            sample["qas"] = qas
-            sample["image"] = {
-                "id": game.image.id,
-                "width": game.image.width,
-                "height": game.image.height,
-                "coco_url": game.image.url
-            }
-
-            sample["objects"] = [{"id": o.id,
-                                  "category_id": o.category_id,
-                                  "category": o.category,
-                                  "area": o.area,
-                                  "bbox": o.bbox.coco_bbox,
-                                  "segment": o.segment,  # no segment to avoid making the file too big
-                                  } for o in game.objects]
-
-            sample["object_id"] = game.object.id
-            sample["guess_object_id"] = game.id_guess_object
-            sample["status"] = game.status
-
-            f.write(str(json.dumps(sample)).encode())
-            f.write(b'\n')
+    with GameWriter(os.path.join(save_path, 'guesswhat.' + name + '.jsonl.gz')) as writer:
+        writer.append([game_to_dict(game) for game in games])
 
 # def compute_qgen_accuracy(sess, dataset, batchifier, evaluator, mode, tokenizer, save_path, cpu_pool, batch_size, store_games, dump_suffix):
 #